@@ -0,0 +1,70 @@
+"""
+Startup benchmark for the ADK agents.
+Imports the agent package in fresh interpreters, the same way `adk web` loads it, and reports
+the wall-clock import time, the slowest modules and whether heavy dependencies were loaded eagerly.
+
+Usage:
+    python bench_startup.py [--module manager] [--runs 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Dependencies that should only be imported on first use, not at agent load.
+DEFERRED_MODULES = ["firebase_admin", "google.cloud.firestore", "requests", "httpx"]
+
+
+def measure(module: str) -> float:
+    """Wall-clock seconds to import `module` in a fresh interpreter."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(module: str, top: int = 10) -> list:
+    """Modules with the largest cumulative import time, from `python -X importtime`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            check=True, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def eagerly_loaded(module: str) -> list:
+    """Which of DEFERRED_MODULES end up in sys.modules just from importing `module`."""
+    check = f"import sys, {module}; print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", check], check=True, capture_output=True, text=True)
+    return [name for name in result.stdout.strip().split(",") if name]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure agent import (startup) time")
+    parser.add_argument("--module", default="manager", help="Module to import")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh-interpreter runs")
+    args = parser.parse_args()
+
+    baseline = statistics.median(measure("sys") for _ in range(args.runs))
+    timings = [measure(args.module) for _ in range(args.runs)]
+
+    print(f"Import of '{args.module}' over {args.runs} runs (interpreter startup of {baseline * 1000:.0f} ms subtracted):")
+    print(f"  median {(statistics.median(timings) - baseline) * 1000:.0f} ms, "
+          f"min {(min(timings) - baseline) * 1000:.0f} ms, max {(max(timings) - baseline) * 1000:.0f} ms")
+
+    print("\nSlowest imports (cumulative):")
+    for cumulative, name in slowest_imports(args.module):
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    loaded = eagerly_loaded(args.module)
+    print(f"\nDeferred dependencies present after import (possibly pulled in by ADK itself): "
+          f"{', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,42 @@
-from google.adk.agents import Agent
-from ...sub_agents.receipt_processor.agent import get_data_from_firestore
+from typing import AsyncGenerator
+
+from google.adk.agents import Agent, BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.genai import types
+from ...sub_agents.receipt_processor.agent import get_data_from_firestore, get_spending_summary, stream_receipt_answer
+
+
+class ReceiptAnswerStreamer(BaseAgent):
+    """Answers the user's receipt question with streamGenerateContent, emitting partial events as text arrives."""
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        user_query = "".join(part.text or "" for part in (ctx.user_content.parts if ctx.user_content else []))
+        
+        chunks = []
+        async for text in stream_receipt_answer(user_query, ctx.user_id):
+            chunks.append(text)
+            yield Event(
+                author=self.name,
+                invocation_id=ctx.invocation_id,
+                branch=ctx.branch,
+                partial=True,
+                content=types.Content(role="model", parts=[types.Part(text=text)]),
+            )
+        
+        # The final, non-partial event carries the whole answer and is what gets stored in the session.
+        yield Event(
+            author=self.name,
+            invocation_id=ctx.invocation_id,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text="".join(chunks))]),
+        )
+
+
+receipt_answer_streamer = ReceiptAnswerStreamer(
+    name="receipt_answer_streamer",
+    description="Streams long answers about the user's receipts, such as spending summaries and breakdowns, as they are generated.",
+)
 
 query_execution = Agent(
     name="query_execution",
@@ -13,14 +50,21 @@ query_execution = Agent(
     You will call the tool `get_data_from_firestore` to retrieve data from Firebase Firestore.
     
     tools:
+    - get_spending_summary: Tool to answer aggregate spending questions (totals by month, category or merchant) from precomputed rollups.
     - get_data_from_firestore: Tool to execute queries on Firebase Firestore and retrieve information.
     
-    When the user asks for information related to receipts, call the tool `get_data_from_firestore` with the user's query.
+    When the user asks how much they spent (a total for a period, category or merchant), call the tool `get_spending_summary` with the user's query.
+    When the user asks for any other information related to receipts, call the tool `get_data_from_firestore` with the user's query.
+    When the user asks for a long answer such as a spending summary, report or breakdown, transfer to the agent `receipt_answer_streamer` so the answer is streamed as it is generated.
     
     If the user asks about any other topic delegate the task to manager agent.
     
     """,
     tools=[
+        get_spending_summary,
         get_data_from_firestore,
     ],
+    sub_agents=[
+        receipt_answer_streamer,
+    ],
 )
\ No newline at end of file
@@ -1,22 +1,80 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 from google.adk.agents import Agent
-from typing import List, Optional
+from google.adk.tools.tool_context import ToolContext
+from typing import AsyncIterator, List, Optional
 from datetime import datetime
 from pydantic import BaseModel
-import requests
-import json
+import asyncio
+import threading
+from concurrent.futures import Future
 from dotenv import load_dotenv
+from google.api_core.exceptions import FailedPrecondition
 import os
 
+from .answer_cache import answer_cache
+from .firebase_client import get_db
+from .gemini_client import GeminiError, get_gemini_client
+from .prompt_format import serialize_receipts, shard_receipts
+from .query_planner import QueryConstraints, plan_query, searchable_fields
+from .receipt_mirror import ReceiptMirror
+from .rollups import is_aggregate_question, read_rollups, receipt_increments, rollup_keys_for, rollup_writes
+from .write_pipeline import CREATE, BatchWriter
+
 # Load environment variables
 load_dotenv()
 
-# Firebase Setup (replace with your Firebase Admin SDK credentials)
-cred = credentials.Certificate('manager/sub_agents/receipt_processor/cred.json')
-firebase_admin.initialize_app(cred)
-# Reference to Firestore
-db = firestore.client()
+# Firebase is initialized lazily by `get_db()` on the first tool call, not at import time.
+
+# Receipt writes are grouped into Firestore batch commits
+BATCH_MAX_OPS = int(os.getenv("FIRESTORE_BATCH_MAX_OPS", "500"))
+BATCH_FLUSH_INTERVAL = float(os.getenv("FIRESTORE_BATCH_FLUSH_INTERVAL", "0.02"))
+WRITE_TIMEOUT = float(os.getenv("FIRESTORE_WRITE_TIMEOUT", "30"))
+
+# Receipt histories larger than one prompt are answered map-reduce style over shards
+MAP_REDUCE_WORKERS = int(os.getenv("RECEIPT_MAP_REDUCE_WORKERS", "4"))
+MAP_REDUCE_MAX_SHARDS = int(os.getenv("RECEIPT_MAP_REDUCE_MAX_SHARDS", "32"))
+
+# Optional in-memory mirror of the receipts collection, kept current by snapshot listeners.
+# Changes seen by the listener (including writes from other instances) invalidate cached answers.
+RECEIPT_MIRROR_ENABLED = os.getenv("RECEIPT_MIRROR_ENABLED", "").lower() in ("1", "true", "yes")
+
+_write_pipeline = None
+_receipt_mirror = None
+_lazy_lock = threading.Lock()
+_mirror_lock = threading.Lock()
+
+def get_write_pipeline() -> BatchWriter:
+    """Get or create the batched write pipeline (and with it the Firestore client)."""
+    global _write_pipeline
+    with _lazy_lock:
+        if _write_pipeline is None:
+            _write_pipeline = BatchWriter(get_db(), max_ops=BATCH_MAX_OPS, flush_interval=BATCH_FLUSH_INTERVAL)
+        return _write_pipeline
+
+def get_receipt_mirror() -> Optional[ReceiptMirror]:
+    """Get or create the receipt mirror, or None when it is disabled."""
+    global _receipt_mirror
+    if not RECEIPT_MIRROR_ENABLED:
+        return None
+    if _receipt_mirror is None:
+        # Not under _lazy_lock: connecting to Firestore here must not hold up the write pipeline
+        with _mirror_lock:
+            if _receipt_mirror is None:
+                _receipt_mirror = ReceiptMirror(
+                    get_db(),
+                    max_users=int(os.getenv("RECEIPT_MIRROR_MAX_USERS", "100")),
+                    on_change=answer_cache.bump_version,
+                )
+    return _receipt_mirror
+
+def preload_receipt_mirror():
+    """Subscribe the users in RECEIPT_MIRROR_PRELOAD_USERS at startup; their partitions load in the background."""
+    receipt_mirror = get_receipt_mirror()
+    if receipt_mirror is not None:
+        receipt_mirror.start(user for user in os.getenv("RECEIPT_MIRROR_PRELOAD_USERS", "").split(",") if user)
+
+if RECEIPT_MIRROR_ENABLED:
+    # Off the import path, so loading the agents stays fast (see firebase_client.get_db)
+    threading.Thread(target=preload_receipt_mirror, name="receipt-mirror-preload", daemon=True).start()
 
 
 class ReceiptItem(BaseModel):
@@ -44,83 +102,318 @@ class ReceiptData(BaseModel):
     cashier: Optional[str] = None
     created_at: str = datetime.now().isoformat()  # Changed from datetime
 
-def store_receipt_data(receipt_data: dict) -> bool:
-    """Store receipt data in Firebase Firestore."""
+def get_user_id(tool_context: Optional[ToolContext]) -> str:
+    """Resolve the ADK session's user, falling back to "anonymous" outside of an agent run."""
+    if tool_context is None:
+        return "anonymous"
+    return tool_context._invocation_context.user_id or "anonymous"
+
+def submit_receipt(receipt_data: dict, user_id: str) -> Future:
+    """
+    Validate a receipt and queue it, together with its rollup increments, on the batched write pipeline.
     
+    Returns a Future resolving to the new document's ID once its batch has committed.
+    
+    Args:
+        receipt_data (dict): Receipt in the `ReceiptData` format.
+        user_id (str): Owner of the receipt.
+    """
     # Convert dict to Pydantic model
     parsed_data = ReceiptData(**receipt_data)
     
-    # Create a document reference
+    # Create a document reference; the ID is assigned client-side
+    db = get_db()
     receipt_ref = db.collection('receipts').document()
     
-    # Store the data
-    receipt_ref.set(parsed_data.dict())
-    print(f"Receipt data for {parsed_data.receipt_id} stored successfully.")
+    # Store the data along with the fields the query planner filters on
+    record = parsed_data.dict()
+    record.update(searchable_fields(record))
+    record['user_id'] = user_id
+    
+    # The receipt and its rollup increments commit atomically in the same batch. The receipt is created,
+    # not set, so retrying a batch that did commit cannot apply the increments twice.
+    writes = [(receipt_ref, record, CREATE)] + rollup_writes(db, user_id, receipt_increments(record))
+    future = get_write_pipeline().submit(writes)
+    future.add_done_callback(lambda done: done.exception() is None and answer_cache.bump_version(user_id))
+    return future
+
+async def store_receipt_data(receipt_data: dict, tool_context: ToolContext) -> bool:
+    """Store receipt data in Firebase Firestore and update the user's spending rollups."""
+    
+    future = submit_receipt(receipt_data, get_user_id(tool_context))
+    # Shielded so a timeout stops waiting without cancelling a write that may already be committing
+    await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), WRITE_TIMEOUT)
+    print(f"Receipt data for {receipt_data.get('receipt_id')} stored successfully.")
     
     return True
 
-# Get all receipt data from Firestore
-def get_data_from_firestore(user_query: str) -> str:
+def import_receipts(receipts: List[dict], user_id: str) -> List[dict]:
+    """
+    Bulk-store receipts through the write pipeline, which packs them into as few batch commits as possible.
+    
+    Args:
+        receipts (list): Receipts in the `ReceiptData` format.
+        user_id (str): Owner of the receipts.
+    """
+    futures = [submit_receipt(receipt, user_id) for receipt in receipts]
+    results = []
+    for future in futures:
+        try:
+            results.append({"success": True, "document_id": future.result(WRITE_TIMEOUT)})
+        except Exception as e:
+            results.append({"success": False, "error": str(e), "document_id": None})
+    return results
+
+def fetch_receipts(constraints: QueryConstraints, user_id: str) -> list:
+    """
+    Fetch the user's receipts that can satisfy the given constraints.
+    
+    Only the owner and the date range are pushed down to Firestore (with the latest-N limit when
+    nothing else narrows the result); amounts are filtered in memory afterwards. Merchant and
+    category only order the receipts, since they are matched loosely against free-form stored values.
+    When the in-memory receipt mirror is enabled, the user's receipts are filtered from memory instead.
+    Owner plus date needs the composite index in `firestore.indexes.json`; while it is missing, all of
+    the user's receipts are read and filtered in memory.
+    
+    Args:
+        constraints (QueryConstraints): Filters produced by `plan_query`.
+        user_id (str): Owner of the receipts.
+    """
+    receipt_mirror = get_receipt_mirror()
+    if receipt_mirror is not None:
+        mirrored = receipt_mirror.receipts(user_id)
+        if mirrored is not None:
+            return constraints.apply(mirrored)
+    
+    owned = get_db().collection('receipts').where('user_id', '==', user_id)
+    query = owned
+    if constraints.start_date:
+        query = query.where('transaction_date', '>=', constraints.start_date)
+    if constraints.end_date:
+        query = query.where('transaction_date', '<=', constraints.end_date)
+    
+    # A limit can only be pushed down as "the latest N" when nothing else decides which N.
+    has_amount_range = constraints.min_amount is not None or constraints.max_amount is not None
+    if constraints.limit and not (has_amount_range or constraints.merchant or constraints.category):
+        query = query.order_by('transaction_date', direction='DESCENDING').limit(constraints.limit)
+    
+    try:
+        receipts = [doc.to_dict() for doc in query.stream()]
+    except FailedPrecondition as e:
+        print(f"Missing Firestore index for receipt query, filtering in memory: {e}")
+        receipts = [doc.to_dict() for doc in owned.stream()]
+    return constraints.apply(receipts)
+
+async def get_data_from_firestore(user_query: str, tool_context: ToolContext) -> str:
     """
     Gets a query from the user.
-    Retrieve all receipt data from Firebase Firestore and filter based on user query and generate an answer using LLM.
+    Plan the query into structured filters, retrieve only the matching receipt data from Firebase Firestore and generate an answer using LLM.
+    Histories too large for a single prompt are answered map-reduce style over shards of receipts.
     
     Args:
         user_query (str): The query string to filter the receipts and answer with the help of LLM.
     """
-    receipts_ref = db.collection('receipts')
-    docs = receipts_ref.stream()
+    user_id = get_user_id(tool_context)
+    # Read before fetching, so an answer computed from receipts that change meanwhile is not cached
+    version = answer_cache.version(user_id)
+    cached = answer_cache.get(user_id, user_query, version=version)
+    if cached is not None:
+        return cached
     
-    # Convert the docs into a string format
-    receipt_data = []
-    for doc in docs:
-        receipt = doc.to_dict()
-        receipt_data.append(receipt)
+    constraints = plan_query(user_query)
+    receipt_data = await asyncio.to_thread(fetch_receipts, constraints, user_id)
         
-    prompt = f"User Query: {user_query}\n\nReceipt Data:\n{json.dumps(receipt_data, indent=2)}\n\nGenerate a response based on the user query and the receipt data."
+    shards = shard_receipts(receipt_data)
+    if len(shards) > 1:
+        generated_text = await answer_with_map_reduce(user_query, shards)
+    else:
+        generated_text = await generate_text(receipt_prompt(
+            user_query, receipt_data, "Generate a response based on the user query and the receipt data."
+        ))
     
-    # Read the API key from environment
-    API_KEY = os.getenv("GOOGLE_API_KEY")
+    if generated_text is None:
+        return {
+            "response": "An error occurred while processing your request."
+        }
+    answer = {
+        "response": generated_text
+    }
+    answer_cache.put(user_id, user_query, answer, version)
+    return answer
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
+def receipt_prompt(user_query: str, receipts: list, instruction: str) -> str:
+    """Build a prompt with the user's query and the receipts rendered as compact tables."""
+    return (
+        f"User Query: {user_query}\n\n"
+        f"Receipt Data (pipe-separated tables; items reference receipts by #, empty cells are unknown):\n"
+        f"{serialize_receipts(receipts, user_query)}\n\n"
+        f"{instruction}"
+    )
 
-    headers = {
-        "Content-Type": "application/json"
-    }
+async def generate_text(prompt: str) -> Optional[str]:
+    """
+    Send a single prompt to Gemini through the shared client and return the generated text, or None if the call failed.
+    
+    Args:
+        prompt (str): The full prompt text.
+    """
+    try:
+        return await get_gemini_client().agenerate(prompt)
+    except GeminiError as e:
+        print(f"Gemini request failed: {e}")
+        return None
 
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
-    }
+async def map_reduce_prompt(user_query: str, shards: List[list]) -> Optional[str]:
+    """
+    Run the map phase for a receipt history too large for one prompt and build the reduce prompt.
+    
+    Each shard is asked for a partial answer concurrently, at most MAP_REDUCE_WORKERS at a time. The
+    returned prompt asks Gemini to combine the partial answers; None means every shard failed.
+    
+    Args:
+        user_query (str): The user's question.
+        shards (list): Chronological receipt shards from `shard_receipts`.
+    """
+    omitted = max(0, len(shards) - MAP_REDUCE_MAX_SHARDS)
+    if omitted:
+        # Keep the most recent history; it is what most questions are about.
+        shards = shards[-MAP_REDUCE_MAX_SHARDS:]
+    
+    map_instruction = (
+        "This is only one slice of the user's receipt history. Answer the query for this slice alone. "
+        "State exact figures (totals, counts, dates, merchants) so they can be combined with other slices; "
+        "say 'no relevant receipts' if nothing in this slice applies."
+    )
+    prompts = [receipt_prompt(user_query, shard, map_instruction) for shard in shards]
+    limiter = asyncio.Semaphore(MAP_REDUCE_WORKERS)
+    
+    async def answer_shard(prompt: str) -> Optional[str]:
+        async with limiter:
+            return await generate_text(prompt)
+    
+    partial_answers = await asyncio.gather(*(answer_shard(prompt) for prompt in prompts))
+    
+    answered = [(shard, answer) for shard, answer in zip(shards, partial_answers) if answer is not None]
+    if not answered:
+        return None
+    
+    sections = []
+    for shard, answer in answered:
+        first, last = shard[0].get('transaction_date'), shard[-1].get('transaction_date')
+        sections.append(f"Receipts from {first} to {last} ({len(shard)} receipts):\n{answer}")
+    failed = len(shards) - len(answered)
+    notes = []
+    if failed:
+        notes.append(f"{failed} slice(s) of the history could not be analysed.")
+    if omitted:
+        notes.append(f"The {omitted} oldest slice(s) of the history were not analysed.")
+    
+    reduce_prompt = (
+        f"User Query: {user_query}\n\n"
+        "The user's receipt history was split into chronological slices and the query was answered for each slice. "
+        "Combine these partial answers into one final answer: add up totals and counts, and merge lists.\n\n"
+        + "\n\n".join(sections)
+        + ("\n\n" + " ".join(notes) + " Mention this in the answer." if notes else "")
+    )
+    return reduce_prompt
 
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
+async def answer_with_map_reduce(user_query: str, shards: List[list]) -> Optional[str]:
+    """
+    Answer a query over a receipt history too large for one prompt by combining per-shard partial answers.
+    
+    Args:
+        user_query (str): The user's question.
+        shards (list): Chronological receipt shards from `shard_receipts`.
+    """
+    reduce_prompt = await map_reduce_prompt(user_query, shards)
+    if reduce_prompt is None:
+        return None
+    return await generate_text(reduce_prompt)
 
-    if response.status_code == 200:
-        data = response.json()
-        try:
-            generated_text = data['candidates'][0]['content']['parts'][0]['text']
-            return {
-                "response": generated_text.strip()
-            }
-        except (KeyError, IndexError):
-            print("Unexpected response format:", data)
-            return {
-                "response": "An error occurred while processing the response."
-            }
+async def stream_receipt_answer(user_query: str, user_id: str) -> AsyncIterator[str]:
+    """
+    Answer a receipt question like `get_data_from_firestore`, yielding the text as Gemini streams it.
+    For histories answered map-reduce style only the final reduce step is streamed.
+    
+    Args:
+        user_query (str): The user's question.
+        user_id (str): Owner of the receipts.
+    """
+    version = answer_cache.version(user_id)
+    cached = answer_cache.get(user_id, user_query, version=version)
+    if cached is not None:
+        yield cached["response"]
+        return
+    
+    constraints = plan_query(user_query)
+    receipt_data = await asyncio.to_thread(fetch_receipts, constraints, user_id)
+    
+    shards = shard_receipts(receipt_data)
+    if len(shards) > 1:
+        prompt = await map_reduce_prompt(user_query, shards)
     else:
-        print("Request failed:", response.status_code)
-        print(response.text)
-        return {
-            "response": "An error occurred while processing your request."
-        }
+        prompt = receipt_prompt(user_query, receipt_data, "Generate a response based on the user query and the receipt data.")
     
+    chunks = []
+    complete = False
+    try:
+        if prompt is not None:
+            async for text in get_gemini_client().astream(prompt):
+                chunks.append(text)
+                yield text
+            complete = True
+    except GeminiError as e:
+        print(f"Gemini streaming request failed: {e}")
+    if not chunks:
+        yield "An error occurred while processing your request."
+    elif complete:
+        # Only complete answers are cached; a partial one is shown but not remembered.
+        answer_cache.put(user_id, user_query, {"response": "".join(chunks).strip()}, version)
+
+
+async def get_spending_summary(user_query: str, tool_context: ToolContext) -> dict:
+    """
+    Answer aggregate spending questions ("how much did I spend on groceries in March") from the
+    precomputed spending rollups without reading receipts or calling the LLM.
+    Free-form questions, aggregates the rollups cannot express, and aggregates with no rolled-up
+    receipts (e.g. stored before the rollups were backfilled) fall back to `get_data_from_firestore`.
+    
+    Args:
+        user_query (str): The user's question about their spending.
+    """
+    constraints = plan_query(user_query)
+    keys = rollup_keys_for(constraints) if is_aggregate_question(user_query) else None
+    if keys is None:
+        return await get_data_from_firestore(user_query, tool_context)
+    
+    user_id = get_user_id(tool_context)
+    version = answer_cache.version(user_id)
+    cached = answer_cache.get(user_id, user_query, namespace="summary", version=version)
+    if cached is not None:
+        return cached
+    
+    total, count = await asyncio.to_thread(read_rollups, get_db(), user_id, keys)
+    if count == 0:
+        # No rollup document means nothing was counted, not that nothing was spent
+        return await get_data_from_firestore(user_query, tool_context)
+    
+    scope = []
+    if constraints.category:
+        scope.append(f"on {constraints.category}")
+    if constraints.merchant:
+        scope.append(f"at {constraints.merchant}")
+    if constraints.start_date:
+        scope.append(f"between {constraints.start_date} and {constraints.end_date}")
+    description = " ".join(scope) or "in total"
+    
+    answer = {
+        "response": f"You spent {total:.2f} {description} across {count} receipt(s).",
+        "total": total,
+        "count": count,
+    }
+    answer_cache.put(user_id, user_query, answer, version, namespace="summary")
+    return answer
+
 
 
 
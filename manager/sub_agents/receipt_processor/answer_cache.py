@@ -0,0 +1,119 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Optional
+
+
+def normalize_query(user_query: str) -> str:
+    """Case-, punctuation- and whitespace-insensitive form of a question, used as the cache key."""
+    return " ".join(re.sub(r"[^\w$€£₹.]+", " ", user_query.lower()).split()).strip(" .")
+
+
+class AnswerCache:
+    """
+    LRU cache with a TTL for answers to receipt questions.
+
+    Entries are keyed by namespace (the tool that produced the answer), user, normalized query,
+    the user's receipts version and today's date (so "this month" rolls over). Storing a receipt
+    bumps the user's version, which makes every older answer for that user unreachable; those
+    entries then age out through LRU or TTL.
+    Versions are per process, so the TTL bounds staleness across instances.
+    `stats()` is printed every `stats_every` lookups.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300.0, stats_every: int = 1000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats_every = stats_every
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def version(self, user_id: str) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def bump_version(self, user_id: str) -> int:
+        """Invalidate every cached answer for the user; called whenever their receipts change."""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            return self._versions[user_id]
+
+    def _key(self, namespace: str, user_id: str, user_query: str, version: int) -> tuple:
+        return namespace, user_id, normalize_query(user_query), version, date.today().isoformat()
+
+    def get(self, user_id: str, user_query: str, namespace: str = "answer", version: Optional[int] = None) -> Optional[dict]:
+        """
+        The cached answer to the question, or None.
+
+        Args:
+            version (int): Receipts version from `version()`, read before fetching the receipts the answer
+                will be computed from; defaults to the current one.
+        """
+        answer, lookups = self._lookup(user_id, user_query, namespace, version)
+        if self.stats_every and lookups % self.stats_every == 0:
+            print(f"Receipt answer cache after {lookups} lookups: {self.stats()}")
+        return answer
+
+    def _lookup(self, user_id: str, user_query: str, namespace: str, version: Optional[int]) -> tuple:
+        """The cached answer (or None) and the number of lookups so far, this one included."""
+        with self._lock:
+            if version is None:
+                version = self._versions.get(user_id, 0)
+            key = self._key(namespace, user_id, user_query, version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, self.hits + self.misses
+            stored_at, answer = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None, self.hits + self.misses
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return answer, self.hits + self.misses
+
+    def put(self, user_id: str, user_query: str, answer: dict, version: int, namespace: str = "answer") -> None:
+        """
+        Cache an answer under the receipts version it was computed from.
+
+        Args:
+            version (int): The receipts version read before the answer's receipts were fetched. If receipts
+                changed since, the answer may be stale and is not stored.
+        """
+        with self._lock:
+            if version != self._versions.get(user_id, 0):
+                return
+            key = self._key(namespace, user_id, user_query, version)
+            self._entries[key] = (time.monotonic(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("RECEIPT_ANSWER_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("RECEIPT_ANSWER_CACHE_TTL", "300")),
+    stats_every=int(os.getenv("RECEIPT_ANSWER_CACHE_STATS_EVERY", "1000")),
+)
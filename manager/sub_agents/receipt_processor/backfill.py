@@ -0,0 +1,153 @@
+"""
+Migrate receipts stored before the query and rollup fields existed.
+
+Receipts without `user_id` are assigned to the given owner, and their amounts are added to the
+owner's spending rollups in the same batch. Receipts whose `merchant_key`/`categories` are missing or
+were derived with an older normalization get the current search fields. Each receipt is updated with
+a precondition on its last update time, and tagged receipts are skipped, so the migration can be
+re-run safely and never counts a receipt twice.
+
+With --rebuild-rollups every spending rollup is then deleted and recomputed from the receipts, which
+rekeys rollups written before merchants and categories were normalized. Stop the agent while it runs:
+receipts stored during the rebuild may be counted twice or not at all.
+
+Usage:
+    python -m manager.sub_agents.receipt_processor.backfill --owner <user_id> [--dry-run] [--rebuild-rollups]
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+from .firebase_client import get_db
+from .query_planner import searchable_fields
+from .rollups import ROLLUP_COLLECTION, receipt_increments, rollup_doc_id, rollup_writes
+
+# Firestore accepts at most 500 writes per batch
+MAX_BATCH_OPS = 500
+
+
+def receipt_updates(receipt: dict, owner: str) -> dict:
+    """
+    Fields a stored receipt is missing, or an empty dict if it is already migrated.
+
+    Args:
+        receipt (dict): The stored receipt.
+        owner (str): User ID given to receipts that have none.
+    """
+    updates = {}
+    if not receipt.get('user_id'):
+        updates['user_id'] = owner
+    fields = searchable_fields(receipt)
+    if any(receipt.get(name) != value for name, value in fields.items()):
+        updates.update(fields)
+    return updates
+
+
+def backfill(db, owner: str, dry_run: bool = False) -> dict:
+    """
+    Migrate every receipt in the collection.
+
+    Args:
+        db: Firestore client.
+        owner (str): User ID given to receipts that have none.
+        dry_run (bool): Only count the receipts that would change.
+    """
+    stats = {"scanned": 0, "tagged": 0, "indexed": 0}
+    batch, ops = db.batch(), 0
+    for snapshot in db.collection('receipts').stream():
+        stats["scanned"] += 1
+        receipt = snapshot.to_dict()
+        updates = receipt_updates(receipt, owner)
+        if not updates:
+            continue
+        writes = []
+        if 'user_id' in updates:
+            stats["tagged"] += 1
+            # Untagged receipts predate the rollups, so none of their amounts have been counted yet
+            writes = rollup_writes(db, owner, receipt_increments({**receipt, **updates}))
+        if 'merchant_key' in updates:
+            stats["indexed"] += 1
+        if dry_run:
+            continue
+        if ops + 1 + len(writes) > MAX_BATCH_OPS:
+            batch.commit()
+            batch, ops = db.batch(), 0
+        batch.update(snapshot.reference, updates, option=db.write_option(last_update_time=snapshot.update_time))
+        for ref, data, merge in writes:
+            batch.set(ref, data, merge=merge)
+        ops += 1 + len(writes)
+    if ops:
+        batch.commit()
+    return stats
+
+
+def rebuild_rollups(db, dry_run: bool = False) -> dict:
+    """
+    Replace every spending rollup with totals recomputed from the owned receipts.
+
+    Args:
+        db: Firestore client.
+        dry_run (bool): Only count the rollups that would be deleted and written.
+    """
+    rollups = defaultdict(lambda: {"total": 0.0, "count": 0})
+    for snapshot in db.collection('receipts').stream():
+        receipt = snapshot.to_dict()
+        if not receipt.get('user_id'):
+            continue
+        for (dimension, key), amount in receipt_increments(receipt).items():
+            rollup = rollups[(receipt['user_id'], dimension, key)]
+            rollup["total"] += amount
+            rollup["count"] += 1
+
+    stale = list(db.collection(ROLLUP_COLLECTION).stream())
+    stats = {"deleted": len(stale), "written": len(rollups)}
+    if dry_run:
+        return stats
+
+    # Deleted first, so a document whose key survives the rebuild is not removed after being rewritten
+    for start in range(0, len(stale), MAX_BATCH_OPS):
+        batch = db.batch()
+        for snapshot in stale[start:start + MAX_BATCH_OPS]:
+            batch.delete(snapshot.reference)
+        batch.commit()
+
+    now = datetime.utcnow().isoformat()
+    items = list(rollups.items())
+    for start in range(0, len(items), MAX_BATCH_OPS):
+        batch = db.batch()
+        for (user_id, dimension, key), rollup in items[start:start + MAX_BATCH_OPS]:
+            ref = db.collection(ROLLUP_COLLECTION).document(rollup_doc_id(user_id, dimension, key))
+            batch.set(ref, {
+                'user_id': user_id,
+                'dimension': dimension,
+                'key': key,
+                'total': round(rollup["total"], 2),
+                'count': rollup["count"],
+                'updated_at': now,
+            })
+        batch.commit()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill user_id, search fields and rollups for older receipts")
+    parser.add_argument("--owner", required=True, help="User ID that owns receipts stored without one")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    parser.add_argument("--rebuild-rollups", action="store_true",
+                        help="Recompute all spending rollups from the receipts (stop the agent first)")
+    args = parser.parse_args()
+
+    db = get_db()
+    stats = backfill(db, args.owner, dry_run=args.dry_run)
+    action = "Would update" if args.dry_run else "Updated"
+    print(f"Scanned {stats['scanned']} receipts. {action} {stats['tagged']} without an owner "
+          f"and {stats['indexed']} with missing or outdated search fields.")
+    if args.rebuild_rollups:
+        stats = rebuild_rollups(db, dry_run=args.dry_run)
+        action = "Would replace" if args.dry_run else "Replaced"
+        print(f"{action} {stats['deleted']} spending rollups with {stats['written']} recomputed from receipts.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import os
+import threading
+
+# Path to the Firebase Admin SDK credentials (replace with your own service account key)
+CREDENTIALS_PATH = os.getenv("FIREBASE_CREDENTIALS", "manager/sub_agents/receipt_processor/cred.json")
+
+_db = None
+_lock = threading.Lock()
+
+
+def get_db():
+    """
+    Return the shared Firestore client, initializing Firebase on first use.
+
+    `firebase_admin` is imported here rather than at module level so that loading the agents
+    (e.g. `adk web` startup) neither pays for gRPC channel setup nor fails when credentials are missing.
+    """
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                if not firebase_admin._apps:
+                    firebase_admin.initialize_app(credentials.Certificate(CREDENTIALS_PATH))
+                _db = firestore.client()
+    return _db
+
+
+def increment(value):
+    """Server-side `firestore.Increment` sentinel, imported lazily like the client."""
+    from firebase_admin import firestore
+
+    return firestore.Increment(value)
@@ -0,0 +1,312 @@
+import asyncio
+import contextlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from typing import AsyncIterator, NamedTuple, Optional
+
+
+# Point this at a local stub server to benchmark without calling Gemini.
+DEFAULT_BASE_URL = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+DEFAULT_MODEL = os.getenv("GEMINI_TOOL_MODEL", "gemini-2.0-flash")
+
+# Status codes worth retrying: rate limiting and transient server errors.
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def _httpx_error():
+    # httpx is only imported once the async transport is actually used.
+    import httpx
+
+    return httpx.HTTPError
+
+
+class GeminiError(Exception):
+    """Raised when a Gemini call fails after all retries or returns an unusable response."""
+
+
+class HTTPResponse(NamedTuple):
+    status_code: int
+    text: str
+    headers: dict
+
+
+class RequestsTransport:
+    """Blocking HTTP layer on a keep-alive `requests.Session` with a bounded connection pool."""
+
+    def __init__(self, pool_size: int = 10):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def post(self, url: str, body: bytes, headers: dict, timeout: float) -> HTTPResponse:
+        response = self.session.post(url, data=body, headers=headers, timeout=timeout)
+        return HTTPResponse(response.status_code, response.text, dict(response.headers))
+
+    def close(self):
+        self.session.close()
+
+
+class HttpxAsyncTransport:
+    """Non-blocking HTTP layer on a pooled `httpx.AsyncClient`."""
+
+    def __init__(self, pool_size: int = 10):
+        import httpx
+
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    async def post(self, url: str, body: bytes, headers: dict, timeout: float) -> HTTPResponse:
+        response = await self.client.post(url, content=body, headers=headers, timeout=timeout)
+        return HTTPResponse(response.status_code, response.text, dict(response.headers))
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, body: bytes, headers: dict, timeout: float):
+        """Yield the streaming response; it exposes `status_code`, `headers`, `aread()` and `aiter_lines()`."""
+        async with self.client.stream("POST", url, content=body, headers=headers, timeout=timeout) as response:
+            yield response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+class GeminiClient:
+    """
+    Shared client for the `generateContent` REST endpoint used by the receipt tools.
+
+    Connections are pooled and kept alive, every call has an overall deadline, 429/5xx responses and
+    connection errors are retried with jittered exponential backoff, and the number of in-flight calls
+    is capped (per event loop for async calls, which each get their own connection pool). The sync and
+    async transports can be swapped, e.g. for a local stub server.
+    """
+
+    def __init__(
+        self,
+        model: str = DEFAULT_MODEL,
+        api_key: Optional[str] = None,
+        base_url: str = DEFAULT_BASE_URL,
+        transport=None,
+        async_transport=None,
+        request_timeout: float = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "30")),
+        deadline: float = float(os.getenv("GEMINI_DEADLINE", "60")),
+        max_retries: int = int(os.getenv("GEMINI_MAX_RETRIES", "4")),
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        max_concurrency: int = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+    ):
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.request_timeout = request_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._async_transport = async_transport
+        self._sync_limiter = threading.BoundedSemaphore(max_concurrency)
+        # Event loop -> (async transport, limiter); dropped when the loop is garbage collected
+        self._loop_state = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def transport(self):
+        with self._lock:
+            if self._transport is None:
+                self._transport = RequestsTransport(pool_size=self.max_concurrency)
+            return self._transport
+
+    def _loop_resources(self) -> tuple:
+        # An httpx client and an asyncio.Semaphore only work on the event loop they were first used on,
+        # and tools may run on several loops (e.g. `asyncio.run` per call), so each loop gets its own.
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            resources = self._loop_state.get(loop)
+            if resources is None:
+                transport = self._async_transport or HttpxAsyncTransport(pool_size=self.max_concurrency)
+                resources = self._loop_state[loop] = (transport, asyncio.Semaphore(self.max_concurrency))
+            return resources
+
+    @property
+    def async_transport(self):
+        """The running event loop's async transport, created on its first use there."""
+        return self._loop_resources()[0]
+
+    @property
+    def async_limiter(self) -> asyncio.Semaphore:
+        """The running event loop's cap on in-flight calls."""
+        return self._loop_resources()[1]
+
+    def url(self, method: str = "generateContent") -> str:
+        api_key = self.api_key or os.getenv("GOOGLE_API_KEY")
+        return f"{self.base_url}/models/{self.model}:{method}?key={api_key}"
+
+    @staticmethod
+    def payload(prompt: str) -> bytes:
+        return json.dumps({"contents": [{"parts": [{"text": prompt}]}]}).encode("utf-8")
+
+    @staticmethod
+    def parse_text(body: str) -> str:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise GeminiError(f"Response is not JSON: {body[:500]}")
+        try:
+            return data['candidates'][0]['content']['parts'][0]['text'].strip()
+        except (KeyError, IndexError):
+            raise GeminiError(f"Unexpected response format: {data}")
+
+    @staticmethod
+    def parse_chunk(data: str) -> str:
+        """Text carried by one server-sent event of `streamGenerateContent`."""
+        try:
+            chunk = json.loads(data)
+            parts = chunk['candidates'][0]['content']['parts']
+        except (ValueError, KeyError, IndexError):
+            return ""
+        return "".join(part.get('text', '') for part in parts)
+
+    def _backoff(self, attempt: int, response: Optional[HTTPResponse]) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        # Full jitter keeps concurrent callers from retrying in lockstep.
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _attempt_timeout(self, expires_at: float) -> float:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            raise GeminiError("Deadline exceeded")
+        return min(self.request_timeout, remaining)
+
+    def _check(self, response: HTTPResponse, attempt: int) -> bool:
+        """True if the response should be retried; raises on non-retryable failures."""
+        if response.status_code == 200:
+            return False
+        if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+            return True
+        raise GeminiError(f"Request failed: {response.status_code} {response.text[:500]}")
+
+    def generate(self, prompt: str, deadline: Optional[float] = None) -> str:
+        """
+        Generate text for a prompt, blocking the calling thread.
+
+        Args:
+            prompt (str): The full prompt text.
+            deadline (float): Seconds the whole call, retries included, may take.
+        """
+        expires_at = time.monotonic() + (deadline or self.deadline)
+        body, headers = self.payload(prompt), {"Content-Type": "application/json"}
+        with self._sync_limiter:
+            for attempt in range(self.max_retries + 1):
+                response = None
+                try:
+                    response = self.transport.post(self.url(), body, headers, self._attempt_timeout(expires_at))
+                    if not self._check(response, attempt):
+                        return self.parse_text(response.text)
+                except OSError as e:  # requests.RequestException derives from OSError
+                    if attempt >= self.max_retries:
+                        raise GeminiError(f"Request error: {e}")
+                delay = self._backoff(attempt, response)
+                if time.monotonic() + delay >= expires_at:
+                    raise GeminiError("Deadline exceeded")
+                time.sleep(delay)
+        raise GeminiError("Retries exhausted")
+
+    async def agenerate(self, prompt: str, deadline: Optional[float] = None) -> str:
+        """
+        Generate text for a prompt without blocking the event loop.
+
+        Args:
+            prompt (str): The full prompt text.
+            deadline (float): Seconds the whole call, retries included, may take.
+        """
+        expires_at = time.monotonic() + (deadline or self.deadline)
+        body, headers = self.payload(prompt), {"Content-Type": "application/json"}
+        async with self.async_limiter:
+            for attempt in range(self.max_retries + 1):
+                response = None
+                try:
+                    response = await self.async_transport.post(self.url(), body, headers, self._attempt_timeout(expires_at))
+                    if not self._check(response, attempt):
+                        return self.parse_text(response.text)
+                except _httpx_error() as e:
+                    if attempt >= self.max_retries:
+                        raise GeminiError(f"Request error: {e}")
+                delay = self._backoff(attempt, response)
+                if time.monotonic() + delay >= expires_at:
+                    raise GeminiError("Deadline exceeded")
+                await asyncio.sleep(delay)
+        raise GeminiError("Retries exhausted")
+
+    async def astream(self, prompt: str, deadline: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Stream generated text for a prompt as it arrives from `streamGenerateContent`.
+
+        Failures before the first chunk are retried like `agenerate`; once text has been yielded
+        a failure is raised instead, since the caller has already forwarded partial output.
+
+        Args:
+            prompt (str): The full prompt text.
+            deadline (float): Seconds the whole call, retries and streaming included, may take.
+        """
+        expires_at = time.monotonic() + (deadline or self.deadline)
+        body, headers = self.payload(prompt), {"Content-Type": "application/json"}
+        url = self.url("streamGenerateContent") + "&alt=sse"
+        async with self.async_limiter:
+            for attempt in range(self.max_retries + 1):
+                response = None
+                streamed = False
+                try:
+                    async with self.async_transport.stream(url, body, headers, self._attempt_timeout(expires_at)) as stream:
+                        if stream.status_code == 200:
+                            async for line in stream.aiter_lines():
+                                if time.monotonic() > expires_at:
+                                    raise GeminiError("Deadline exceeded while streaming")
+                                if not line.startswith("data:"):
+                                    continue
+                                text = self.parse_chunk(line[len("data:"):])
+                                if text:
+                                    streamed = True
+                                    yield text
+                            return
+                        text = (await stream.aread()).decode("utf-8", "replace")
+                        response = HTTPResponse(stream.status_code, text, dict(stream.headers))
+                        self._check(response, attempt)
+                except _httpx_error() as e:
+                    if streamed or attempt >= self.max_retries:
+                        raise GeminiError(f"Request error: {e}")
+                delay = self._backoff(attempt, response)
+                if time.monotonic() + delay >= expires_at:
+                    raise GeminiError("Deadline exceeded")
+                await asyncio.sleep(delay)
+        raise GeminiError("Retries exhausted")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client() -> GeminiClient:
+    """Get or create the process-wide Gemini client shared by the receipt tools."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = GeminiClient()
+        return _client
+
+
+def set_gemini_client(client: GeminiClient) -> None:
+    """Replace the shared client, e.g. with one pointed at a stub server for benchmarks."""
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,170 @@
+import os
+import re
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+
+# Rough size of the receipt context we are willing to send, in tokens.
+DEFAULT_TOKEN_BUDGET = int(os.getenv("RECEIPT_PROMPT_TOKEN_BUDGET", "30000"))
+
+# Average characters per token for Gemini on mostly-ASCII tabular text.
+CHARS_PER_TOKEN = 4
+
+# Columns emitted for each table, in order. `#` is a short per-prompt receipt reference.
+RECEIPT_COLUMNS = [
+    ("transaction_date", "date"),
+    ("transaction_time", "time"),
+    ("merchant_name", "merchant"),
+    ("merchant_address", "address"),
+    ("total_amount", "total"),
+    ("subtotal", "subtotal"),
+    ("tax_total", "tax"),
+    ("tip_amount", "tip"),
+    ("payment_method", "payment"),
+    ("receipt_number", "receipt_no"),
+    ("cashier", "cashier"),
+]
+ITEM_COLUMNS = [
+    ("name", "item"),
+    ("quantity", "qty"),
+    ("unit_price", "unit_price"),
+    ("total_price", "price"),
+    ("category", "category"),
+    ("tax_amount", "tax"),
+]
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {"the", "a", "an", "i", "my", "me", "did", "do", "on", "in", "at", "for", "of", "how",
+              "much", "what", "show", "and", "to", "from", "is", "was", "spend", "spent", "receipts"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate; good enough to keep prompts inside the context window."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        value = round(value, 2)
+        return str(int(value)) if value.is_integer() else str(value)
+    return str(value).replace("|", "/").replace("\n", " ").strip()
+
+
+def _row(cells: List[str]) -> str:
+    # Trailing empty cells carry no information.
+    while cells and cells[-1] == "":
+        cells.pop()
+    return "|".join(cells)
+
+
+def _as_dict(receipt) -> dict:
+    return receipt.dict() if isinstance(receipt, BaseModel) else receipt
+
+
+def rank_receipts(receipts: list, user_query: str) -> list:
+    """
+    Order receipts by relevance to the query: word overlap with merchant, item names and
+    categories first, then recency.
+
+    Args:
+        receipts (list): Receipt dicts or `ReceiptData` models.
+        user_query (str): The user's question.
+    """
+    terms = set(_WORD.findall(user_query.lower())) - _STOPWORDS
+
+    def score(receipt: dict) -> Tuple[int, str]:
+        words = set(_WORD.findall((receipt.get("merchant_name") or "").lower()))
+        for item in receipt.get("items") or []:
+            words.update(_WORD.findall((item.get("name") or "").lower()))
+            words.update(_WORD.findall((item.get("category") or "").lower()))
+        return len(terms & words), receipt.get("transaction_date") or ""
+
+    return sorted((_as_dict(receipt) for receipt in receipts), key=score, reverse=True)
+
+
+def _receipt_block(index: int, receipt: dict, receipt_columns: list) -> Tuple[str, List[str]]:
+    receipt_row = _row([str(index)] + [_cell(receipt.get(field)) for field, _ in receipt_columns])
+    item_rows = [
+        _row([str(index)] + [_cell(item.get(field)) for field, _ in ITEM_COLUMNS])
+        for item in receipt.get("items") or []
+    ]
+    return receipt_row, item_rows
+
+
+def serialize_receipts(receipts: list, user_query: str = "", token_budget: Optional[int] = None) -> str:
+    """
+    Render receipts as two compact pipe-separated tables (receipts and their items) for an LLM prompt.
+
+    Null fields are left empty, columns that are null for every receipt are dropped and floats are
+    rounded to cents. When the tables would exceed `token_budget`, the least relevant receipts are
+    left out and a note says how many.
+
+    Args:
+        receipts (list): Receipt dicts or `ReceiptData` models.
+        user_query (str): The user's question, used to rank receipts when truncating.
+        token_budget (int): Maximum estimated tokens. Defaults to RECEIPT_PROMPT_TOKEN_BUDGET.
+    """
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    ranked = rank_receipts(receipts, user_query)
+    receipt_columns = [(field, label) for field, label in RECEIPT_COLUMNS
+                       if any(receipt.get(field) is not None for receipt in ranked)]
+
+    receipt_header = "receipts: " + "|".join(["#"] + [label for _, label in receipt_columns])
+    item_header = "items: " + "|".join(["#"] + [label for _, label in ITEM_COLUMNS])
+    used = estimate_tokens(receipt_header) + estimate_tokens(item_header)
+
+    selected = []
+    for receipt in ranked:
+        block = _receipt_block(0, receipt, receipt_columns)
+        cost = estimate_tokens("\n".join([block[0]] + block[1]))
+        if used + cost > token_budget:
+            break
+        used += cost
+        selected.append(receipt)
+
+    # Present what fits in chronological order; it reads more naturally for the model.
+    selected.sort(key=lambda receipt: (receipt.get("transaction_date") or "", receipt.get("transaction_time") or ""))
+    receipt_rows, item_rows = [], []
+    for index, receipt in enumerate(selected, 1):
+        receipt_row, rows = _receipt_block(index, receipt, receipt_columns)
+        receipt_rows.append(receipt_row)
+        item_rows.extend(rows)
+
+    lines = [receipt_header, *receipt_rows, item_header, *item_rows]
+    omitted = len(ranked) - len(selected)
+    if omitted:
+        lines.append(f"({omitted} less relevant receipts omitted to fit the context window)")
+    return "\n".join(lines)
+
+
+def shard_receipts(receipts: list, token_budget: Optional[int] = None) -> List[list]:
+    """
+    Split receipts into chronological shards whose serialized tables each fit `token_budget`.
+    Returns a single shard when everything fits in one prompt.
+
+    Args:
+        receipts (list): Receipt dicts or `ReceiptData` models.
+        token_budget (int): Maximum estimated tokens per shard. Defaults to RECEIPT_PROMPT_TOKEN_BUDGET.
+    """
+    token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+    ordered = sorted((_as_dict(receipt) for receipt in receipts),
+                     key=lambda receipt: (receipt.get("transaction_date") or "", receipt.get("transaction_time") or ""))
+    # Headers with every column present are an upper bound on the per-shard overhead.
+    overhead = estimate_tokens("receipts: " + "|".join(label for _, label in RECEIPT_COLUMNS)) \
+        + estimate_tokens("items: " + "|".join(label for _, label in ITEM_COLUMNS))
+
+    shards, current, used = [], [], overhead
+    for receipt in ordered:
+        receipt_row, item_rows = _receipt_block(len(current) + 1, receipt, RECEIPT_COLUMNS)
+        cost = estimate_tokens("\n".join([receipt_row] + item_rows))
+        if current and used + cost > token_budget:
+            shards.append(current)
+            current, used = [], overhead
+        current.append(receipt)
+        used += cost
+    if current:
+        shards.append(current)
+    return shards
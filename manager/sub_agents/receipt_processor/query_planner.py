@@ -0,0 +1,328 @@
+import calendar
+import re
+from datetime import date, timedelta
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+# Category words, in questions and in the free-form item categories the extraction model stores,
+# mapped to one canonical (lower-case) category; see `normalize_category`.
+CATEGORY_KEYWORDS = {
+    "grocery": "groceries",
+    "groceries": "groceries",
+    "supermarket": "groceries",
+    "food": "food",
+    "restaurant": "food",
+    "restaurants": "food",
+    "dining": "food",
+    "coffee": "beverages",
+    "tea": "beverages",
+    "entertainment": "entertainment",
+    "movie": "entertainment",
+    "movies": "entertainment",
+    "transport": "transportation",
+    "transportation": "transportation",
+    "fuel": "transportation",
+    "gas": "transportation",
+    "taxi": "transportation",
+    "shopping": "shopping",
+    "clothing": "shopping",
+    "electronics": "electronics",
+    "utilities": "utilities",
+    "utility": "utilities",
+    "electricity": "utilities",
+    "internet": "utilities",
+    "healthcare": "healthcare",
+    "medical": "healthcare",
+    "pharmacy": "healthcare",
+    "medicine": "healthcare",
+    "household": "household",
+    "beverage": "beverages",
+    "beverages": "beverages",
+    "drink": "beverages",
+    "drinks": "beverages",
+    "alcohol": "alcohol",
+    "personal care": "personal care",
+    "education": "education",
+    "travel": "travel",
+}
+
+_CATEGORY_KEYWORDS_LONGEST_FIRST = sorted(CATEGORY_KEYWORDS, key=len, reverse=True)
+
+# Words of a merchant name that do not identify the merchant ("Costco Wholesale #123" is "costco").
+_MERCHANT_NOISE = {"the", "inc", "llc", "ltd", "pvt", "co", "corp", "corporation", "company",
+                   "store", "stores", "shop", "wholesale", "supermarket", "outlet", "branch"}
+
+MONTHS = {name.lower(): index for index, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): index for index, name in enumerate(calendar.month_abbr) if name})
+
+_CURRENCY = r"(?:rs\.?|inr|usd|₹|\$|€|£)?\s*"
+_NUMBER = r"(\d+(?:,\d{3})*(?:\.\d+)?)"
+# A month name optionally preceded by a preposition and followed by a year; see `_month_mentions`
+_MONTH_PATTERN = (
+    r"(?:\b(in|during|for|of|since|from|until|till|to|through|between|and|before|after)\s+)?"
+    r"\b(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\b\.?(?:\s*,?\s*(\d{4}))?"
+)
+
+_MIN_AMOUNT = re.compile(r"\b(?:over|above|more than|greater than|at least|exceeding|min(?:imum)?)\s+" + _CURRENCY + _NUMBER)
+_MAX_AMOUNT = re.compile(r"\b(?:under|below|less than|at most|cheaper than|max(?:imum)?)\s+" + _CURRENCY + _NUMBER)
+_AMOUNT_BETWEEN = re.compile(r"\bbetween\s+(?:rs\.?|inr|usd|₹|\$|€|£)\s*" + _NUMBER + r"\s+and\s+" + _CURRENCY + _NUMBER)
+_ISO_DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+_LAST_N = re.compile(r"\b(?:last|past)\s+(\d+)\s+(day|week|month)s?\b")
+_YEAR = re.compile(r"\b(?:in|during|for|of)\s+(20\d{2})\b")
+_LIMIT = re.compile(r"\b(?:last|latest|recent|most recent|top|first)\s+(\d+)\s+(?:receipts?|purchases?|transactions?|bills?)\b")
+_QUOTED = re.compile(r"[\"“']([^\"”']{2,})[\"”']")
+_MERCHANT = re.compile(r"\b(?:at|from)\s+((?:[A-Z][\w&'.-]*)(?:\s+[A-Z][\w&'.-]*)*)")
+
+
+class QueryConstraints(BaseModel):
+    """Structured filters extracted from a free-text receipt question."""
+    start_date: Optional[str] = None  # inclusive, YYYY-MM-DD
+    end_date: Optional[str] = None  # inclusive, YYYY-MM-DD
+    # Merchant and category only rank receipts: they are matched loosely against free-form stored
+    # values, and filtering on them would hide receipts the question is about.
+    merchant: Optional[str] = None  # see `merchant_key`
+    category: Optional[str] = None  # see `normalize_category`
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    limit: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        """True when nothing could be extracted and a full scan is needed."""
+        return not any(value is not None for value in self.dict().values())
+
+    def matches(self, receipt: dict) -> bool:
+        """Check a stored receipt against the date and amount constraints in memory."""
+        transaction_date = receipt.get("transaction_date") or ""
+        if self.start_date and transaction_date < self.start_date:
+            return False
+        if self.end_date and transaction_date > self.end_date:
+            return False
+        total = receipt.get("total_amount")
+        if self.min_amount is not None and (total is None or total < self.min_amount):
+            return False
+        if self.max_amount is not None and (total is None or total > self.max_amount):
+            return False
+        return True
+
+    def relevance(self, receipt: dict) -> int:
+        """How many of the merchant and category constraints a receipt matches."""
+        score = 0
+        if self.merchant and merchant_matches(self.merchant, receipt.get("merchant_name")):
+            score += 1
+        if self.category and self.category in receipt_categories(receipt):
+            score += 1
+        return score
+
+    def apply(self, receipts: list) -> list:
+        """
+        Filter receipts by date and amount in memory, order them by merchant/category relevance,
+        then recency, and keep the first `limit` of them.
+        """
+        receipts = [receipt for receipt in receipts if self.matches(receipt)]
+        if self.limit or self.merchant or self.category:
+            receipts.sort(key=lambda receipt: (self.relevance(receipt), receipt.get("transaction_date") or ""),
+                          reverse=True)
+        if self.limit:
+            receipts = receipts[:self.limit]
+        return receipts
+
+
+def normalize_merchant(name: Optional[str]) -> str:
+    """Lower-case a merchant name and collapse punctuation/whitespace."""
+    if not name:
+        return ""
+    return " ".join(re.sub(r"[^\w&]+", " ", name.lower()).split())
+
+
+def merchant_key(name: Optional[str]) -> str:
+    """
+    Canonical merchant of a stored name or a question, shared by the planner and the spending rollups:
+    the normalized name without store numbers and generic words, e.g. "Costco Wholesale #123" -> "costco".
+    """
+    words = [word for word in normalize_merchant(name).split()
+             if word not in _MERCHANT_NOISE and not any(char.isdigit() for char in word)]
+    return " ".join(words) or normalize_merchant(name)
+
+
+def merchant_matches(merchant: str, name: Optional[str]) -> bool:
+    """True if the stored merchant name contains the planner's merchant as whole words, e.g. "costco"."""
+    if not merchant or not name:
+        return False
+    return f" {merchant} " in f" {merchant_key(name)} " or f" {merchant} " in f" {normalize_merchant(name)} "
+
+
+def normalize_category(category: Optional[str]) -> str:
+    """
+    Map a free-form category (from a question or an extracted item) onto the canonical categories of
+    CATEGORY_KEYWORDS, e.g. "Grocery" -> "groceries"; unknown categories are only lower-cased.
+    """
+    text = normalize_merchant(category)
+    return _find_category(text) or text
+
+
+def _find_category(text: str) -> Optional[str]:
+    """Canonical category of the longest category keyword in the text, if any."""
+    for keyword in _CATEGORY_KEYWORDS_LONGEST_FIRST:
+        if re.search(r"\b" + re.escape(keyword) + r"\b", text):
+            return CATEGORY_KEYWORDS[keyword]
+    return None
+
+
+def receipt_categories(receipt: dict) -> list:
+    """Distinct, canonical item categories of a stored receipt."""
+    categories = []
+    for item in receipt.get("items") or []:
+        category = normalize_category(item.get("category"))
+        if category and category not in categories:
+            categories.append(category)
+    return categories
+
+
+def searchable_fields(receipt: dict) -> dict:
+    """
+    Canonical merchant and categories stored alongside each receipt, as the spending rollups key them.
+
+    Args:
+        receipt (dict): The receipt as it is about to be written.
+    """
+    return {
+        "merchant_key": merchant_key(receipt.get("merchant_name")),
+        "categories": receipt_categories(receipt),
+    }
+
+
+def _to_float(value: str) -> float:
+    return float(value.replace(",", ""))
+
+
+def _month_range(year: int, month: int) -> tuple:
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, 1), date(year, month, last_day)
+
+
+def _shift_month(day: date, months: int) -> date:
+    """The same day of the month `months` months away, clamped to the length of the target month."""
+    index = day.year * 12 + day.month - 1 + months
+    year, month = index // 12, index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _month_mentions(text: str) -> list:
+    """
+    (month, year or None) for each month mentioned in the text.
+
+    A name only counts with month context: a preceding preposition ("in mar"), a year ("may 2024"),
+    or a full month name other than "may", so "May I see my receipts?" or "jan's bill" are not dates.
+    """
+    mentions = []
+    for match in re.finditer(_MONTH_PATTERN, text):
+        preposition, name, year = match.groups()
+        if preposition or year or (name == calendar.month_name[MONTHS[name]].lower() and name != "may"):
+            mentions.append((MONTHS[name], year))
+    return mentions
+
+
+def _plan_dates(text: str, today: date) -> tuple:
+    """Return an inclusive (start, end) date range, either side possibly None."""
+    iso_dates = _ISO_DATE.findall(text)
+    if len(iso_dates) >= 2:
+        return min(iso_dates[:2]), max(iso_dates[:2])
+    if len(iso_dates) == 1:
+        if re.search(r"\b(?:since|after|from)\s+" + iso_dates[0], text):
+            return iso_dates[0], None
+        if re.search(r"\b(?:before|until|till)\s+" + iso_dates[0], text):
+            return None, iso_dates[0]
+        return iso_dates[0], iso_dates[0]
+
+    if "today" in text:
+        return today.isoformat(), today.isoformat()
+    if "yesterday" in text:
+        yesterday = today - timedelta(days=1)
+        return yesterday.isoformat(), yesterday.isoformat()
+    if "this week" in text:
+        return (today - timedelta(days=today.weekday())).isoformat(), today.isoformat()
+    if "last week" in text:
+        start = today - timedelta(days=today.weekday() + 7)
+        return start.isoformat(), (start + timedelta(days=6)).isoformat()
+    if "this month" in text:
+        return today.replace(day=1).isoformat(), today.isoformat()
+    if "last month" in text or "previous month" in text:
+        previous = _shift_month(today, -1)
+        start, end = _month_range(previous.year, previous.month)
+        return start.isoformat(), end.isoformat()
+    if "this year" in text:
+        return date(today.year, 1, 1).isoformat(), today.isoformat()
+    if "last year" in text or "previous year" in text:
+        return date(today.year - 1, 1, 1).isoformat(), date(today.year - 1, 12, 31).isoformat()
+
+    last_n = _LAST_N.search(text)
+    if last_n:
+        count, unit = int(last_n.group(1)), last_n.group(2)
+        if unit == "day":
+            start = today - timedelta(days=count)
+        elif unit == "week":
+            start = today - timedelta(weeks=count)
+        else:
+            start = _shift_month(today, -count)
+        return start.isoformat(), today.isoformat()
+
+    months = _month_mentions(text)
+    if months:
+        ranges = []
+        for month, year in months[:2]:
+            # A month without a year means its most recent occurrence.
+            year = int(year) if year else (today.year if month <= today.month else today.year - 1)
+            ranges.append(_month_range(year, month))
+        start = min(r[0] for r in ranges)
+        end = max(r[1] for r in ranges)
+        return start.isoformat(), end.isoformat()
+
+    year = _YEAR.search(text)
+    if year:
+        return f"{year.group(1)}-01-01", f"{year.group(1)}-12-31"
+
+    return None, None
+
+
+def plan_query(user_query: str, today: Optional[date] = None) -> QueryConstraints:
+    """
+    Turn a free-text receipt question into structured constraints.
+
+    Args:
+        user_query (str): The user's question, e.g. "how much did I spend at Costco in March?".
+        today (date): Reference date for relative ranges such as "last month". Defaults to today.
+    """
+    today = today or date.today()
+    text = user_query.lower()
+    constraints = QueryConstraints()
+
+    constraints.start_date, constraints.end_date = _plan_dates(text, today)
+
+    between = _AMOUNT_BETWEEN.search(text)
+    if between:
+        low, high = sorted((_to_float(between.group(1)), _to_float(between.group(2))))
+        constraints.min_amount, constraints.max_amount = low, high
+    else:
+        minimum = _MIN_AMOUNT.search(text)
+        maximum = _MAX_AMOUNT.search(text)
+        if minimum:
+            constraints.min_amount = _to_float(minimum.group(1))
+        if maximum:
+            constraints.max_amount = _to_float(maximum.group(1))
+
+    limit = _LIMIT.search(text)
+    if limit:
+        constraints.limit = int(limit.group(1))
+
+    quoted = _QUOTED.search(user_query)
+    merchant = _MERCHANT.search(user_query)
+    if quoted:
+        constraints.merchant = merchant_key(quoted.group(1))
+    elif merchant and merchant.group(1).lower().split()[0] not in MONTHS:
+        constraints.merchant = merchant_key(merchant.group(1))
+
+    constraints.category = _find_category(text)
+
+    return constraints
@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+
+class _Partition:
+    """One user's receipts, kept current by a Firestore snapshot listener."""
+
+    def __init__(self):
+        self.receipts = {}
+        self.ready = threading.Event()
+        self.watch = None
+        # Set once the partition is dropped; a listener created after that is closed as soon as it exists
+        self.closed = False
+
+
+class ReceiptMirror:
+    """
+    In-memory mirror of the `receipts` collection, partitioned per user.
+
+    A partition is loaded by the first snapshot of a per-user `on_snapshot` listener and kept current
+    by the listener afterwards, so queries read memory instead of Firestore. At most `max_users`
+    partitions are held; the least recently queried user is evicted and its listener closed, and is
+    transparently reloaded on its next query. A partition whose initial snapshot does not arrive in
+    time is dropped as well, and the user is read from Firestore directly for `retry_interval` seconds
+    before the mirror subscribes again.
+    """
+
+    def __init__(self, db, max_users: int = 100, load_timeout: float = 10.0, retry_interval: float = 60.0,
+                 on_change: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            db: Firestore client.
+            max_users (int): Number of user partitions kept in memory.
+            load_timeout (float): Seconds to wait for a partition's initial snapshot before giving up.
+            retry_interval (float): Seconds after a failed load before the user is subscribed again.
+            on_change (callable): Called with the user ID whenever that user's receipts change after loading.
+        """
+        self.db = db
+        self.max_users = max_users
+        self.load_timeout = load_timeout
+        self.retry_interval = retry_interval
+        self.on_change = on_change
+        self._partitions = OrderedDict()
+        self._retry_after = {}
+        self._lock = threading.Lock()
+
+    def start(self, user_ids: Iterable[str] = ()) -> None:
+        """Subscribe the given users up front, e.g. the most active ones at startup, without waiting for them to load."""
+        for user_id in user_ids:
+            self._partition(user_id)
+
+    def stop(self) -> None:
+        """Close every listener and drop all partitions."""
+        with self._lock:
+            watches = [self._close(partition) for partition in self._partitions.values()]
+            self._partitions.clear()
+        self._unsubscribe(watches)
+
+    def receipts(self, user_id: str) -> Optional[list]:
+        """
+        The user's receipts from memory, or None if the partition could not be loaded in time
+        (callers should then query Firestore directly).
+
+        Args:
+            user_id (str): Owner of the receipts.
+        """
+        partition = self._partition(user_id)
+        if partition is None:
+            return None
+        if not partition.ready.wait(self.load_timeout):
+            # Drop the partition so later queries do not wait for a snapshot that may never come
+            watches = []
+            with self._lock:
+                if self._partitions.get(user_id) is partition:
+                    del self._partitions[user_id]
+                    self._retry_after[user_id] = time.monotonic() + self.retry_interval
+                    watches.append(self._close(partition))
+            self._unsubscribe(watches)
+            return None
+        with self._lock:
+            return list(partition.receipts.values())
+
+    def _partition(self, user_id: str) -> Optional[_Partition]:
+        """
+        The user's partition, subscribing it if needed; None while the user is waiting to retry a failed
+        load, or if the new partition was evicted before its listener was set up.
+        """
+        evicted = []
+        with self._lock:
+            partition = self._partitions.get(user_id)
+            if partition is not None:
+                self._partitions.move_to_end(user_id)
+                return partition
+            if time.monotonic() < self._retry_after.get(user_id, 0.0):
+                return None
+            self._retry_after.pop(user_id, None)
+            partition = _Partition()
+            self._partitions[user_id] = partition
+            while len(self._partitions) > self.max_users:
+                evicted.append(self._close(self._partitions.popitem(last=False)[1]))
+        self._unsubscribe(evicted)
+        query = self.db.collection('receipts').where('user_id', '==', user_id)
+        watch = query.on_snapshot(lambda docs, changes, read_time: self._apply(user_id, partition, changes))
+        with self._lock:
+            if not partition.closed:
+                partition.watch = watch
+                return partition
+        # Evicted while subscribing (e.g. by many concurrent users): nobody else would close this listener
+        watch.unsubscribe()
+        return None
+
+    @staticmethod
+    def _close(partition: _Partition):
+        """Mark a dropped partition closed and take its listener, if it has one yet (lock held)."""
+        partition.closed = True
+        watch, partition.watch = partition.watch, None
+        return watch
+
+    @staticmethod
+    def _unsubscribe(watches: list) -> None:
+        """Close listeners taken by `_close`, outside the lock."""
+        for watch in watches:
+            if watch is not None:
+                watch.unsubscribe()
+
+    def _apply(self, user_id: str, partition: _Partition, changes) -> None:
+        # Runs on the listener's background thread.
+        with self._lock:
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    partition.receipts.pop(change.document.id, None)
+                else:
+                    partition.receipts[change.document.id] = change.document.to_dict()
+        if partition.ready.is_set():
+            if self.on_change is not None and changes:
+                self.on_change(user_id)
+        else:
+            partition.ready.set()
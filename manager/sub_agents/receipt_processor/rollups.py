@@ -0,0 +1,174 @@
+import calendar
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from .firebase_client import increment
+from .query_planner import QueryConstraints, merchant_key, normalize_category
+
+
+# Rollup documents live in their own collection, one document per (user, dimension, key):
+#   total                          -> everything the user ever spent
+#   month / category / merchant    -> e.g. "2025-03", "groceries", "costco"
+#   month_category / month_merchant-> e.g. "2025-03|groceries"
+# Each document holds a running `total` and `count` maintained with server-side increments.
+ROLLUP_COLLECTION = 'spending_rollups'
+
+# Beyond this many monthly documents an aggregate is cheaper to answer from the receipts.
+MAX_ROLLUP_MONTHS = 36
+
+# Only questions asking for a sum: "how much did I spend", "total spent", "what did I spend in May".
+# Questions that merely mention totals or expenses ("my top expenses", "the highest total") are not.
+_AGGREGATE_QUESTION = re.compile(
+    r"\bhow much\b.*\bspen[dt]\b"
+    r"|\bwhat did (?:i|we) spend\b"
+    r"|\btotal (?:amount )?(?:spent|spend|spending|expenses|expenditure)\b"
+    r"|\b(?:spent|spend|spending|expenses) in total\b"
+    r"|\bsum of (?:my |all )*(?:spending|expenses|purchases|receipts)\b"
+)
+
+
+def rollup_doc_id(user_id: str, dimension: str, key: str = '') -> str:
+    """Deterministic document ID so writers and readers agree without a lookup."""
+    parts = [user_id, dimension] + ([key.replace('/', '_')] if key else [])
+    return "__".join(parts)
+
+
+def receipt_increments(receipt: dict) -> Dict[Tuple[str, str], float]:
+    """
+    Amounts a single receipt adds to each rollup, keyed by (dimension, key).
+
+    Merchant and category keys go through the planner's `merchant_key` and `normalize_category`,
+    so "Costco Wholesale #123" and "Grocery" land on the documents asked about as "costco" and "groceries".
+
+    Args:
+        receipt (dict): The stored receipt.
+    """
+    total = float(receipt.get('total_amount') or 0.0)
+    month = (receipt.get('transaction_date') or '')[:7]
+    merchant = merchant_key(receipt.get('merchant_name'))
+
+    increments = {('total', ''): total}
+    if month:
+        increments[('month', month)] = total
+    if merchant:
+        increments[('merchant', merchant)] = total
+        if month:
+            increments[('month_merchant', f"{month}|{merchant}")] = total
+
+    for item in receipt.get('items') or []:
+        category = normalize_category(item.get('category'))
+        if not category:
+            continue
+        amount = float(item.get('total_price') or 0.0)
+        increments[('category', category)] = increments.get(('category', category), 0.0) + amount
+        if month:
+            key = ('month_category', f"{month}|{category}")
+            increments[key] = increments.get(key, 0.0) + amount
+
+    return increments
+
+
+def rollup_writes(db, user_id: str, increments: Dict[Tuple[str, str], float]) -> List[tuple]:
+    """
+    Rollup updates for a record, as (reference, data, merge) writes to commit in the same batch as the record.
+
+    Args:
+        db: Firestore client.
+        user_id (str): Owner of the record.
+        increments (dict): Output of `receipt_increments`.
+    """
+    now = datetime.utcnow().isoformat()
+    writes = []
+    for (dimension, key), amount in increments.items():
+        ref = db.collection(ROLLUP_COLLECTION).document(rollup_doc_id(user_id, dimension, key))
+        writes.append((ref, {
+            'user_id': user_id,
+            'dimension': dimension,
+            'key': key,
+            'total': increment(round(amount, 2)),
+            'count': increment(1),
+            'updated_at': now,
+        }, True))
+    return writes
+
+
+def is_aggregate_question(user_query: str) -> bool:
+    """True for questions asking how much was spent in total, which rollups can answer."""
+    return bool(_AGGREGATE_QUESTION.search(user_query.lower()))
+
+
+def _months_in_range(constraints: QueryConstraints, today: date) -> Optional[List[str]]:
+    """Whole calendar months covered by the date range, or None if it does not align to months."""
+    start = date.fromisoformat(constraints.start_date)
+    end = date.fromisoformat(constraints.end_date)
+    if start.day != 1:
+        return None
+    month_end = calendar.monthrange(end.year, end.month)[1]
+    # "this month" ends today rather than on the last day; nothing later has been recorded yet.
+    if end.day != month_end and end != today:
+        return None
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        if len(months) > MAX_ROLLUP_MONTHS:
+            return None
+    return months
+
+
+def rollup_keys_for(constraints: QueryConstraints, today: Optional[date] = None) -> Optional[List[Tuple[str, str]]]:
+    """
+    Map planner constraints onto the rollup documents whose sum answers the question.
+
+    Returns None when the constraints cannot be expressed with the maintained rollups
+    (amount bounds, limits, partial months, or merchant and category together).
+
+    Args:
+        constraints (QueryConstraints): Filters produced by `plan_query`.
+        today (date): Reference date used to accept month-to-date ranges.
+    """
+    today = today or date.today()
+    if constraints.min_amount is not None or constraints.max_amount is not None or constraints.limit:
+        return None
+    if constraints.merchant and constraints.category:
+        return None
+    if bool(constraints.start_date) != bool(constraints.end_date):
+        return None
+
+    if constraints.merchant:
+        dimension, key = 'merchant', constraints.merchant
+    elif constraints.category:
+        dimension, key = 'category', constraints.category
+    else:
+        dimension, key = 'total', ''
+
+    if not constraints.start_date:
+        return [(dimension, key)]
+
+    months = _months_in_range(constraints, today)
+    if months is None:
+        return None
+    if dimension == 'total':
+        return [('month', month) for month in months]
+    return [(f"month_{dimension}", f"{month}|{key}") for month in months]
+
+
+def read_rollups(db, user_id: str, keys: List[Tuple[str, str]]) -> Tuple[float, int]:
+    """
+    Sum the `total` and `count` of the given rollup documents in a single batched read.
+
+    Args:
+        db: Firestore client.
+        user_id (str): Owner of the rollups.
+        keys (list): (dimension, key) pairs from `rollup_keys_for`.
+    """
+    refs = [db.collection(ROLLUP_COLLECTION).document(rollup_doc_id(user_id, dimension, key)) for dimension, key in keys]
+    total, count = 0.0, 0
+    for snapshot in db.get_all(refs):
+        if snapshot.exists:
+            data = snapshot.to_dict()
+            total += data.get('total') or 0.0
+            count += data.get('count') or 0
+    return round(total, 2), count
@@ -0,0 +1,75 @@
+"""
+Tests for the receipt query planner: questions about a merchant or category must never lose the
+receipts they are about, whatever free-form merchant names and item categories were extracted.
+
+Run with `python -m pytest manager/sub_agents/receipt_processor/test_query_planner.py`.
+"""
+
+from datetime import date
+
+from .query_planner import merchant_key, normalize_category, plan_query, searchable_fields
+
+TODAY = date(2025, 5, 20)
+
+COSTCO = {
+    "merchant_name": "Costco Wholesale #123",
+    "transaction_date": "2025-04-12",
+    "total_amount": 54.3,
+    "items": [
+        {"name": "Cold brew coffee", "category": "Beverages", "total_price": 12.3},
+        {"name": "Bananas", "category": "Grocery", "total_price": 42.0},
+    ],
+}
+CAFE = {
+    "merchant_name": "Blue Bottle Cafe",
+    "transaction_date": "2025-04-20",
+    "total_amount": 6.5,
+    "items": [{"name": "Latte", "category": "Food & Drink", "total_price": 6.5}],
+}
+OLD = {"merchant_name": "Costco", "transaction_date": "2024-12-01", "total_amount": 20.0, "items": []}
+
+
+def answer_receipts(question: str) -> list:
+    return plan_query(question, today=TODAY).apply([CAFE, OLD, COSTCO])
+
+
+def test_merchant_question_keeps_store_with_number_suffix():
+    constraints = plan_query("How much did I spend at Costco last month?", today=TODAY)
+    assert constraints.merchant == "costco"
+    assert answer_receipts("How much did I spend at Costco last month?") == [COSTCO, CAFE]
+
+
+def test_category_synonym_matches_extracted_category():
+    constraints = plan_query("groceries in April", today=TODAY)
+    assert constraints.category == "groceries"
+    assert (constraints.start_date, constraints.end_date) == ("2025-04-01", "2025-04-30")
+    assert answer_receipts("groceries in April")[0] is COSTCO
+
+
+def test_category_only_ranks_receipts():
+    # Both stored categories ("Beverages", "Food & Drink") mean beverages; newest first among equals
+    assert answer_receipts("what did I spend on coffee last month") == [CAFE, COSTCO]
+
+
+def test_date_and_amount_still_filter():
+    assert answer_receipts("receipts over 50 in April") == [COSTCO]
+    assert OLD not in answer_receipts("spend at Costco last month")
+
+
+def test_latest_receipts_prefer_the_merchant():
+    assert answer_receipts("last 2 receipts from Costco") == [COSTCO, OLD]
+
+
+def test_stored_fields_use_the_same_normalization():
+    fields = searchable_fields(COSTCO)
+    assert fields == {"merchant_key": "costco", "categories": ["beverages", "groceries"]}
+    assert merchant_key("The Home Depot #4411") == "home depot"
+    assert normalize_category("Food & Beverages") == "beverages"
+    assert normalize_category("Pet Supplies") == "pet supplies"
+
+
+def test_month_words_need_month_context():
+    assert plan_query("May I see all my receipts?", today=TODAY).start_date is None
+    assert plan_query("what did I spend in may", today=TODAY).start_date == "2025-05-01"
+    constraints = plan_query("last 2 months", today=date(2025, 3, 31))
+    assert (constraints.start_date, constraints.end_date) == ("2025-01-31", "2025-03-31")
@@ -0,0 +1,42 @@
+"""
+Tests for the spending rollups: the documents a receipt increments must be the ones the planner
+reads for questions about its merchant and categories.
+
+Run with `python -m pytest manager/sub_agents/receipt_processor/test_rollups.py`.
+"""
+
+from datetime import date
+
+from .query_planner import plan_query
+from .rollups import receipt_increments, rollup_keys_for
+
+TODAY = date(2025, 5, 20)
+
+RECEIPT = {
+    "merchant_name": "Costco Wholesale #123",
+    "transaction_date": "2025-04-12",
+    "total_amount": 54.3,
+    "items": [
+        {"name": "Cold brew coffee", "category": "Beverages", "total_price": 12.3},
+        {"name": "Bananas", "category": "Grocery", "total_price": 30.0},
+        {"name": "Apples", "category": "Groceries", "total_price": 12.0},
+    ],
+}
+
+
+def rollup_keys(question: str) -> list:
+    return rollup_keys_for(plan_query(question, today=TODAY), today=TODAY)
+
+
+def test_receipt_increments_use_planner_keys():
+    increments = receipt_increments(RECEIPT)
+    assert rollup_keys("How much did I spend at Costco in April?") == [("month_merchant", "2025-04|costco")]
+    assert increments[("month_merchant", "2025-04|costco")] == 54.3
+    assert rollup_keys("How much did I spend on groceries?") == [("category", "groceries")]
+    assert increments[("category", "groceries")] == 42.0
+    assert increments[("month_category", "2025-04|beverages")] == 12.3
+
+
+def test_receipt_without_merchant_or_categories_counts_towards_totals():
+    increments = receipt_increments({"transaction_date": "2025-04-12", "total_amount": 5.0, "items": [{}]})
+    assert increments == {("total", ""): 5.0, ("month", "2025-04"): 5.0}
@@ -0,0 +1,208 @@
+"""
+Offline stand-in for `genai.Client().aio.live`, for load tests and local development.
+
+Set FAKE_GEMINI_LIVE=1 and main.py serves sessions from FakeLiveClient instead of Gemini. A fake
+session collects the client's audio; once FAKE_LIVE_TURN_AUDIO_MS of it has arrived it waits
+FAKE_LIVE_REPLY_LATENCY seconds and streams FAKE_LIVE_REPLY_AUDIO_MS of audio back (the caller's
+own audio, echoed at 24 kHz), then completes the turn. Every FAKE_LIVE_TOOL_CALL_EVERY-th turn
+starts with a scripted record_transaction tool call, and the reply waits for its tool response.
+When the config asks for session resumption, every completed turn is followed by a new handle;
+after FAKE_LIVE_GO_AWAY_AFTER_TURNS turns the session sends go_away and drops the connection
+FAKE_LIVE_GO_AWAY_GRACE seconds later, as the Live API does when it recycles connections.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import os
+from typing import Optional
+
+import websockets
+from google.genai import types
+
+FAKE_CONNECT_LATENCY = float(os.getenv("FAKE_LIVE_CONNECT_LATENCY", "0.3"))
+FAKE_REPLY_LATENCY = float(os.getenv("FAKE_LIVE_REPLY_LATENCY", "0.3"))
+FAKE_TURN_AUDIO_MS = int(os.getenv("FAKE_LIVE_TURN_AUDIO_MS", "2000"))
+FAKE_REPLY_AUDIO_MS = int(os.getenv("FAKE_LIVE_REPLY_AUDIO_MS", "1000"))
+FAKE_REPLY_CHUNK_MS = int(os.getenv("FAKE_LIVE_REPLY_CHUNK_MS", "40"))
+# Reply audio is streamed this many times faster than real time, as Gemini does.
+FAKE_STREAM_SPEED = float(os.getenv("FAKE_LIVE_STREAM_SPEED", "4"))
+FAKE_TOOL_CALL_EVERY = int(os.getenv("FAKE_LIVE_TOOL_CALL_EVERY", "0"))
+FAKE_GO_AWAY_AFTER_TURNS = int(os.getenv("FAKE_LIVE_GO_AWAY_AFTER_TURNS", "0"))
+FAKE_GO_AWAY_GRACE = float(os.getenv("FAKE_LIVE_GO_AWAY_GRACE", "1.0"))
+FAKE_TOOL_RESPONSE_TIMEOUT = 30.0
+
+INPUT_BYTES_PER_MS = 32   # 16 kHz, 16-bit mono
+OUTPUT_BYTES_PER_MS = 48  # 24 kHz, 16-bit mono
+
+SCRIPTED_TOOL_CALL = {
+    "name": "record_transaction",
+    "args": {
+        "amount": "12.50",
+        "description": "Lunch at a cafe",
+        "category": "food",
+        "transaction_type": "expense",
+        "merchant": "Corner Cafe",
+    },
+}
+
+
+class FakeLiveSession:
+    """Implements the parts of `AsyncSession` used by main.py."""
+
+    _call_ids = itertools.count(1)
+
+    def __init__(self, config: Optional[dict] = None, reply_latency: float = FAKE_REPLY_LATENCY,
+                 turn_audio_ms: int = FAKE_TURN_AUDIO_MS, reply_audio_ms: int = FAKE_REPLY_AUDIO_MS,
+                 reply_chunk_ms: int = FAKE_REPLY_CHUNK_MS, stream_speed: float = FAKE_STREAM_SPEED,
+                 tool_call_every: int = FAKE_TOOL_CALL_EVERY, go_away_after_turns: int = FAKE_GO_AWAY_AFTER_TURNS,
+                 go_away_grace: float = FAKE_GO_AWAY_GRACE):
+        self.config = config or {}
+        self.reply_latency = reply_latency
+        self.turn_bytes = turn_audio_ms * INPUT_BYTES_PER_MS
+        self.reply_bytes = reply_audio_ms * OUTPUT_BYTES_PER_MS
+        self.chunk_bytes = reply_chunk_ms * OUTPUT_BYTES_PER_MS
+        self.chunk_interval = reply_chunk_ms / 1000 / stream_speed
+        self.tool_call_every = tool_call_every
+        self.go_away_after_turns = go_away_after_turns
+        self.go_away_grace = go_away_grace
+        resumption = self.config.get("session_resumption")
+        if isinstance(resumption, dict):
+            resumption = types.SessionResumptionConfig(**resumption)
+        self.resumable = resumption is not None
+        self.resumed_from = resumption.handle if resumption is not None else None
+        self.turns_completed = 0
+        self.audio_bytes_in = 0
+        self.video_frames_in = 0
+        self.tool_responses = []
+        self.turns = 0
+        self._turn_audio = bytearray()
+        self._messages = asyncio.Queue()
+        self._tool_response = asyncio.Event()
+        self._replies = set()
+        self._closed = False
+        self._dropped = False
+
+    async def send_realtime_input(self, audio: Optional[types.Blob] = None, video: Optional[types.Blob] = None, **kwargs):
+        self._check_connected()
+        if video is not None:
+            self.video_frames_in += 1
+        if audio is None:
+            return
+        self.audio_bytes_in += len(audio.data)
+        self._turn_audio += audio.data
+        while len(self._turn_audio) >= self.turn_bytes:
+            utterance = bytes(self._turn_audio[:self.turn_bytes])
+            del self._turn_audio[:self.turn_bytes]
+            reply = asyncio.create_task(self._reply(utterance))
+            self._replies.add(reply)
+            reply.add_done_callback(self._replies.discard)
+
+    async def send_tool_response(self, function_responses=None, **kwargs):
+        self._check_connected()
+        self.tool_responses.extend(function_responses or [])
+        self._tool_response.set()
+
+    async def receive(self):
+        """Yield server messages until the current turn completes, like `AsyncSession.receive`."""
+        while not self._closed:
+            message = await self._messages.get()
+            if message is None:
+                self._check_connected()
+                return
+            yield message
+            if message.server_content is not None and message.server_content.turn_complete:
+                return
+        self._check_connected()
+
+    async def close(self):
+        self._closed = True
+        for reply in list(self._replies):
+            reply.cancel()
+        self._messages.put_nowait(None)
+
+    def _check_connected(self):
+        if self._dropped:
+            raise websockets.exceptions.ConnectionClosedOK(websockets.frames.Close(1000, "go away"), None)
+
+    async def _drop_after(self, delay: float):
+        await asyncio.sleep(delay)
+        self._dropped = True
+        await self.close()
+
+    async def _reply(self, utterance: bytes):
+        self.turns += 1
+        await asyncio.sleep(self.reply_latency)
+        if self.tool_call_every and self.turns % self.tool_call_every == 0:
+            self._tool_response.clear()
+            call = types.FunctionCall(id=f"fake-call-{next(self._call_ids)}", **SCRIPTED_TOOL_CALL)
+            self._messages.put_nowait(types.LiveServerMessage(
+                tool_call=types.LiveServerToolCall(function_calls=[call])
+            ))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._tool_response.wait(), FAKE_TOOL_RESPONSE_TIMEOUT)
+
+        # Echo the caller's audio, repeated or cut to the configured reply length.
+        source = utterance or b"\0\0"
+        audio = (source * (self.reply_bytes // len(source) + 1))[:self.reply_bytes]
+        for offset in range(0, len(audio), self.chunk_bytes):
+            part = types.Part(inline_data=types.Blob(data=audio[offset:offset + self.chunk_bytes],
+                                                     mime_type="audio/pcm;rate=24000"))
+            self._messages.put_nowait(types.LiveServerMessage(
+                server_content=types.LiveServerContent(model_turn=types.Content(role="model", parts=[part]))
+            ))
+            await asyncio.sleep(self.chunk_interval)
+        self._messages.put_nowait(types.LiveServerMessage(
+            server_content=types.LiveServerContent(turn_complete=True)
+        ))
+        self.turns_completed += 1
+        if self.resumable:
+            self._messages.put_nowait(types.LiveServerMessage(
+                session_resumption_update=types.LiveServerSessionResumptionUpdate(
+                    new_handle=f"fake-handle-{id(self):x}-{self.turns_completed}", resumable=True
+                )
+            ))
+        if self.go_away_after_turns and self.turns_completed == self.go_away_after_turns:
+            self._messages.put_nowait(types.LiveServerMessage(
+                go_away=types.LiveServerGoAway(time_left=f"{self.go_away_grace}s")
+            ))
+            drop = asyncio.create_task(self._drop_after(self.go_away_grace))
+            self._replies.add(drop)
+            drop.add_done_callback(self._replies.discard)
+
+
+class _FakeLive:
+    def __init__(self, connect_latency: float, session_options: dict):
+        self.connect_latency = connect_latency
+        self.session_options = session_options
+        self.sessions_opened = 0
+        self.sessions_resumed = 0
+
+    @contextlib.asynccontextmanager
+    async def connect(self, model: str = None, config=None):
+        await asyncio.sleep(self.connect_latency)
+        session = FakeLiveSession(config, **self.session_options)
+        self.sessions_opened += 1
+        if session.resumed_from:
+            self.sessions_resumed += 1
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+class _FakeAio:
+    def __init__(self, live: _FakeLive):
+        self.live = live
+
+
+class FakeLiveClient:
+    """Drop-in for `genai.Client` as far as `client.aio.live.connect(...)` is concerned."""
+
+    def __init__(self, connect_latency: float = FAKE_CONNECT_LATENCY, **session_options):
+        """
+        Args:
+            connect_latency: Seconds each connect takes, standing in for the Live API handshake
+            **session_options: Overrides for FakeLiveSession's reply behaviour
+        """
+        self.aio = _FakeAio(_FakeLive(connect_latency, session_options))
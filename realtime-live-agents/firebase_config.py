@@ -1,21 +1,168 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
+import glob
 import json
+import logging
 import os
+import re
+import threading
+import time
 from datetime import datetime
-from typing import Dict, Any, Optional
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional, Tuple
+
+from google.api_core.exceptions import AlreadyExists
+
+from metrics import FIRESTORE_WRITE_SECONDS
+from write_ahead_log import WriteAheadLog
+from write_pipeline import CREATE, BatchWriter
+
+logger = logging.getLogger(__name__)
+
+# Writes are grouped into Firestore batch commits by a background BatchWriter
+BATCH_MAX_OPS = int(os.getenv("FIRESTORE_BATCH_MAX_OPS", "500"))
+BATCH_FLUSH_INTERVAL = float(os.getenv("FIRESTORE_BATCH_FLUSH_INTERVAL", "0.02"))
+WRITE_TIMEOUT = float(os.getenv("FIRESTORE_WRITE_TIMEOUT", "30"))
+# Writes acknowledged before they are stored get this many further attempts, with exponential backoff
+WRITE_RETRIES = int(os.getenv("FIRESTORE_WRITE_RETRIES", "3"))
+WRITE_RETRY_BACKOFF = float(os.getenv("FIRESTORE_WRITE_RETRY_BACKOFF", "0.5"))
+# Local SQLite write-ahead log that the server's writes land in before Firestore; empty disables it.
+# A relative path is resolved against this directory, so the log is found again whatever the working
+# directory. Server workers other than the first add their index to the file name, as each process
+# needs its own log.
+WAL_PATH = os.getenv("FIRESTORE_WAL_PATH", "firebase_wal.sqlite3")
+if WAL_PATH:
+    WAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), WAL_PATH)
+# Failed attempts after which a logged write is moved to the log's dead letters and reported as failed
+WAL_MAX_ATTEMPTS = int(os.getenv("FIRESTORE_WAL_MAX_ATTEMPTS", "50"))
+
+# Set by `enable_write_ahead_log`: this server worker's index and the number of workers
+_wal_worker = None
+_wal_workers = 1
+
+def enable_write_ahead_log(index: int = 0, workers: int = 1):
+    """
+    Land this process's writes in a write-ahead log; called by the server before the first Firebase use.
+    
+    Other callers (command-line tools, scripts calling the tools directly) write to Firestore
+    synchronously, so a write has reached Firestore when `store_*` returns and they never open
+    the server's log.
+    
+    Args:
+        index: Which server worker this process is, so it gets its own log file
+        workers: Number of server workers; the first one also replays the logs of workers beyond it
+    """
+    global _wal_worker, _wal_workers
+    _wal_worker = index
+    _wal_workers = workers
+
+def worker_wal_path(path: str, index: int) -> str:
+    """The write-ahead log file of a worker: `path` itself for the first, e.g. firebase_wal-worker2.sqlite3 for others."""
+    if not index:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-worker{index}{ext}"
+
+def orphaned_wal_paths(path: str, workers: int) -> List[str]:
+    """
+    Log files of workers that no longer run, e.g. after SERVER_WORKERS was reduced.
+    
+    Args:
+        path: The first worker's log file
+        workers: Number of server workers now running
+    """
+    root, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(os.path.basename(root)) + r"-worker(\d+)" + re.escape(ext) + "$")
+    orphans = []
+    for candidate in sorted(glob.glob(f"{glob.escape(root)}-worker*{glob.escape(ext)}")):
+        match = pattern.match(os.path.basename(candidate))
+        if match and int(match.group(1)) >= workers:
+            orphans.append(candidate)
+    return orphans
+
+def _timed_write(future: Future, kind: str) -> Future:
+    """Record the time from queueing a write group to its commit (or failure)."""
+    started = time.monotonic()
+    future.add_done_callback(lambda _: FIRESTORE_WRITE_SECONDS.observe(time.monotonic() - started, kind=kind))
+    return future
+
+def _with_retries(submit, kind: str, retries: int, document_id: str) -> Future:
+    """
+    Run `submit()` (which queues a write group and returns its Future) until it commits.
+    
+    Failed attempts are resubmitted after WRITE_RETRY_BACKOFF * 2**attempt seconds; the returned
+    Future fails only once all `retries` further attempts have failed. The group's first write must
+    create `document_id`: an error such as DEADLINE_EXCEEDED can be reported for a batch the server
+    did apply, and the resubmitted group then fails with AlreadyExists instead of applying the
+    group twice, which counts as committed.
+    """
+    result = Future()
+
+    def attempt(number: int):
+        try:
+            future = submit()
+        except Exception as e:
+            result.set_exception(e)
+            return
+
+        def done(future: Future):
+            error = future.exception()
+            if error is None:
+                result.set_result(future.result())
+            elif isinstance(error, AlreadyExists):
+                result.set_result(document_id)
+            elif number >= retries:
+                result.set_exception(error)
+            else:
+                logger.warning("%s write failed (attempt %s of %s), retrying: %s", kind, number + 1, retries + 1, error)
+                timer = threading.Timer(WRITE_RETRY_BACKOFF * 2 ** number, attempt, (number + 1,))
+                timer.daemon = True
+                timer.start()
+
+        future.add_done_callback(done)
+
+    attempt(0)
+    return result
 
 class FirebaseConfig:
-    def __init__(self, credentials_path: str = "firebase_credentials.json"):
+    def __init__(self, credentials_path: str = "firebase_credentials.json", wal_worker: Optional[int] = None,
+                 wal_workers: int = 1):
         """
         Initialize Firebase configuration for storing ID data.
         
         Args:
             credentials_path: Path to Firebase credentials JSON file
+            wal_worker: Server worker whose write-ahead log writes land in; None writes to Firestore directly
+            wal_workers: Number of server workers; the first also replays the logs of workers beyond it
         """
         self.credentials_path = credentials_path
         self.db = None
+        self.writer = None
+        self.wal = None
+        self.orphaned_wals = []
         self._initialize_firebase()
+        if self.db:
+            self.writer = BatchWriter(self.db, max_ops=BATCH_MAX_OPS, flush_interval=BATCH_FLUSH_INTERVAL)
+            if WAL_PATH and wal_worker is not None:
+                self.wal = self._open_wal(worker_wal_path(WAL_PATH, wal_worker))
+                if wal_worker == 0:
+                    # Nobody else replays these; they are drained and left empty
+                    for path in orphaned_wal_paths(WAL_PATH, wal_workers):
+                        logger.info("Replaying write-ahead log '%s' of a worker that no longer runs", path)
+                        orphan = self._open_wal(path)
+                        if orphan is not None:
+                            self.orphaned_wals.append(orphan)
+                if self.wal is None:
+                    logger.warning("No write-ahead log, writing to Firestore directly")
+    
+    def _open_wal(self, path: str) -> Optional[WriteAheadLog]:
+        """Open a write-ahead log, which replays what it holds, or None if it cannot be opened."""
+        try:
+            return WriteAheadLog(path, self.db, self.writer, retry_backoff=WRITE_RETRY_BACKOFF,
+                                 max_attempts=WAL_MAX_ATTEMPTS)
+        except Exception as e:
+            logger.error("Error opening write-ahead log '%s': %s", path, e)
+            return None
     
     def _initialize_firebase(self):
         """Initialize Firebase Admin SDK"""
@@ -23,8 +170,9 @@ class FirebaseConfig:
             if not firebase_admin._apps:
                 # Check if credentials file exists
                 if not os.path.exists(self.credentials_path):
-                    print(f"Warning: Firebase credentials file '{self.credentials_path}' not found.")
-                    print("Please create the credentials file with your Firebase service account key.")
+                    logger.warning("Firebase credentials file '%s' not found. "
+                                   "Please create the credentials file with your Firebase service account key.",
+                                   self.credentials_path)
                     return
                 
                 # Initialize Firebase with service account credentials
@@ -32,15 +180,42 @@ class FirebaseConfig:
                 firebase_admin.initialize_app(cred)
                 
                 self.db = firestore.client()
-                print("Firebase initialized successfully")
+                logger.info("Firebase initialized successfully")
             else:
                 self.db = firestore.client()
-                print("Using existing Firebase connection")
+                logger.info("Using existing Firebase connection")
                 
         except Exception as e:
-            print(f"Error initializing Firebase: {e}")
-            print("Please check your Firebase credentials and configuration.")
+            logger.error("Error initializing Firebase: %s. Please check your Firebase credentials and configuration.", e)
     
+    def submit_id_data(self, id_data: Dict[str, Any], user_id: Optional[str] = None,
+                       retries: int = 0) -> Tuple[Dict[str, Any], str, Future]:
+        """
+        Queue extracted ID data on the batched write pipeline without waiting for the commit.
+        
+        Args:
+            id_data: Dictionary containing extracted ID information
+            user_id: Optional user identifier
+            retries: Further attempts if the commit fails
+            
+        Returns:
+            Tuple of the data being stored, its client-generated document ID and a Future
+            resolving to that ID once committed
+        """
+        # Add metadata to the ID data
+        enhanced_data = {
+            **id_data,
+            "timestamp": datetime.utcnow(),
+            "user_id": user_id or "anonymous",
+            "status": "active",
+            "created_at": datetime.utcnow().isoformat(),
+            "updated_at": datetime.utcnow().isoformat()
+        }
+        
+        doc_ref = self.db.collection('id_documents').document()
+        future = self._submit([(doc_ref, enhanced_data, False)], "id_document", retries)
+        return enhanced_data, doc_ref.id, future
+
     def store_id_data(self, id_data: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Store extracted ID data in Firestore database.
@@ -60,21 +235,13 @@ class FirebaseConfig:
             }
         
         try:
-            # Add metadata to the ID data
-            enhanced_data = {
-                **id_data,
-                "timestamp": datetime.utcnow(),
-                "user_id": user_id or "anonymous",
-                "status": "active",
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
-            }
-            
             # Store in Firestore
-            doc_ref = self.db.collection('id_documents').add(enhanced_data)
-            document_id = doc_ref[1].id
+            enhanced_data, document_id, future = self.submit_id_data(id_data, user_id)
+            if self.wal is None:
+                document_id = future.result(timeout=WRITE_TIMEOUT)
+            # Otherwise the data is on local disk and the write-ahead log delivers it to Firestore
             
-            print(f"ID data stored successfully with document ID: {document_id}")
+            logger.debug("ID data stored successfully with document ID: %s", document_id)
             
             return {
                 "success": True,
@@ -84,7 +251,7 @@ class FirebaseConfig:
             }
             
         except Exception as e:
-            print(f"Error storing ID data: {e}")
+            logger.error("Error storing ID data: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -126,7 +293,7 @@ class FirebaseConfig:
                 }
                 
         except Exception as e:
-            print(f"Error retrieving ID data: {e}")
+            logger.error("Error retrieving ID data: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -166,7 +333,7 @@ class FirebaseConfig:
             }
             
         except Exception as e:
-            print(f"Error retrieving user documents: {e}")
+            logger.error("Error retrieving user documents: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -204,7 +371,7 @@ class FirebaseConfig:
             }
             
         except Exception as e:
-            print(f"Error updating document: {e}")
+            logger.error("Error updating document: %s", e)
             return {
                 "success": False,
                 "error": str(e)
@@ -242,12 +409,62 @@ class FirebaseConfig:
             }
             
         except Exception as e:
-            print(f"Error deleting document: {e}")
+            logger.error("Error deleting document: %s", e)
             return {
                 "success": False,
                 "error": str(e)
             }
 
+    def submit_transaction_data(self, transaction_data: Dict[str, Any], user_id: Optional[str] = None,
+                                retries: int = 0) -> Tuple[Dict[str, Any], str, Future]:
+        """
+        Queue transaction data on the batched write pipeline without waiting for the commit.
+        
+        Args:
+            transaction_data: Dictionary containing transaction information
+            user_id: Optional user identifier
+            retries: Further attempts if the commit fails
+            
+        Returns:
+            Tuple of the data being stored, its client-generated document ID and a Future
+            resolving to that ID once committed
+        """
+        # Add metadata to the transaction data
+        enhanced_data = {
+            **transaction_data,
+            "timestamp": datetime.utcnow(),
+            "user_id": user_id or "anonymous",
+            "status": "active",
+            "created_at": datetime.utcnow().isoformat(),
+            "updated_at": datetime.utcnow().isoformat()
+        }
+        
+        # Transactions do not feed the receipt agent's spending rollups: those are per ADK user and
+        # keyed by receipt date, while live transactions belong to the session's caller
+        doc_ref = self.db.collection('transactions').document()
+        future = self._submit([(doc_ref, enhanced_data, False)], "transaction", retries)
+        return enhanced_data, doc_ref.id, future
+
+    def _submit(self, writes: List[tuple], kind: str, retries: int) -> Future:
+        """
+        Hand a write group to the write-ahead log, or straight to the batch writer if it is disabled.
+        
+        Args:
+            writes: (reference, data, merge) writes; the first is the record itself
+            kind: Record type, for metrics and logs
+            retries: Further attempts if the commit fails (the write-ahead log retries until it commits)
+            
+        Returns:
+            Future resolving to the record's document ID once committed in Firestore
+        """
+        if self.wal is not None:
+            return _timed_write(self.wal.append(kind, writes), kind)
+        # The record is created rather than set, so a retry of a group that did commit fails instead of
+        # applying the group again
+        record_ref, record, _ = writes[0]
+        writes = [(record_ref, record, CREATE)] + writes[1:]
+        return _with_retries(lambda: _timed_write(self.writer.submit(writes), kind), kind, retries, record_ref.id)
+
     def store_transaction_data(self, transaction_data: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Store transaction data in Firestore database.
@@ -267,21 +484,13 @@ class FirebaseConfig:
             }
         
         try:
-            # Add metadata to the transaction data
-            enhanced_data = {
-                **transaction_data,
-                "timestamp": datetime.utcnow(),
-                "user_id": user_id or "anonymous",
-                "status": "active",
-                "created_at": datetime.utcnow().isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
-            }
-            
             # Store in Firestore
-            doc_ref = self.db.collection('transactions').add(enhanced_data)
-            document_id = doc_ref[1].id
+            enhanced_data, document_id, future = self.submit_transaction_data(transaction_data, user_id)
+            if self.wal is None:
+                document_id = future.result(timeout=WRITE_TIMEOUT)
+            # Otherwise the data is on local disk and the write-ahead log delivers it to Firestore
             
-            print(f"Transaction data stored successfully with document ID: {document_id}")
+            logger.debug("Transaction data stored successfully with document ID: %s", document_id)
             
             return {
                 "success": True,
@@ -291,7 +500,7 @@ class FirebaseConfig:
             }
             
         except Exception as e:
-            print(f"Error storing transaction data: {e}")
+            logger.error("Error storing transaction data: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -337,7 +546,7 @@ class FirebaseConfig:
             }
             
         except Exception as e:
-            print(f"Error retrieving user transactions: {e}")
+            logger.error("Error retrieving user transactions: %s", e)
             return {
                 "success": False,
                 "error": str(e),
@@ -348,12 +557,22 @@ class FirebaseConfig:
 firebase_config = None
 
 def get_firebase_config() -> FirebaseConfig:
-    """Get or create Firebase configuration instance"""
+    """Get or create Firebase configuration instance, with a write-ahead log if `enable_write_ahead_log` was called"""
     global firebase_config
     if firebase_config is None:
-        firebase_config = FirebaseConfig()
+        firebase_config = FirebaseConfig(wal_worker=_wal_worker, wal_workers=_wal_workers)
     return firebase_config
 
+def close_firebase_config(timeout: float = WRITE_TIMEOUT):
+    """Commit writes still queued on the batch writer and stop it, e.g. when the server shuts down."""
+    if firebase_config is not None:
+        # Writes not yet committed stay in the logs and are replayed on the next start
+        for wal in [firebase_config.wal] + firebase_config.orphaned_wals:
+            if wal is not None:
+                wal.close(timeout)
+    if firebase_config is not None and firebase_config.writer is not None:
+        firebase_config.writer.close(timeout)
+
 def store_extracted_id_data(id_data: Dict[str, Any], user_id: Optional[str] = None) -> Dict[str, Any]:
     """
     Convenience function to store extracted ID data.
@@ -381,3 +600,41 @@ def store_transaction_data(transaction_data: Dict[str, Any], user_id: Optional[s
     """
     firebase = get_firebase_config()
     return firebase.store_transaction_data(transaction_data, user_id)
+
+def submit_extracted_id_data(id_data: Dict[str, Any], user_id: Optional[str] = None,
+                             retries: int = WRITE_RETRIES) -> Tuple[str, Future]:
+    """
+    Queue extracted ID data for storage, retrying failed commits, without waiting for it.
+    
+    Args:
+        id_data: Dictionary containing extracted ID information
+        user_id: Optional user identifier
+        retries: Further attempts if the commit fails
+        
+    Returns:
+        Tuple of the client-generated document ID and a Future resolving once it is stored
+    """
+    firebase = get_firebase_config()
+    if not firebase.db:
+        raise RuntimeError("Firebase not initialized")
+    _, document_id, future = firebase.submit_id_data(id_data, user_id, retries)
+    return document_id, future
+
+def submit_transaction_data(transaction_data: Dict[str, Any], user_id: Optional[str] = None,
+                            retries: int = WRITE_RETRIES) -> Tuple[str, Future]:
+    """
+    Queue transaction data for storage, retrying failed commits, without waiting for it.
+    
+    Args:
+        transaction_data: Dictionary containing transaction information
+        user_id: Optional user identifier
+        retries: Further attempts if the commit fails
+        
+    Returns:
+        Tuple of the client-generated document ID and a Future resolving once it is stored
+    """
+    firebase = get_firebase_config()
+    if not firebase.db:
+        raise RuntimeError("Firebase not initialized")
+    _, document_id, future = firebase.submit_transaction_data(transaction_data, user_id, retries)
+    return document_id, future
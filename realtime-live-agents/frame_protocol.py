@@ -0,0 +1,103 @@
+import struct
+import time
+
+# Binary websocket frame: a fixed header followed by the raw media payload.
+#   stream type  uint8   (see STREAM_* below)
+#   sequence     uint32  per-stream counter, wraps at 2**32
+#   timestamp    uint64  sender clock in milliseconds
+# All fields are big-endian. The payload is the unencoded PCM or JPEG bytes.
+HEADER = struct.Struct("!BIQ")
+HEADER_SIZE = HEADER.size
+
+STREAM_AUDIO = 1  # audio/pcm (16 kHz upstream, 24 kHz downstream)
+STREAM_VIDEO = 2  # image/jpeg
+
+STREAM_MIME_TYPES = {
+    STREAM_AUDIO: "audio/pcm",
+    STREAM_VIDEO: "image/jpeg",
+}
+
+# Value of "protocol" in the setup message that asks for binary frames, and in the server's reply.
+BINARY_PROTOCOL = "binary-v1"
+
+_SEQUENCE_MOD = 2 ** 32
+
+
+class FrameError(ValueError):
+    """Raised for binary frames that are too short or carry an unknown stream type."""
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def decode_frame(message) -> tuple:
+    """
+    Split a binary frame into its header fields and payload without copying the payload.
+
+    Args:
+        message: The bytes received from the websocket
+
+    Returns:
+        (stream_type, sequence, timestamp_ms, payload) where payload is a memoryview into message
+    """
+    view = memoryview(message)
+    if len(view) < HEADER_SIZE:
+        raise FrameError(f"Frame of {len(view)} bytes is shorter than the {HEADER_SIZE}-byte header")
+    stream_type, sequence, timestamp = HEADER.unpack_from(view)
+    if stream_type not in STREAM_MIME_TYPES:
+        raise FrameError(f"Unknown stream type: {stream_type}")
+    return stream_type, sequence, timestamp, view[HEADER_SIZE:]
+
+
+def encode_frame(stream_type: int, sequence: int, payload, timestamp: int = None) -> bytes:
+    """
+    Build a binary frame for a payload.
+
+    Args:
+        stream_type: One of the STREAM_* constants
+        sequence: Per-stream sequence number
+        payload: Raw media bytes (bytes, bytearray or memoryview)
+        timestamp: Milliseconds since the epoch; defaults to now
+
+    Returns:
+        Header and payload as a single bytes object
+    """
+    header = HEADER.pack(stream_type, sequence % _SEQUENCE_MOD, now_ms() if timestamp is None else timestamp)
+    return header + payload
+
+
+class SequenceTracker:
+    """Counts frames per stream and how many were missing or arrived out of order."""
+
+    def __init__(self):
+        self._next = {}
+        self.received = 0
+        self.gaps = 0
+        self.reordered = 0
+
+    def observe(self, stream_type: int, sequence: int) -> bool:
+        """Record a received frame; returns False if it is older than one already seen on its stream."""
+        self.received += 1
+        expected = self._next.get(stream_type)
+        if expected is not None and sequence != expected:
+            # Distance ahead of the expected number, modulo wrap-around.
+            ahead = (sequence - expected) % _SEQUENCE_MOD
+            if ahead >= _SEQUENCE_MOD // 2:
+                self.reordered += 1
+                return False
+            self.gaps += ahead
+        self._next[stream_type] = (sequence + 1) % _SEQUENCE_MOD
+        return True
+
+
+class SequenceCounter:
+    """Next outgoing sequence number for each stream."""
+
+    def __init__(self):
+        self._next = {}
+
+    def next(self, stream_type: int) -> int:
+        sequence = self._next.get(stream_type, 0)
+        self._next[stream_type] = (sequence + 1) % _SEQUENCE_MOD
+        return sequence
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import time
+
+import websockets
+from google.genai import errors, types
+
+import metrics
+
+logger = logging.getLogger("live_agent")
+
+# How the model context is kept bounded in long sessions: "sliding_window" (the only policy the
+# Live API offers) drops the oldest turns once the context reaches the trigger; "off" disables it.
+LIVE_CONTEXT_COMPRESSION = os.getenv("LIVE_CONTEXT_COMPRESSION", "sliding_window").lower()
+# Context size in tokens that starts a compression, and the size it compresses down to; 0 uses the API defaults.
+LIVE_CONTEXT_TRIGGER_TOKENS = int(os.getenv("LIVE_CONTEXT_TRIGGER_TOKENS", "0"))
+LIVE_CONTEXT_TARGET_TOKENS = int(os.getenv("LIVE_CONTEXT_TARGET_TOKENS", "0"))
+# Ask Gemini for resumption handles so a dropped or recycled connection continues the same conversation.
+LIVE_SESSION_RESUMPTION = os.getenv("LIVE_SESSION_RESUMPTION", "1") != "0"
+# Reconnects tried after a lost connection before the session gives up.
+LIVE_RESUME_ATTEMPTS = int(os.getenv("LIVE_RESUME_ATTEMPTS", "3"))
+
+SESSION_RESUMPTIONS = metrics.Counter(
+    "live_session_resumptions_total", "Gemini connections replaced by a resumed one, by cause.", labelnames=("reason",))
+
+
+def context_config() -> dict:
+    """Context compression and session resumption entries for the shared live config."""
+    config = {}
+    if LIVE_CONTEXT_COMPRESSION == "sliding_window":
+        config["context_window_compression"] = types.ContextWindowCompressionConfig(
+            trigger_tokens=LIVE_CONTEXT_TRIGGER_TOKENS or None,
+            sliding_window=types.SlidingWindow(target_tokens=LIVE_CONTEXT_TARGET_TOKENS or None),
+        )
+    elif LIVE_CONTEXT_COMPRESSION != "off":
+        logger.warning("Unknown LIVE_CONTEXT_COMPRESSION %r, context compression disabled", LIVE_CONTEXT_COMPRESSION)
+    if LIVE_SESSION_RESUMPTION:
+        config["session_resumption"] = types.SessionResumptionConfig()
+    return config
+
+
+class ResumableSession:
+    """
+    A Gemini Live session that survives its connection.
+
+    Wraps the session of a connect context manager and keeps the latest resumption handle Gemini
+    sends. When Gemini announces a disconnect (go_away) the connection is replaced between turns;
+    when it drops unexpectedly it is replaced straight away. Either way the new connection resumes
+    the conversation from the handle instead of replaying it, and callers keep using the same
+    object for sending and receiving.
+    """
+
+    def __init__(self, connection, reconnect, max_attempts: int = LIVE_RESUME_ATTEMPTS):
+        """
+        Args:
+            connection: Async context manager yielding the first session (a fresh or pooled connection)
+            reconnect: Called with a resumption handle, returns the connect context manager that resumes it
+            max_attempts: Reconnects tried after a lost connection before its error is passed on to the caller
+        """
+        self._connection = connection
+        self._reconnect = reconnect
+        self.max_attempts = max_attempts
+        self.session = None
+        self.handle = None
+        self.resumptions = 0
+        self._in_turn = False
+        self._go_away = False
+        self._ready = asyncio.Event()
+
+    async def __aenter__(self):
+        self.session = await self._connection.__aenter__()
+        self._ready.set()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if self._connection is not None:
+            return await self._connection.__aexit__(exc_type, exc, traceback)
+
+    async def send_realtime_input(self, **kwargs):
+        # Input arriving while the connection is being replaced waits for the resumed session
+        await self._ready.wait()
+        await self.session.send_realtime_input(**kwargs)
+
+    async def send_tool_response(self, **kwargs):
+        await self._ready.wait()
+        await self.session.send_tool_response(**kwargs)
+
+    async def receive(self):
+        """Yield server messages until the current turn completes, like `AsyncSession.receive`."""
+        while True:
+            try:
+                async for message in self.session.receive():
+                    if message.session_resumption_update is not None or message.go_away is not None:
+                        self._observe(message)
+                        if self._go_away and not self._in_turn:
+                            await self._resume("go_away")
+                            return
+                        continue
+                    yield message
+                    self._in_turn = not (message.server_content is not None and message.server_content.turn_complete)
+                if self._go_away:
+                    await self._resume("go_away")
+                return
+            except (websockets.exceptions.ConnectionClosed, errors.APIError) as e:
+                if self.handle is None:
+                    raise
+                logger.warning("Gemini connection lost, resuming session: %s", e)
+                await self._resume_with_retries(e)
+
+    def _observe(self, message) -> None:
+        update = message.session_resumption_update
+        if update is not None and update.resumable and update.new_handle:
+            self.handle = update.new_handle
+        if message.go_away is not None and self.handle is not None:
+            logger.info("Gemini will close the connection, resuming after this turn",
+                        extra={"time_left": str(message.go_away.time_left)})
+            self._go_away = True
+
+    async def _resume_with_retries(self, error: Exception) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self._resume("connection_lost")
+                return
+            except Exception as e:
+                logger.warning("Resuming Gemini session failed (attempt %s): %s", attempt, e)
+                await asyncio.sleep(0.5 * attempt)
+        raise error
+
+    async def _resume(self, reason: str) -> None:
+        self._ready.clear()
+        self._go_away = False
+        try:
+            if self._connection is not None:
+                connection, self._connection = self._connection, None
+                try:
+                    await connection.__aexit__(None, None, None)
+                except Exception as e:
+                    logger.debug("Error closing replaced Gemini connection: %s", e)
+            started = time.monotonic()
+            connection = self._reconnect(self.handle)
+            self.session = await connection.__aenter__()
+            self._connection = connection
+            self.resumptions += 1
+            SESSION_RESUMPTIONS.inc(reason=reason)
+            logger.info("Gemini session resumed", extra={
+                "reason": reason, "resume_seconds": round(time.monotonic() - started, 3)
+            })
+        finally:
+            self._ready.set()
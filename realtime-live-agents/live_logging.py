@@ -0,0 +1,142 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Level for third-party libraries (websockets, google-genai, PIL, ...), kept separate so DEBUG stays readable.
+LIBRARY_LOG_LEVEL = os.getenv("LIBRARY_LOG_LEVEL", "WARNING").upper()
+# This service's own loggers, which LOG_LEVEL applies to.
+APP_LOGGERS = ("live_agent", "firebase_config", "metrics")
+# Records buffered for the writer thread; when it falls behind, further records are dropped.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# At most this many records per second for each sampled event (e.g. per audio chunk).
+LOG_SAMPLE_PER_SECOND = int(os.getenv("LOG_SAMPLE_PER_SECOND", "1"))
+
+# Set by the websocket handler; copied into tasks and tool threads started for the session.
+session_id = contextvars.ContextVar("session_id", default=None)
+
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, session and any `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        if getattr(record, "session_id", None):
+            entry["session_id"] = record.session_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and key != "session_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; never blocks the caller, drops records when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Capture the session in the calling thread; formatting happens on the writer thread.
+        record.session_id = session_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogSampler:
+    """Per-key rate limit for high-frequency events, reporting how many records were suppressed."""
+
+    def __init__(self, per_second: int = LOG_SAMPLE_PER_SECOND):
+        self.per_second = per_second
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str):
+        """
+        Whether a record for `key` may be emitted now.
+
+        Returns:
+            None if the record should be skipped, otherwise the number of records suppressed
+            since the last one that was emitted
+        """
+        window = int(time.monotonic())
+        with self._lock:
+            start, emitted, suppressed = self._windows.get(key, (window, 0, 0))
+            if start != window:
+                start, emitted = window, 0
+            if emitted >= self.per_second:
+                self._windows[key] = (start, emitted, suppressed + 1)
+                return None
+            self._windows[key] = (start, emitted + 1, 0)
+            return suppressed
+
+
+_sampler = LogSampler()
+
+
+def log_sampled(logger: logging.Logger, level: int, key: str, message: str, *args, **fields) -> None:
+    """
+    Log a high-frequency event at most LOG_SAMPLE_PER_SECOND times a second per key.
+
+    Callers in hot loops should check `logger.isEnabledFor(level)` first so that nothing, not even
+    this call, happens while the level is disabled.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    suppressed = _sampler.allow(key)
+    if suppressed is None:
+        return
+    if suppressed:
+        fields["suppressed"] = suppressed
+    logger.log(level, message, *args, extra=fields)
+
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level: str = LOG_LEVEL, library_level: str = LIBRARY_LOG_LEVEL) -> None:
+    """
+    Route all logging through a bounded queue to a writer thread that prints JSON lines to stdout.
+
+    Safe to call more than once; each process (e.g. every server worker) calls it at startup.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter())
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=False)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        root.handlers = [_NonBlockingQueueHandler(log_queue)]
+        root.setLevel(library_level)
+        for name in APP_LOGGERS:
+            logging.getLogger(name).setLevel(level)
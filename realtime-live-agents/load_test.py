@@ -0,0 +1,259 @@
+"""
+Load test for the realtime bridge, fully offline.
+
+Starts main.py against the FakeLiveClient (FAKE_GEMINI_LIVE=1) unless --url points at a running
+server, opens --sessions synthetic websocket clients that stream PCM audio in real time plus a
+JPEG frame every second, and reports first-audio latency, sessions per core and CPU per session.
+Recorded input can be replayed with --pcm (raw 16 kHz 16-bit mono) and --jpeg-dir.
+
+Usage:
+    python load_test.py [--sessions 200] [--turns 3] [--workers 1] [--binary]
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import math
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+from frame_protocol import BINARY_PROTOCOL, HEADER_SIZE, STREAM_AUDIO, STREAM_VIDEO, encode_frame
+
+CHUNK_MS = 40
+INPUT_BYTES_PER_MS = 32
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def synthetic_pcm(seconds: float = 10.0) -> bytes:
+    """A 440 Hz tone as 16 kHz 16-bit mono PCM."""
+    samples = int(16000 * seconds)
+    return b"".join(
+        int(8000 * math.sin(2 * math.pi * 440 * i / 16000)).to_bytes(2, "little", signed=True)
+        for i in range(samples)
+    )
+
+
+def synthetic_jpegs(count: int = 5) -> list:
+    """Camera-sized frames with a moving block, so some frames pass the duplicate filter."""
+    from PIL import Image, ImageDraw
+
+    frames = []
+    for index in range(count):
+        image = Image.new("RGB", (640, 480), "white")
+        ImageDraw.Draw(image).rectangle([60 + index * 90, 120, 220 + index * 90, 360], fill="navy")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=80)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+def process_tree_cpu(pid: int) -> float:
+    """CPU seconds (user + system) used so far by a process and its children, from /proc."""
+    total, pending = 0.0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            fields = Path(f"/proc/{current}/stat").read_text().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+        total += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        try:
+            pending.extend(int(child) for child in Path(f"/proc/{current}/task/{current}/children").read_text().split())
+        except (FileNotFoundError, ProcessLookupError):
+            pass
+    return total
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ClientSession:
+    """One synthetic caller: speaks `turns` utterances and times the first reply audio of each."""
+
+    def __init__(self, url: str, pcm: bytes, jpegs: list, turn_ms: int, turns: int, binary: bool):
+        self.url = url
+        self.pcm = pcm
+        self.jpegs = jpegs
+        self.turn_ms = turn_ms
+        self.turns = turns
+        self.binary = binary
+        self.latencies = []
+        self.error = None
+        self._sequences = {STREAM_AUDIO: 0, STREAM_VIDEO: 0}
+        self._first_audio = None
+        self._binary_enabled = False
+
+    async def run(self):
+        try:
+            async with websockets.connect(self.url, max_size=None) as websocket:
+                setup = {"setup": {"generation_config": {"response_modalities": ["AUDIO"]}}}
+                if self.binary:
+                    setup["protocol"] = BINARY_PROTOCOL
+                await websocket.send(json.dumps(setup))
+                reader = asyncio.create_task(self._read(websocket))
+                try:
+                    for turn in range(self.turns):
+                        await self._speak(websocket, turn)
+                finally:
+                    reader.cancel()
+        except Exception as e:
+            self.error = repr(e)
+
+    async def _speak(self, websocket, turn: int):
+        chunk_bytes = CHUNK_MS * INPUT_BYTES_PER_MS
+        chunks = self.turn_ms // CHUNK_MS
+        offset = turn * chunks * chunk_bytes
+        self._first_audio = asyncio.get_running_loop().create_future()
+        started = time.monotonic()
+        for index in range(chunks):
+            # Pace like a microphone: chunk i is sent once its CHUNK_MS of audio has been captured.
+            await asyncio.sleep(max(0.0, started + (index + 1) * CHUNK_MS / 1000 - time.monotonic()))
+            if index % (1000 // CHUNK_MS) == 0:
+                await self._send(websocket, STREAM_VIDEO, self.jpegs[(offset // chunk_bytes + index) % len(self.jpegs)])
+            start = (offset + index * chunk_bytes) % (len(self.pcm) - chunk_bytes)
+            await self._send(websocket, STREAM_AUDIO, self.pcm[start:start + chunk_bytes])
+
+        # Latency runs from the end of the utterance to the first audio of the reply.
+        spoke_at = time.monotonic()
+        await asyncio.wait_for(self._first_audio, 30)
+        self.latencies.append(time.monotonic() - spoke_at)
+        # Let the reply play out before speaking again.
+        await asyncio.sleep(1.0)
+
+    async def _send(self, websocket, stream_type: int, payload: bytes):
+        if self._binary_enabled:
+            sequence = self._sequences[stream_type]
+            self._sequences[stream_type] += 1
+            await websocket.send(encode_frame(stream_type, sequence, payload))
+            return
+        mime_type = "audio/pcm" if stream_type == STREAM_AUDIO else "image/jpeg"
+        await websocket.send(json.dumps({"realtime_input": {"media_chunks": [
+            {"mime_type": mime_type, "data": base64.b64encode(payload).decode("ascii")}
+        ]}}))
+
+    async def _read(self, websocket):
+        async for message in websocket:
+            if isinstance(message, bytes):
+                is_audio = len(message) > HEADER_SIZE and message[0] == STREAM_AUDIO
+            else:
+                data = json.loads(message)
+                if data.get("protocol") == BINARY_PROTOCOL:
+                    self._binary_enabled = True
+                is_audio = "audio" in data
+            if is_audio and self._first_audio is not None and not self._first_audio.done():
+                self._first_audio.set_result(None)
+
+
+def start_server(port: int, workers: int, turn_ms: int, reply_latency: float, tool_call_every: int) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "FAKE_GEMINI_LIVE": "1",
+        "FAKE_LIVE_TURN_AUDIO_MS": str(turn_ms),
+        "FAKE_LIVE_REPLY_LATENCY": str(reply_latency),
+        "FAKE_LIVE_TOOL_CALL_EVERY": str(tool_call_every),
+        "SERVER_HOST": "127.0.0.1",
+        "SERVER_PORT": str(port),
+        "SERVER_WORKERS": str(workers),
+        "METRICS_PORT": "0",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+    }
+    server = subprocess.Popen([sys.executable, "main.py"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            # Give the remaining workers a moment to bind the shared port as well.
+            time.sleep(1.0 if workers > 1 else 0)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("Server did not start listening within 60 seconds")
+
+
+async def run_load(args, url: str, pcm: bytes, jpegs: list) -> list:
+    sessions = [ClientSession(url, pcm, jpegs, args.turn_ms, args.turns, args.binary) for _ in range(args.sessions)]
+
+    async def staggered(index, session):
+        await asyncio.sleep(args.ramp * index / max(1, args.sessions))
+        await session.run()
+
+    await asyncio.gather(*(staggered(index, session) for index, session in enumerate(sessions)))
+    return sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the realtime bridge")
+    parser.add_argument("--sessions", type=int, default=200, help="Concurrent synthetic clients")
+    parser.add_argument("--turns", type=int, default=3, help="Utterances per client")
+    parser.add_argument("--turn-ms", type=int, default=2000, help="Audio per utterance in milliseconds")
+    parser.add_argument("--ramp", type=float, default=5.0, help="Seconds over which clients connect")
+    parser.add_argument("--reply-latency", type=float, default=0.3, help="Fake Gemini thinking time in seconds")
+    parser.add_argument("--tool-call-every", type=int, default=0, help="Fake a tool call every N-th turn (0 = never)")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--port", type=int, default=9182, help="Port for the spawned server")
+    parser.add_argument("--url", help="Test an already running server instead of spawning one")
+    parser.add_argument("--binary", action="store_true", help="Negotiate binary frames instead of base64 JSON")
+    parser.add_argument("--pcm", help="Raw 16 kHz 16-bit mono PCM file to replay")
+    parser.add_argument("--jpeg-dir", help="Directory of JPEG frames to replay")
+    args = parser.parse_args()
+
+    pcm = Path(args.pcm).read_bytes() if args.pcm else synthetic_pcm()
+    jpegs = ([path.read_bytes() for path in sorted(Path(args.jpeg_dir).glob("*.jp*g"))]
+             if args.jpeg_dir else synthetic_jpegs())
+
+    server = None if args.url else start_server(args.port, args.workers, args.turn_ms, args.reply_latency, args.tool_call_every)
+    url = args.url or f"ws://127.0.0.1:{args.port}"
+    try:
+        server_cpu_before = process_tree_cpu(server.pid) if server else None
+        client_cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.monotonic()
+        sessions = asyncio.run(run_load(args, url, pcm, jpegs))
+        wall = time.monotonic() - started
+        server_cpu = process_tree_cpu(server.pid) - server_cpu_before if server else None
+        client_usage = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=60)
+
+    client_cpu = (client_usage.ru_utime + client_usage.ru_stime
+                  - client_cpu_before.ru_utime - client_cpu_before.ru_stime)
+    completed = [session for session in sessions if session.error is None]
+    latencies = [latency for session in sessions for latency in session.latencies]
+    errors = {}
+    for session in sessions:
+        if session.error:
+            errors[session.error] = errors.get(session.error, 0) + 1
+
+    print(f"{len(completed)}/{len(sessions)} sessions completed in {wall:.1f} s "
+          f"({'binary frames' if args.binary else 'base64 JSON'}, {args.workers} server worker(s))")
+    if latencies:
+        print(f"First-audio latency over {len(latencies)} turns: p50 {statistics.median(latencies) * 1000:.0f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms (fake reply latency {args.reply_latency * 1000:.0f} ms)")
+    if server_cpu is not None and sessions:
+        cores_used = server_cpu / wall
+        print(f"Server CPU: {server_cpu:.2f} s total, {server_cpu / len(sessions) * 1000:.1f} ms per session, "
+              f"{cores_used:.2f} cores busy on average")
+        if cores_used:
+            print(f"Sessions per core: {len(sessions) / cores_used:.0f} (concurrent sessions / cores busy)")
+    print(f"Load generator CPU: {client_cpu:.2f} s")
+    for error, count in errors.items():
+        print(f"  {count} x {error}")
+
+
+if __name__ == "__main__":
+    main()
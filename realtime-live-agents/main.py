@@ -1,36 +1,160 @@
 ## pip install google-genai==0.3.0
 
 import asyncio
+import contextvars
+import functools
 import json
+import logging
+import multiprocessing.connection
 import os
+import signal
+import socket
+import time
+import uuid
+from types import MappingProxyType
 import websockets
+from concurrent.futures import ThreadPoolExecutor
 from google import genai
 from google.genai import types
 import base64
-from firebase_config import store_extracted_id_data, get_firebase_config, store_transaction_data
+from firebase_config import (
+    store_extracted_id_data, get_firebase_config, store_transaction_data, close_firebase_config,
+    submit_extracted_id_data, submit_transaction_data, enable_write_ahead_log
+)
+from frame_protocol import (
+    BINARY_PROTOCOL, STREAM_AUDIO, STREAM_VIDEO, FrameError, SequenceCounter, SequenceTracker,
+    decode_frame, encode_frame
+)
+import metrics
+from live_context import ResumableSession, context_config
+from live_logging import log_sampled, session_id, setup_logging
+from session_pool import LIVE_POOL_SETUP, LIVE_POOL_SIZE, LiveSessionPool
+from session_queues import DownstreamQueue, UpstreamQueue, is_speech
+from tool_registry import ToolRegistry
+from video_gate import VideoFrameGate
 
 # Load API key from environment
 os.environ['GOOGLE_API_KEY'] = 'GEMINI_API_KEY'  # replace with your actual API key
 MODEL = "gemini-2.0-flash-exp"  # use your model ID
 
-client = genai.Client(
-    http_options={
-        'api_version': 'v1alpha',
-    }
-)
+logger = logging.getLogger("live_agent")
+
+if os.getenv("FAKE_GEMINI_LIVE"):
+    # Offline stand-in for load tests; see fake_live.py
+    from fake_live import FakeLiveClient
+    client = FakeLiveClient()
+else:
+    client = genai.Client(
+        http_options={
+            'api_version': 'v1alpha',
+        }
+    )
+
+# Tool functions do blocking Firestore writes, so they run on a bounded thread pool
+# instead of the event loop that forwards every session's audio.
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "8"))
+DEFAULT_TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+TOOL_TIMEOUTS = {
+    "extract_id_info": float(os.getenv("EXTRACT_ID_INFO_TIMEOUT", DEFAULT_TOOL_TIMEOUT)),
+    "record_transaction": float(os.getenv("RECORD_TRANSACTION_TIMEOUT", DEFAULT_TOOL_TIMEOUT)),
+}
+tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+# Functions Gemini may call; their declarations are derived from signature and docstring at import
+tools = ToolRegistry()
+
+# Answer tool calls as soon as their input is validated ("accepted", with the client-generated document ID)
+# and finish the Firestore write in the background, instead of holding the conversation for the commit.
+# Only inside a live session: tools called directly (e.g. by test_transaction.py) wait for the write.
+SPECULATIVE_TOOL_ACK = os.getenv("SPECULATIVE_TOOL_ACK", "0") == "1"
+# Set by the websocket handler: sends an event to the session's client from any thread.
+client_events = contextvars.ContextVar("client_events", default=None)
+
+
+def accept_and_persist(name, data, submit):
+    """
+    Queue a validated tool result for storage and acknowledge it before the write commits.
+    
+    If the write still fails after its retries, the session's client receives a
+    `persistence_failed` event for the document.
+    
+    Args:
+        name: Tool name, for logs and the failure event
+        data: The validated tool result to store
+        submit: submit_extracted_id_data or submit_transaction_data
+        
+    Returns:
+        The data with storage_status "accepted" and its firebase_document_id
+    """
+    try:
+        document_id, future = submit(data)
+    except Exception as e:
+        data["storage_status"] = "storage_error"
+        data["storage_error"] = str(e)
+        logger.error("Error queueing %s data for Firebase: %s", name, e)
+        return data
+    
+    notify_client = client_events.get()
+    
+    def persisted(future):
+        error = future.exception()
+        if error is None:
+            logger.info("%s stored in Firebase with document ID: %s", name, document_id)
+            return
+        logger.error("%s was accepted but could not be stored in Firebase: %s", name, error,
+                     extra={"document_id": document_id})
+        if notify_client is not None:
+            notify_client({"event": "persistence_failed", "tool": name, "document_id": document_id, "error": str(error)})
+    
+    # Completion callbacks run on the writer thread; keep this session's context for their logs
+    context = contextvars.copy_context()
+    future.add_done_callback(lambda future: context.run(persisted, future))
+    data["firebase_document_id"] = document_id
+    data["storage_status"] = "accepted"
+    return data
+
+
+async def run_tool(name, func, *args):
+    """
+    Run a blocking tool function on the tool thread pool without stalling the event loop.
+    
+    Args:
+        name: Tool name, used to look up its timeout
+        func: The tool function
+        *args: Positional arguments for the tool function
+        
+    Returns:
+        The tool's result, or a failure result if it did not finish within its timeout
+    """
+    timeout = TOOL_TIMEOUTS.get(name, DEFAULT_TOOL_TIMEOUT)
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the current context so the tool's log lines carry the session ID
+    call = functools.partial(contextvars.copy_context().run, func, *args)
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(tool_executor, call), timeout)
+    except asyncio.TimeoutError:
+        # The worker thread cannot be interrupted; the write may still complete later.
+        logger.warning("Tool %s timed out after %ss", name, timeout)
+        return {
+            "storage_status": "storage_timeout",
+            "storage_error": f"{name} did not complete within {timeout} seconds"
+        }
 
 
 # Enhanced function for extract_id_info with Firebase storage
-def extract_id_info(name, id_number, date_of_birth, address, additional_info):
+@tools.tool
+def extract_id_info(name: str, id_number: str, date_of_birth: str = "", address: str = "", additional_info: str = ""):
     """
-    Extract ID information and store it in Firebase.
+    Extract and log important key-value pairs from an ID document shown to the camera.
+    
+    The extracted data is stored in Firebase.
     
     Args:
-        name: Full name from ID
-        id_number: ID document number
-        date_of_birth: Date of birth
-        address: Address information
-        additional_info: Additional information from ID
+        name: Full name as it appears on the ID
+        id_number: The ID number or document number
+        date_of_birth: Date of birth in the format shown on the ID
+        address: Address information from the ID
+        additional_info: Any other important information visible on the ID
         
     Returns:
         Dictionary with extraction results and Firebase storage status
@@ -44,6 +168,9 @@ def extract_id_info(name, id_number, date_of_birth, address, additional_info):
         "extraction_status": "success"
     }
     
+    if SPECULATIVE_TOOL_ACK and client_events.get() is not None:
+        return accept_and_persist("extract_id_info", id_data, submit_extracted_id_data)
+    
     # Store in Firebase
     try:
         storage_result = store_extracted_id_data(id_data)
@@ -51,31 +178,35 @@ def extract_id_info(name, id_number, date_of_birth, address, additional_info):
         if storage_result.get("success"):
             id_data["firebase_document_id"] = storage_result.get("document_id")
             id_data["storage_status"] = "stored_successfully"
-            print(f"ID data stored in Firebase with document ID: {storage_result.get('document_id')}")
+            logger.info("ID data stored in Firebase with document ID: %s", storage_result.get('document_id'))
         else:
             id_data["storage_status"] = "storage_failed"
             id_data["storage_error"] = storage_result.get("error", "Unknown error")
-            print(f"Failed to store ID data in Firebase: {storage_result.get('error')}")
+            logger.warning("Failed to store ID data in Firebase: %s", storage_result.get('error'))
             
     except Exception as e:
         id_data["storage_status"] = "storage_error"
         id_data["storage_error"] = str(e)
-        print(f"Error storing ID data in Firebase: {e}")
+        logger.error("Error storing ID data in Firebase: %s", e)
     
     return id_data
 
 # Enhanced function for record_transaction with Firebase storage
-def record_transaction(amount, description, category, transaction_type, merchant=None, payment_method=None):
+@tools.tool
+def record_transaction(amount: str, description: str, category: str, transaction_type: str,
+                       merchant: str = None, payment_method: str = None):
     """
-    Record a transaction and store it in Firebase.
+    Record a financial transaction (expense or income) from voice commands or bills. Examples: 'spent $20 on a movie', 'paid $50 for groceries', 'received $1000 salary'.
+    
+    The transaction is stored in Firebase.
     
     Args:
-        amount: Transaction amount (positive number)
-        description: Description of the transaction
-        category: Category of the expense/income (e.g., food, entertainment, salary)
-        transaction_type: Type of transaction ('expense' or 'income')
-        merchant: Optional merchant/business name
-        payment_method: Optional payment method (cash, card, digital)
+        amount: The transaction amount (positive number, without currency symbol)
+        description: Description of what the transaction was for (e.g., 'movie ticket', 'groceries', 'salary payment')
+        category: Category of the transaction (e.g., entertainment, food, transportation, salary, freelance)
+        transaction_type: Type of transaction: 'expense' for money spent or 'income' for money received
+        merchant: Name of the business/merchant where the transaction occurred
+        payment_method: Payment method used (cash, credit card, debit card, digital wallet, etc.)
         
     Returns:
         Dictionary with transaction recording results and Firebase storage status
@@ -111,6 +242,9 @@ def record_transaction(amount, description, category, transaction_type, merchant
         "recording_status": "success"
     }
     
+    if SPECULATIVE_TOOL_ACK and client_events.get() is not None:
+        return accept_and_persist("record_transaction", transaction_data, submit_transaction_data)
+    
     # Store in Firebase
     try:
         storage_result = store_transaction_data(transaction_data)
@@ -118,94 +252,109 @@ def record_transaction(amount, description, category, transaction_type, merchant
         if storage_result.get("success"):
             transaction_data["firebase_document_id"] = storage_result.get("document_id")
             transaction_data["storage_status"] = "stored_successfully"
-            print(f"Transaction stored in Firebase with document ID: {storage_result.get('document_id')}")
+            logger.info("Transaction stored in Firebase with document ID: %s", storage_result.get('document_id'))
         else:
             transaction_data["storage_status"] = "storage_failed"
             transaction_data["storage_error"] = storage_result.get("error", "Unknown error")
-            print(f"Failed to store transaction in Firebase: {storage_result.get('error')}")
+            logger.warning("Failed to store transaction in Firebase: %s", storage_result.get('error'))
             
     except Exception as e:
         transaction_data["storage_status"] = "storage_error"
         transaction_data["storage_error"] = str(e)
-        print(f"Error storing transaction in Firebase: {e}")
+        logger.error("Error storing transaction in Firebase: %s", e)
     
     return transaction_data
 
-# Define the tool (function)
-tool_extract_id_info = {
-    "function_declarations": [
-        {
-            "name": "extract_id_info",
-            "description": "Extract and log important key-value pairs from an ID document shown to the camera.",
-            "parameters": {
-                "type": "OBJECT",
-                "properties": {
-                    "name": {
-                        "type": "STRING",
-                        "description": "Full name as it appears on the ID"
-                    },
-                    "id_number": {
-                        "type": "STRING", 
-                        "description": "The ID number or document number"
-                    },
-                    "date_of_birth": {
-                        "type": "STRING",
-                        "description": "Date of birth in the format shown on the ID"
-                    },
-                    "address": {
-                        "type": "STRING",
-                        "description": "Address information from the ID"
-                    },
-                    "additional_info": {
-                        "type": "STRING",
-                        "description": "Any other important information visible on the ID"
-                    }
-                },
-                "required": ["name", "id_number"]
-            }
-        }
-    ]
-}
+async def execute_function_call(function_call):
+    """
+    Execute one function call from Gemini through the tool registry.
+    
+    Args:
+        function_call: A function call from a Gemini tool_call
+        
+    Returns:
+        The function response to send back to Gemini
+    """
+    name = function_call.name
+    args = function_call.args or {}
+    tool = tools.get(name)
+    
+    if tool is None:
+        logger.warning("Unknown function called: %s", name)
+        result = {"error": f"Unknown function: {name}"}
+    else:
+        try:
+            started = time.monotonic()
+            result = await run_tool(name, tool.func, *tool.call_args(args))
+            metrics.TOOL_CALL_SECONDS.observe(time.monotonic() - started, tool=name)
+            
+            # Log Firebase storage status
+            if result.get("storage_status") == "stored_successfully":
+                logger.info("%s stored in Firebase with document ID: %s", name, result.get('firebase_document_id'))
+            elif result.get("storage_status") == "accepted":
+                logger.info("%s accepted, storing document %s in the background", name, result.get('firebase_document_id'))
+            else:
+                logger.warning("%s completed but Firebase storage failed: %s", name, result.get('storage_error', result.get('error', 'Unknown error')))
+        except Exception as e:
+            logger.exception("Error executing function %s: %s", name, e)
+            result = {"error": str(e)}
+    
+    return {
+        "name": name,
+        "response": {"result": result},
+        "id": function_call.id
+    }
 
-# Define the transaction recording tool
-tool_record_transaction = {
-    "function_declarations": [
-        {
-            "name": "record_transaction",
-            "description": "Record a financial transaction (expense or income) from voice commands or bills. Examples: 'spent $20 on a movie', 'paid $50 for groceries', 'received $1000 salary'.",
-            "parameters": {
-                "type": "OBJECT",
-                "properties": {
-                    "amount": {
-                        "type": "STRING",
-                        "description": "The transaction amount (positive number, without currency symbol)"
-                    },
-                    "description": {
-                        "type": "STRING", 
-                        "description": "Description of what the transaction was for (e.g., 'movie ticket', 'groceries', 'salary payment')"
-                    },
-                    "category": {
-                        "type": "STRING",
-                        "description": "Category of the transaction (e.g., entertainment, food, transportation, salary, freelance)"
-                    },
-                    "transaction_type": {
-                        "type": "STRING",
-                        "description": "Type of transaction: 'expense' for money spent or 'income' for money received"
-                    },
-                    "merchant": {
-                        "type": "STRING",
-                        "description": "Optional: Name of the business/merchant where the transaction occurred"
-                    },
-                    "payment_method": {
-                        "type": "STRING",
-                        "description": "Optional: Payment method used (cash, credit card, debit card, digital wallet, etc.)"
-                    }
-                },
-                "required": ["amount", "description", "category", "transaction_type"]
-            }
-        }
-    ]
-}
+async def handle_tool_call(tool_call, session, client_websocket):
+    """
+    Run all function calls of a tool turn concurrently and send a single consolidated response
+    to both the client and Gemini, so the turn takes as long as its slowest call.
+    
+    Args:
+        tool_call: The tool_call message received from Gemini
+        session: The Gemini live session
+        client_websocket: The websocket connection to the client, or the session's downstream queue
+    """
+    function_responses = list(await asyncio.gather(
+        *(execute_function_call(function_call) for function_call in tool_call.function_calls)
+    ))
+    
+    await client_websocket.send(json.dumps({"text": json.dumps(function_responses)}))
+    
+    # Send function response back to Gemini
+    logger.debug("function_responses: %s", function_responses)
+    await session.send_tool_response(function_responses=function_responses)
+
+# Warm pool of pre-connected Gemini sessions, created per process by serve() when LIVE_POOL_SIZE > 0
+session_pool = None
+
+# System prompt for the ID verification and transaction recording workflows
+SYSTEM_INSTRUCTION = types.Content(parts=[types.Part(
+    text="You are a helpful digital wallet assistant. Have normal conversations with users about various topics. You have two main functions that MUST store data in Firebase:\n\n**ID VERIFICATION WORKFLOW:**\nOnly when a user specifically says they want to 'add this id to my wallet' or similar phrases about adding an ID document, then follow this process:\n1. Acknowledge their request to add the ID to their wallet\n2. Ask them to show their ID document to the camera\n3. Once you can see the ID document, ask the user to verbally confirm ONE unique parameter from their ID (preferably their name) by saying something like: 'I can see your ID. Please tell me your name to verify it matches what I see on the document.'\n4. Wait for their verbal response\n5. Once they provide the verification parameter, you MUST immediately call the extract_id_info tool to extract and store all the key information from the ID document in Firebase\n6. Confirm successful extraction and that their ID has been added to their wallet\n\n**IMPORTANT: You MUST call extract_id_info tool every time you process an ID document. This is not optional.**\n\n**TRANSACTION RECORDING:**\nWhen users mention spending money, making purchases, receiving income, or want to record transactions, use the record_transaction tool. Examples of phrases that should trigger this:\n- 'I spent $20 on a movie'\n- 'Please note I paid $50 for groceries'\n- 'Record that I bought coffee for $5'\n- 'I received my $1000 salary today'\n- 'Note down I spent money on gas'\n- 'Record this receipt' or 'Add this invoice' (when showing a receipt/invoice to camera)\n- When they show you a receipt or bill and ask to record it\n\nFor transaction recording:\n1. If user refers to 'this receipt', 'this invoice', or 'this bill' while showing something to the camera, extract transaction details from the visual receipt/invoice\n2. Extract the amount, description, and determine if it's an expense or income from voice commands or visual receipt data\n3. Automatically determine the appropriate category based on the transaction description and context. Use categories like:\n   - food (restaurants, groceries, coffee, etc.)\n   - entertainment (movies, games, concerts, etc.)\n   - transportation (gas, parking, taxi, public transport, etc.)\n   - shopping (clothing, electronics, household items, etc.)\n   - utilities (electricity, water, internet, phone, etc.)\n   - healthcare (medical, pharmacy, dental, etc.)\n   - salary (wages, freelance payments, etc.)\n   - other (for unclear categories)\n4. You MUST call the record_transaction tool with the extracted information and auto-determined category to store it in Firebase\n5. Confirm the transaction has been recorded with the category you determined\n\n**IMPORTANT: You MUST call record_transaction tool every time you process a transaction. This is not optional.**\n\nDo NOT ask users to specify the category - determine it automatically based on the transaction description and context.\n\nCRITICAL RULES:\n- ALWAYS call extract_id_info when processing ID documents\n- ALWAYS call record_transaction when processing transactions\n- These tools handle Firebase storage - they are mandatory, not optional\n- Never skip calling these tools when the respective workflows are triggered\n\nFor all other conversations, be helpful and natural. Only trigger these workflows when explicitly requested by the user."
+)])
+
+# Tools, system instruction and context management shared by every session's config, built once and never mutated
+BASE_LIVE_CONFIG = MappingProxyType({
+    "tools": tools.declarations,
+    "system_instruction": SYSTEM_INSTRUCTION,
+    **context_config(),
+})
+
+def build_live_config(setup, resumption_handle=None):
+    """
+    Build the Gemini Live config for a client's setup message.
+    
+    Args:
+        setup: The client-supplied "setup" dict (e.g. generation_config)
+        resumption_handle: Handle of an earlier connection of this session to resume, if any
+        
+    Returns:
+        The setup extended with the shared tool declarations, system instruction and context settings
+    """
+    config = {**setup, **BASE_LIVE_CONFIG}
+    if resumption_handle is not None:
+        config["session_resumption"] = types.SessionResumptionConfig(handle=resumption_handle)
+    return config
 
 async def gemini_session_handler(client_websocket: websockets.WebSocketServerProtocol):
     """Handles the interaction with Gemini API within a websocket session.
@@ -213,144 +362,186 @@ async def gemini_session_handler(client_websocket: websockets.WebSocketServerPro
     Args:
         client_websocket: The websocket connection to the client.
     """
+    session_id.set(uuid.uuid4().hex[:12])
+    metrics.SESSIONS_TOTAL.inc()
+    metrics.ACTIVE_SESSIONS.inc()
+    # Per-session counters for the metrics endpoint. `last_speech_at` is when non-silent audio last reached
+    # Gemini (the browser streams the microphone continuously), `turn_ended_at` when the last turn completed.
+    stats = {"bytes_in": 0, "bytes_out": 0, "last_speech_at": None, "turn_started_at": None, "turn_ended_at": None}
     try:
         config_message = await client_websocket.recv()
+        stats["bytes_in"] += len(config_message)
+        metrics.BYTES_TOTAL.inc(len(config_message), direction="in")
         config_data = json.loads(config_message)
-        config = config_data.get("setup", {})
-        
-        config["tools"] = [tool_extract_id_info, tool_record_transaction]
+        setup = config_data.get("setup", {})
+        config = build_live_config(setup)
+        # Clients that ask for it exchange media as binary frames instead of base64 JSON
+        binary_frames = config_data.get("protocol") == BINARY_PROTOCOL
+        received_sequences = SequenceTracker()
+        sent_sequences = SequenceCounter()
+        video_gate = VideoFrameGate()
+        # Bounded buffers between the client and Gemini, drained by their own forwarding tasks
+        upstream = UpstreamQueue()
+
+        def encode_audio(pcm):
+            """Wraps outbound PCM in the client's negotiated message format."""
+            if binary_frames:
+                return encode_frame(STREAM_AUDIO, sent_sequences.next(STREAM_AUDIO), pcm)
+            return json.dumps({"audio": base64.b64encode(pcm).decode('utf-8')})
+
+        downstream = DownstreamQueue(encode_audio)
+        loop = asyncio.get_running_loop()
+
+        def notify_client(event):
+            """Queues an event for the client; safe to call from tool and Firestore writer threads."""
+            try:
+                loop.call_soon_threadsafe(lambda: asyncio.ensure_future(downstream.send(json.dumps(event))))
+            except RuntimeError:
+                logger.debug("Event loop closed, dropping client event: %s", event)
+
+        client_events.set(notify_client)
         
-        # Add system prompt for ID verification workflow
-        config["system_instruction"] = {
-            "parts": [
-                {
-                    "text": "You are a helpful digital wallet assistant. Have normal conversations with users about various topics. You have two main functions that MUST store data in Firebase:\n\n**ID VERIFICATION WORKFLOW:**\nOnly when a user specifically says they want to 'add this id to my wallet' or similar phrases about adding an ID document, then follow this process:\n1. Acknowledge their request to add the ID to their wallet\n2. Ask them to show their ID document to the camera\n3. Once you can see the ID document, ask the user to verbally confirm ONE unique parameter from their ID (preferably their name) by saying something like: 'I can see your ID. Please tell me your name to verify it matches what I see on the document.'\n4. Wait for their verbal response\n5. Once they provide the verification parameter, you MUST immediately call the extract_id_info tool to extract and store all the key information from the ID document in Firebase\n6. Confirm successful extraction and that their ID has been added to their wallet\n\n**IMPORTANT: You MUST call extract_id_info tool every time you process an ID document. This is not optional.**\n\n**TRANSACTION RECORDING:**\nWhen users mention spending money, making purchases, receiving income, or want to record transactions, use the record_transaction tool. Examples of phrases that should trigger this:\n- 'I spent $20 on a movie'\n- 'Please note I paid $50 for groceries'\n- 'Record that I bought coffee for $5'\n- 'I received my $1000 salary today'\n- 'Note down I spent money on gas'\n- 'Record this receipt' or 'Add this invoice' (when showing a receipt/invoice to camera)\n- When they show you a receipt or bill and ask to record it\n\nFor transaction recording:\n1. If user refers to 'this receipt', 'this invoice', or 'this bill' while showing something to the camera, extract transaction details from the visual receipt/invoice\n2. Extract the amount, description, and determine if it's an expense or income from voice commands or visual receipt data\n3. Automatically determine the appropriate category based on the transaction description and context. Use categories like:\n   - food (restaurants, groceries, coffee, etc.)\n   - entertainment (movies, games, concerts, etc.)\n   - transportation (gas, parking, taxi, public transport, etc.)\n   - shopping (clothing, electronics, household items, etc.)\n   - utilities (electricity, water, internet, phone, etc.)\n   - healthcare (medical, pharmacy, dental, etc.)\n   - salary (wages, freelance payments, etc.)\n   - other (for unclear categories)\n4. You MUST call the record_transaction tool with the extracted information and auto-determined category to store it in Firebase\n5. Confirm the transaction has been recorded with the category you determined\n\n**IMPORTANT: You MUST call record_transaction tool every time you process a transaction. This is not optional.**\n\nDo NOT ask users to specify the category - determine it automatically based on the transaction description and context.\n\nCRITICAL RULES:\n- ALWAYS call extract_id_info when processing ID documents\n- ALWAYS call record_transaction when processing transactions\n- These tools handle Firebase storage - they are mandatory, not optional\n- Never skip calling these tools when the respective workflows are triggered\n\nFor all other conversations, be helpful and natural. Only trigger these workflows when explicitly requested by the user."
-                }
-            ]
-        }
-        
-        async with client.aio.live.connect(model=MODEL, config=config) as session:
-            print("Connected to Gemini API")
+        connect_started = time.monotonic()
+        # Take a pre-connected session if one matches this setup, otherwise connect now
+        connection = session_pool.acquire(setup) if session_pool is not None else None
+        if connection is None:
+            connection = client.aio.live.connect(model=MODEL, config=config)
+
+        def resume(handle):
+            """Reconnects to the same conversation when Gemini recycles or drops the connection."""
+            return client.aio.live.connect(model=MODEL, config=build_live_config(setup, handle))
+
+        async with ResumableSession(connection, resume) as session:
+            metrics.GEMINI_CONNECT_SECONDS.observe(time.monotonic() - connect_started)
+            logger.info("Connected to Gemini API", extra={"binary_frames": binary_frames})
+            if binary_frames:
+                # Confirm the binary protocol; the client keeps sending JSON until it sees this
+                await downstream.send(json.dumps({"protocol": BINARY_PROTOCOL}))
+
+            async def send_media(stream_type, payload):
+                """Forwards one audio or video payload to Gemini."""
+                # Blob only accepts bytes. UpstreamQueue already copied the payload into bytes (audio when
+                # cutting frames from its buffer, video on arrival), so bytes() here returns it as is.
+                if stream_type == STREAM_AUDIO:
+                    await session.send_realtime_input(
+                        audio=types.Blob(data=bytes(payload), mime_type="audio/pcm;rate=16000")
+                    )
+                elif stream_type == STREAM_VIDEO:
+                    image_bytes = bytes(payload)
+                    # Skip frames that repeat the last one or exceed the latency-adjusted frame rate
+                    if not video_gate.admit(image_bytes):
+                        return
+                    started = time.monotonic()
+                    await session.send_realtime_input(
+                        video=types.Blob(data=image_bytes, mime_type="image/jpeg")
+                    )
+                    video_gate.record_send_latency(time.monotonic() - started)
 
             async def send_to_gemini():
                 """Sends messages from the client websocket to the Gemini API."""
                 try:
                   async for message in client_websocket:
+                      stats["bytes_in"] += len(message)
+                      metrics.BYTES_TOTAL.inc(len(message), direction="in")
                       try:
+                          if isinstance(message, bytes):
+                              stream_type, sequence, _, payload = decode_frame(message)
+                              in_order = received_sequences.observe(stream_type, sequence)
+                              if stream_type == STREAM_AUDIO:
+                                  upstream.put_audio(payload)
+                              elif in_order:
+                                  upstream.put_video(payload)  # older frames arriving late are skipped
+                              continue
+
                           data = json.loads(message)
                           if "realtime_input" in data:
                               for chunk in data["realtime_input"]["media_chunks"]:
                                   if chunk["mime_type"] == "audio/pcm":
-                                      audio_bytes = base64.b64decode(chunk["data"])
-                                      await session.send_realtime_input(
-                                          audio=types.Blob(data=audio_bytes, mime_type="audio/pcm;rate=16000")
-                                      )
+                                      upstream.put_audio(base64.b64decode(chunk["data"]))
                                       
                                   elif chunk["mime_type"] == "image/jpeg":
-                                      image_bytes = base64.b64decode(chunk["data"])
-                                      await session.send_realtime_input(
-                                          video=types.Blob(data=image_bytes, mime_type="image/jpeg")
-                                      )
+                                      upstream.put_video(base64.b64decode(chunk["data"]))
                                       
+                      except FrameError as e:
+                          log_sampled(logger, logging.WARNING, "invalid_frame", "Dropping invalid binary frame: %s", e)
                       except Exception as e:
-                          print(f"Error sending to Gemini: {e}")
-                  print("Client connection closed (send)")
+                          log_sampled(logger, logging.ERROR, "client_message_error", "Error handling client message: %s", e)
+                  logger.info("Client connection closed (send)")
+                  if received_sequences.received:
+                      logger.info("Binary frames received", extra={
+                          "received": received_sequences.received,
+                          "missing": received_sequences.gaps,
+                          "out_of_order": received_sequences.reordered,
+                      })
+                except Exception as e:
+                     logger.error("Error reading from client: %s", e)
+                finally:
+                   upstream.close()
+                   logger.debug("send_to_gemini closed")
+
+            async def forward_to_gemini():
+                """Drains the upstream queue into the Gemini session."""
+                try:
+                    while True:
+                        item = await upstream.get()
+                        if item is None:
+                            break
+                        try:
+                            await send_media(*item)
+                            if item[0] == STREAM_AUDIO and is_speech(item[1]):
+                                stats["last_speech_at"] = time.monotonic()
+                        except Exception as e:
+                            log_sampled(logger, logging.ERROR, "gemini_send_error", "Error sending to Gemini: %s", e)
+                finally:
+                    logger.info("Upstream queue closed", extra={"upstream": upstream.stats(), "video": video_gate.stats()})
+                    upstream.discard()
+
+            async def forward_to_client():
+                """Drains the downstream queue into the client websocket."""
+                try:
+                    while True:
+                        message = await downstream.get()
+                        if message is None:
+                            break
+                        await client_websocket.send(message)
+                        stats["bytes_out"] += len(message)
+                        metrics.BYTES_TOTAL.inc(len(message), direction="out")
+                except websockets.exceptions.ConnectionClosed:
+                    logger.info("Client connection closed (forward)")
                 except Exception as e:
-                     print(f"Error sending to Gemini: {e}")
+                    logger.error("Error sending to client: %s", e)
                 finally:
-                   print("send_to_gemini closed")
+                    logger.info("Downstream queue closed", extra={"downstream": downstream.stats()})
+                    downstream.close()
 
 
 
             async def receive_from_gemini():
                 """Receives responses from the Gemini API and forwards them to the client, looping until turn is complete."""
                 try:
-                    while True:
+                    while not downstream.closed:
                         try:
-                            print("receiving from gemini")
+                            logger.debug("receiving from gemini")
                             async for response in session.receive():
                                 #first_response = True
                                 #print(f"response: {response}")
+                                now = time.monotonic()
+                                if stats["turn_started_at"] is None:
+                                    # First message of a turn: anchor turn and first-audio timings. First audio is
+                                    # measured from the end of the user's speech, or from the previous turn when
+                                    # nothing was said since (e.g. a reply to a video frame or tool result).
+                                    stats["turn_started_at"] = now
+                                    stats["turn_input_at"] = max(
+                                        (at for at in (stats["last_speech_at"], stats["turn_ended_at"]) if at is not None),
+                                        default=now)
+                                    stats["first_audio_seen"] = False
                                 if response.server_content is None:
                                     if response.tool_call is not None:
-                                          #handle the tool call
-                                           print(f"Tool call received: {response.tool_call}")
-
-                                           function_calls = response.tool_call.function_calls
-                                           function_responses = []
-
-                                           for function_call in function_calls:
-                                                 name = function_call.name
-                                                 args = function_call.args
-                                                 # Extract the numeric part from Gemini's function call ID
-                                                 call_id = function_call.id
-
-                                                 # Validate function name
-                                                 if name == "extract_id_info":
-                                                      try:
-                                                          result = extract_id_info(
-                                                              args.get("name", ""),
-                                                              args.get("id_number", ""),
-                                                              args.get("date_of_birth", ""),
-                                                              args.get("address", ""),
-                                                              args.get("additional_info", "")
-                                                          )
-                                                          function_responses.append(
-                                                             {
-                                                                 "name": name,
-                                                                 "response": {"result": result},
-                                                                 "id": call_id  
-                                                             }
-                                                          )
-                                                          await client_websocket.send(json.dumps({"text": json.dumps(function_responses)}))
-                                                          
-                                                          # Log Firebase storage status
-                                                          if result.get("storage_status") == "stored_successfully":
-                                                              print(f"ID information extracted and stored in Firebase with document ID: {result.get('firebase_document_id')}")
-                                                          else:
-                                                              print(f"ID information extracted but Firebase storage failed: {result.get('storage_error', 'Unknown error')}")
-                                                              
-                                                      except Exception as e:
-                                                          print(f"Error executing function: {e}")
-                                                          continue
-
-                                                 elif name == "record_transaction":
-                                                      try:
-                                                          result = record_transaction(
-                                                              args.get("amount", ""),
-                                                              args.get("description", ""),
-                                                              args.get("category", ""),
-                                                              args.get("transaction_type", ""),
-                                                              args.get("merchant"),
-                                                              args.get("payment_method")
-                                                          )
-                                                          function_responses.append(
-                                                             {
-                                                                 "name": name,
-                                                                 "response": {"result": result},
-                                                                 "id": call_id  
-                                                             }
-                                                          )
-                                                          await client_websocket.send(json.dumps({"text": json.dumps(function_responses)}))
-                                                          
-                                                          # Log Firebase storage status
-                                                          if result.get("storage_status") == "stored_successfully":
-                                                              print(f"Transaction recorded and stored in Firebase with document ID: {result.get('firebase_document_id')}")
-                                                          else:
-                                                              print(f"Transaction recorded but Firebase storage failed: {result.get('storage_error', 'Unknown error')}")
-                                                              
-                                                      except Exception as e:
-                                                          print(f"Error executing transaction function: {e}")
-                                                          continue
-
-
-                                           # Send function response back to Gemini
-                                           print(f"function_responses: {function_responses}")
-                                           await session.send_tool_response(function_responses=function_responses)
-                                           continue
-
-                                    #print(f'Unhandled server message! - {response}')
-                                    #continue
+                                        # Run every call of this tool turn concurrently and answer once
+                                        logger.info("Tool call received: %s", [call.name for call in response.tool_call.function_calls])
+                                        await handle_tool_call(response.tool_call, session, downstream)
+                                    # Other messages (usage metadata, cancellations) carry nothing for the client
+                                    continue
 
                                 model_turn = response.server_content.model_turn
                                 if model_turn:
@@ -358,50 +549,182 @@ async def gemini_session_handler(client_websocket: websockets.WebSocketServerPro
                                         #print(f"part: {part}")
                                         if hasattr(part, 'text') and part.text is not None:
                                             #print(f"text: {part.text}")
-                                            await client_websocket.send(json.dumps({"text": part.text}))
+                                            await downstream.send(json.dumps({"text": part.text}))
                                         elif hasattr(part, 'inline_data') and part.inline_data is not None:
                                             # if first_response:
                                             #print("audio mime_type:", part.inline_data.mime_type)
                                                 #first_response = False
-                                            base64_audio = base64.b64encode(part.inline_data.data).decode('utf-8')
-                                            await client_websocket.send(json.dumps({
-                                                "audio": base64_audio,
-                                            }))
-                                            print("audio received")
+                                            # Batched and encoded for the client by the downstream queue
+                                            downstream.put_audio(part.inline_data.data)
+                                            if not stats["first_audio_seen"]:
+                                                stats["first_audio_seen"] = True
+                                                metrics.FIRST_AUDIO_SECONDS.observe(now - stats["turn_input_at"])
+                                            if logger.isEnabledFor(logging.DEBUG):
+                                                log_sampled(logger, logging.DEBUG, "audio_received", "audio received",
+                                                            bytes=len(part.inline_data.data))
 
                                 if response.server_content.turn_complete:
-                                    print('\n<Turn complete>')
+                                    downstream.end_audio()
+                                    metrics.TURN_SECONDS.observe(now - stats["turn_started_at"])
+                                    stats["turn_started_at"] = None
+                                    stats["turn_ended_at"] = now
+                                    logger.info("Turn complete")
                         except websockets.exceptions.ConnectionClosedOK:
-                            print("Client connection closed normally (receive)")
+                            logger.info("Client connection closed normally (receive)")
                             break  # Exit the loop if the connection is closed
                         except Exception as e:
-                            print(f"Error receiving from Gemini: {e}")
+                            logger.error("Error receiving from Gemini: %s", e)
                             break # exit the lo
 
                 except Exception as e:
-                      print(f"Error receiving from Gemini: {e}")
+                      logger.error("Error receiving from Gemini: %s", e)
                 finally:
-                      print("Gemini connection closed (receive)")
+                      logger.debug("Gemini connection closed (receive)")
 
 
-            # Start send loop
+            # Start send loop and its forwarder
             send_task = asyncio.create_task(send_to_gemini())
-            # Launch receive loop as a background task
+            upstream_task = asyncio.create_task(forward_to_gemini())
+            # Launch receive loop and its forwarder as background tasks
             receive_task = asyncio.create_task(receive_from_gemini())
-            await asyncio.gather(send_task, receive_task)
+            downstream_task = asyncio.create_task(forward_to_client())
+            await asyncio.gather(send_task, upstream_task)
+
+            # The client is gone: stop waiting on Gemini and drop undelivered output
+            downstream.close()
+            receive_task.cancel()
+            await asyncio.gather(receive_task, downstream_task, return_exceptions=True)
 
 
     except Exception as e:
-        print(f"Error in Gemini session: {e}")
+        logger.error("Error in Gemini session: %s", e)
     finally:
-        print("Gemini session closed.")
+        metrics.ACTIVE_SESSIONS.dec()
+        metrics.SESSION_BYTES.observe(stats["bytes_in"], direction="in")
+        metrics.SESSION_BYTES.observe(stats["bytes_out"], direction="out")
+        logger.info("Gemini session closed", extra={"bytes_in": stats["bytes_in"], "bytes_out": stats["bytes_out"]})
+
+
+# Serving: a single process by default. With SERVER_WORKERS > 1 that many worker processes share
+# the listening port through SO_REUSEPORT, each with its own event loop, tool pool and Firebase client.
+SERVER_HOST = os.getenv("SERVER_HOST", "localhost")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "9082"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+# Seconds live sessions get to finish after a shutdown signal before they are closed.
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "30"))
+
+
+async def serve(host: str, port: int, reuse_port: bool = False, metrics_port: int = metrics.METRICS_PORT) -> None:
+    """
+    Run the websocket server until SIGINT/SIGTERM, then drain gracefully.
+    
+    Args:
+        host: Interface to bind
+        port: Port to listen on
+        reuse_port: Bind with SO_REUSEPORT so several processes can share the port
+        metrics_port: Port of this process's Prometheus endpoint (0 to disable)
+    """
+    global session_pool
+    setup_logging()
+    metrics_server = await metrics.start_metrics_server(port=metrics_port)
+    if LIVE_POOL_SIZE > 0:
+        session_pool = LiveSessionPool(client, MODEL, LIVE_POOL_SETUP, build_live_config)
+        session_pool.start()
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # e.g. Windows; Ctrl+C then stops the process immediately
+    
+    async with websockets.serve(gemini_session_handler, host, port, reuse_port=reuse_port) as server:
+        logger.info("Running websocket server %s:%s", host, port)
+        await stop.wait()
+        
+        # Stop accepting connections, but let sessions in progress finish
+        logger.info("Draining websocket server")
+        server.close(close_connections=False)
+        try:
+            await asyncio.wait_for(server.wait_closed(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Sessions still open after %ss, closing them", DRAIN_TIMEOUT)
+            server.close()
+            await server.wait_closed()
+    
+    if session_pool is not None:
+        await session_pool.close()
+    # Let tool calls already started and their queued Firestore writes complete
+    tool_executor.shutdown(wait=True)
+    close_firebase_config()
+    if metrics_server is not None:
+        metrics_server.close()
+    logger.info("Websocket server stopped")
+
+
+def run_worker(host: str, port: int, index: int, workers: int) -> None:
+    """Entry point of a worker process; each worker serves metrics on its own port and has its own write-ahead log."""
+    enable_write_ahead_log(index, workers)
+    metrics_port = metrics.METRICS_PORT + index if metrics.METRICS_PORT else 0
+    asyncio.run(serve(host, port, reuse_port=True, metrics_port=metrics_port))
+
+
+def run_workers(host: str, port: int, workers: int) -> None:
+    """
+    Start worker processes sharing the port and supervise them until shutdown.
+    
+    Workers are spawned rather than forked so none inherits gRPC or event loop state. A worker
+    that exits unexpectedly is restarted; SIGINT/SIGTERM are passed on to every worker, which
+    then drains its sessions and exits.
+    
+    Args:
+        host: Interface to bind
+        port: Port to listen on
+        workers: Number of worker processes
+    """
+    setup_logging()
+    context = multiprocessing.get_context("spawn")
+    stopping = False
+    
+    def start(index):
+        process = context.Process(target=run_worker, args=(host, port, index, workers), name=f"live-agent-worker-{index}")
+        process.start()
+        return process
+    
+    def forward_signal(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+    
+    processes = {index: start(index) for index in range(workers)}
+    signal.signal(signal.SIGINT, forward_signal)
+    signal.signal(signal.SIGTERM, forward_signal)
+    logger.info("Started %s websocket workers on %s:%s", workers, host, port)
+    
+    while processes:
+        multiprocessing.connection.wait([process.sentinel for process in processes.values()])
+        for index, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            del processes[index]
+            if not stopping and process.exitcode != 0:
+                logger.warning("Worker %s exited with code %s, restarting", index, process.exitcode)
+                processes[index] = start(index)
 
 
 async def main() -> None:
-    async with websockets.serve(gemini_session_handler, "localhost", 9082):
-        print("Running websocket server localhost:9082...")
-        await asyncio.Future()  # Keep the server running indefinitely
+    enable_write_ahead_log()
+    await serve(SERVER_HOST, SERVER_PORT)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if SERVER_WORKERS > 1 and hasattr(socket, "SO_REUSEPORT"):
+        run_workers(SERVER_HOST, SERVER_PORT, SERVER_WORKERS)
+    else:
+        if SERVER_WORKERS > 1:
+            setup_logging()
+            logger.warning("SO_REUSEPORT is not available on this platform; running a single process")
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,202 @@
+import asyncio
+import bisect
+import logging
+import os
+import threading
+
+# Port of the Prometheus endpoint (worker N of a multi-process server uses METRICS_PORT + N); 0 disables it.
+# Only local scrapers can reach it by default; set METRICS_HOST=0.0.0.0 to expose it to the network.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TURN_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = (1e4, 1e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8)
+
+
+def _escape_label_value(value: str) -> str:
+    """Escape a label value as the text format requires: backslash, double quote and newline."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        documentation = self.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+        lines = [f"# HELP {self.name} {documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list:
+        return [f"{self.name}{_label_text(self.labelnames, key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. the number of open sessions."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def _samples(self) -> list:
+        return [f"{self.name} {self._value}"]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the running sum.
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def _samples(self) -> list:
+        lines = []
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Live session metrics
+GEMINI_CONNECT_SECONDS = Histogram(
+    "live_gemini_connect_seconds", "Time a new client waits for its Gemini Live session (near zero from the warm pool).")
+FIRST_AUDIO_SECONDS = Histogram(
+    "live_first_audio_seconds",
+    "Time from the end of the user's speech (last non-silent audio sent to Gemini) to the first audio of the reply.")
+TURN_SECONDS = Histogram(
+    "live_turn_seconds", "Time from the first message of a Gemini turn to turn_complete.", buckets=TURN_BUCKETS)
+TOOL_CALL_SECONDS = Histogram(
+    "live_tool_call_seconds", "Tool call execution time, including the Firestore write.", labelnames=("tool",))
+FIRESTORE_WRITE_SECONDS = Histogram(
+    "live_firestore_write_seconds", "Time from queueing a Firestore write to its batch commit.", labelnames=("kind",))
+SESSION_BYTES = Histogram(
+    "live_session_bytes", "Websocket bytes exchanged with the client per session.",
+    buckets=BYTES_BUCKETS, labelnames=("direction",))
+BYTES_TOTAL = Counter(
+    "live_bytes_total", "Websocket bytes exchanged with clients.", labelnames=("direction",))
+SESSIONS_TOTAL = Counter(
+    "live_sessions_total", "Sessions handled.")
+ACTIVE_SESSIONS = Gauge(
+    "live_active_sessions", "Sessions currently open.")
+FIRESTORE_WAL_PENDING = Gauge(
+    "live_firestore_wal_pending", "Write groups in the local write-ahead log not yet committed to Firestore.")
+FIRESTORE_WAL_DEAD_LETTERS = Counter(
+    "live_firestore_wal_dead_letters_total", "Write groups Firestore rejected for good, moved aside in the write-ahead log.",
+    labelnames=("kind",))
+UPSTREAM_AUDIO_PENDING_BYTES = Gauge(
+    "live_upstream_audio_pending_bytes", "Client audio buffered across sessions, waiting to be sent to Gemini.")
+DOWNSTREAM_QUEUE_DEPTH = Gauge(
+    "live_downstream_queue_depth", "Messages queued across sessions, waiting to be sent to clients.")
+MEDIA_DROPPED_TOTAL = Counter(
+    "live_media_dropped_total", "Media not forwarded because of backpressure or deduplication.", labelnames=("reason",))
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Headers are not needed; read them so the client sees a clean exchange.
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_metrics().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", b"Not Found\n", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """
+    Serve GET /metrics on the running event loop.
+
+    Returns:
+        The asyncio server, or None if metrics are disabled (port 0)
+    """
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
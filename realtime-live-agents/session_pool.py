@@ -0,0 +1,167 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger("live_agent")
+
+# Pre-connected Gemini Live sessions kept ready per process; 0 disables the pool.
+LIVE_POOL_SIZE = int(os.getenv("LIVE_POOL_SIZE", "0"))
+# Pooled sessions unused for this long are closed and replaced, well before the Live API drops them.
+LIVE_POOL_MAX_IDLE = float(os.getenv("LIVE_POOL_MAX_IDLE_SECONDS", "120"))
+# The client setup pooled sessions are opened with (what index.html sends); other setups connect fresh.
+LIVE_POOL_SETUP = json.loads(os.getenv("LIVE_POOL_SETUP", '{"generation_config": {"response_modalities": ["AUDIO"]}}'))
+
+POOL_ACQUIRES = metrics.Counter(
+    "live_pool_acquire_total", "Session requests served from the warm pool, by result.", labelnames=("result",))
+
+
+def _setup_key(setup: dict) -> str:
+    return json.dumps(setup, sort_keys=True)
+
+
+class PooledConnection:
+    """
+    A connected session handed out by the pool.
+
+    Used like `client.aio.live.connect(...)`: `async with` yields the session and closes it on exit.
+    """
+
+    def __init__(self, connection, session):
+        self._connection = connection
+        self.session = session
+        self.connected_at = time.monotonic()
+
+    async def __aenter__(self):
+        return self.session
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        return await self._connection.__aexit__(exc_type, exc, traceback)
+
+    async def close(self):
+        try:
+            await self._connection.__aexit__(None, None, None)
+        except Exception as e:
+            logger.debug("Error closing pooled session: %s", e)
+
+
+class LiveSessionPool:
+    """
+    Keeps `size` Gemini Live sessions connected with the standard config, ready to hand out.
+
+    A background task opens replacements as sessions are taken, and closes and replaces sessions
+    that have been idle for `max_idle` seconds. Only clients whose setup equals the pool's setup
+    can be served from it; everyone else, and anyone arriving while the pool is empty, connects
+    fresh as before.
+    """
+
+    def __init__(self, client, model: str, setup: dict, build_config, size: int = LIVE_POOL_SIZE,
+                 max_idle: float = LIVE_POOL_MAX_IDLE):
+        """
+        Args:
+            client: genai client (or FakeLiveClient) whose `aio.live.connect` opens sessions
+            model: Model ID to connect to
+            setup: The client setup pooled sessions are opened for
+            build_config: Turns a client setup into the full live config (tools, system instruction)
+            size: Number of sessions to keep ready
+            max_idle: Seconds a pooled session may wait before it is replaced
+        """
+        self.client = client
+        self.model = model
+        self.setup_key = _setup_key(setup)
+        self.config = build_config(setup)
+        self.size = size
+        self.max_idle = max_idle
+        self._ready = deque()
+        self._closing = set()
+        self._connecting = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closed = False
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._maintain())
+
+    def acquire(self, setup: dict):
+        """
+        A ready session for this setup, or None if the caller has to connect itself.
+
+        Args:
+            setup: The client-supplied setup of the new websocket session
+        """
+        if _setup_key(setup) != self.setup_key:
+            POOL_ACQUIRES.inc(result="setup_mismatch")
+            return None
+        now = time.monotonic()
+        while self._ready:
+            pooled = self._ready.popleft()
+            self._wakeup.set()
+            if now - pooled.connected_at < self.max_idle:
+                POOL_ACQUIRES.inc(result="hit")
+                return pooled
+            self._close_later(pooled)
+        POOL_ACQUIRES.inc(result="empty")
+        return None
+
+    async def close(self) -> None:
+        """Stop refilling and close every idle session."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        while self._ready:
+            await self._ready.popleft().close()
+
+    async def _maintain(self):
+        failures = 0
+        while not self._closed:
+            self._expire()
+            missing = self.size - len(self._ready) - self._connecting
+            if missing > 0:
+                results = await asyncio.gather(*(self._connect() for _ in range(missing)), return_exceptions=True)
+                errors = [result for result in results if isinstance(result, Exception)]
+                if errors:
+                    failures += 1
+                    logger.warning("Failed to pre-connect %s Gemini session(s): %s", len(errors), errors[0])
+                    # Back off so an unreachable API is not hammered by every worker.
+                    await asyncio.sleep(min(30.0, random.uniform(0, 2 ** failures)))
+                    continue
+                failures = 0
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._next_expiry())
+            except asyncio.TimeoutError:
+                pass
+
+    async def _connect(self):
+        self._connecting += 1
+        try:
+            connection = self.client.aio.live.connect(model=self.model, config=self.config)
+            session = await connection.__aenter__()
+        finally:
+            self._connecting -= 1
+        pooled = PooledConnection(connection, session)
+        if self._closed:
+            await pooled.close()
+        else:
+            self._ready.append(pooled)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._ready and now - self._ready[0].connected_at >= self.max_idle:
+            self._close_later(self._ready.popleft())
+
+    def _close_later(self, pooled: PooledConnection) -> None:
+        task = asyncio.create_task(pooled.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _next_expiry(self) -> float:
+        if not self._ready:
+            return self.max_idle
+        return max(0.0, self._ready[0].connected_at + self.max_idle - time.monotonic())
@@ -0,0 +1,312 @@
+import array
+import asyncio
+import os
+import sys
+import time
+from collections import deque
+
+from frame_protocol import STREAM_AUDIO, STREAM_VIDEO
+from metrics import DOWNSTREAM_QUEUE_DEPTH, MEDIA_DROPPED_TOTAL, UPSTREAM_AUDIO_PENDING_BYTES
+
+# Client audio the Gemini send may fall behind by before the oldest frames are dropped.
+UPSTREAM_AUDIO_MAX_MS = int(os.getenv("UPSTREAM_AUDIO_MAX_MS", "2000"))
+# Gemini audio chunks the client may fall behind by before the oldest ones are dropped.
+DOWNSTREAM_AUDIO_MAX_DEPTH = int(os.getenv("DOWNSTREAM_AUDIO_MAX_DEPTH", "32"))
+
+# 16-bit mono PCM: client microphone audio is 16 kHz, Gemini's reply audio is 24 kHz.
+BYTES_PER_SAMPLE = 2
+INPUT_SAMPLE_RATE = 16000
+OUTPUT_SAMPLE_RATE = 24000
+
+# Inbound audio is forwarded in whole frames of this duration (a partial frame waits at most this long).
+INBOUND_AUDIO_FRAME_MS = int(os.getenv("INBOUND_AUDIO_FRAME_MS", "40"))
+# Outbound audio is held at the start of each response until this much is buffered (or this long passed).
+OUTBOUND_AUDIO_PREBUFFER_MS = int(os.getenv("OUTBOUND_AUDIO_PREBUFFER_MS", "60"))
+# Largest outbound audio message built by merging consecutive Gemini audio parts.
+OUTBOUND_AUDIO_MAX_BATCH_MS = int(os.getenv("OUTBOUND_AUDIO_MAX_BATCH_MS", "400"))
+# Peak sample amplitude (of 32767) above which inbound audio counts as speech rather than room noise.
+SPEECH_PEAK_THRESHOLD = int(os.getenv("SPEECH_PEAK_THRESHOLD", "1000"))
+
+
+def pcm_bytes(duration_ms: int, sample_rate: int) -> int:
+    """Size of `duration_ms` of 16-bit mono PCM."""
+    return sample_rate * duration_ms // 1000 * BYTES_PER_SAMPLE
+
+
+def is_speech(payload, threshold: int = SPEECH_PEAK_THRESHOLD) -> bool:
+    """True if a chunk of 16-bit little-endian PCM has a sample louder than `threshold`."""
+    samples = array.array("h")
+    samples.frombytes(payload[:len(payload) - len(payload) % BYTES_PER_SAMPLE])
+    if not samples:
+        return False
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return max(max(samples), -min(samples)) > threshold
+
+
+class UpstreamQueue:
+    """
+    Client -> Gemini buffer with a fixed footprint per media type.
+
+    Audio chunks are appended to one pending buffer and forwarded as a whole number of fixed-duration
+    frames, so many tiny client chunks become one send. A partial frame is sent on its own once it has
+    waited a frame's duration. When sends to Gemini stall and more than `max_audio_ms` is pending, the
+    oldest whole frames are dropped so the buffer stays bounded and the conversation close to real
+    time. Video keeps only the newest frame; an unsent frame is dropped as soon as a newer one arrives.
+    Ready audio is forwarded before the pending frame.
+    """
+
+    def __init__(self, frame_ms: int = INBOUND_AUDIO_FRAME_MS, sample_rate: int = INPUT_SAMPLE_RATE,
+                 max_audio_ms: int = UPSTREAM_AUDIO_MAX_MS):
+        """
+        Args:
+            frame_ms: Duration of one inbound audio frame
+            sample_rate: Sample rate of the client's PCM audio
+            max_audio_ms: Most audio held while waiting for Gemini, rounded up to whole frames
+        """
+        self.frame_bytes = pcm_bytes(frame_ms, sample_rate)
+        self.frame_seconds = frame_ms / 1000
+        self.audio_capacity = max(1, -(-max_audio_ms // frame_ms)) * self.frame_bytes
+        self._audio = bytearray()
+        self._reported_audio_bytes = 0
+        self._audio_since = None
+        self._video = None
+        self._closed = False
+        self._ready = asyncio.Event()
+        self.audio_chunks_coalesced = 0
+        self.audio_frames_dropped = 0
+        self.video_frames_dropped = 0
+        self.max_audio_bytes = 0
+
+    def put_audio(self, payload) -> None:
+        if self._audio:
+            self.audio_chunks_coalesced += 1
+        else:
+            self._audio_since = time.monotonic()
+        self._audio += payload
+        excess = len(self._audio) - self.audio_capacity
+        if excess > 0:
+            frames = -(-excess // self.frame_bytes)
+            del self._audio[:frames * self.frame_bytes]
+            self.audio_frames_dropped += frames
+            MEDIA_DROPPED_TOTAL.inc(frames, reason="audio_overflow")
+        self.max_audio_bytes = max(self.max_audio_bytes, len(self._audio))
+        self._report_depth()
+        self._ready.set()
+
+    def put_video(self, payload) -> None:
+        if self._video is not None:
+            self.video_frames_dropped += 1
+            MEDIA_DROPPED_TOTAL.inc(reason="video_superseded")
+        self._video = bytes(payload)
+        self._ready.set()
+
+    def close(self) -> None:
+        """Stop accepting input; `get` returns None once what is pending has been taken."""
+        self._closed = True
+        self._ready.set()
+
+    def discard(self) -> None:
+        """Close and drop anything still pending, e.g. once the consumer has stopped."""
+        self.close()
+        self._audio.clear()
+        self._video = None
+        self._report_depth()
+
+    async def get(self):
+        """
+        Wait for the next item to forward.
+
+        Returns:
+            (stream_type, payload) tuple, or None once the queue is closed and empty
+        """
+        while True:
+            size = self._ready_audio_bytes()
+            if size:
+                payload = bytes(self._audio[:size])
+                del self._audio[:size]
+                self._audio_since = time.monotonic() if self._audio else None
+                self._report_depth()
+                return STREAM_AUDIO, payload
+            if self._video is not None:
+                payload, self._video = self._video, None
+                return STREAM_VIDEO, payload
+            if self._closed:
+                return None
+            self._ready.clear()
+            timeout = None
+            if self._audio_since is not None:
+                timeout = max(0.0, self._audio_since + self.frame_seconds - time.monotonic())
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _ready_audio_bytes(self) -> int:
+        """How much pending audio can be sent now: whole frames, or everything once it is due."""
+        pending = len(self._audio)
+        if pending >= self.frame_bytes:
+            return pending - pending % self.frame_bytes
+        if pending and (self._closed or time.monotonic() - self._audio_since >= self.frame_seconds):
+            return pending
+        return 0
+
+    def _report_depth(self) -> None:
+        """Move the pending-audio gauge, which sums every session's buffer, by this queue's change."""
+        UPSTREAM_AUDIO_PENDING_BYTES.inc(len(self._audio) - self._reported_audio_bytes)
+        self._reported_audio_bytes = len(self._audio)
+
+    def stats(self) -> dict:
+        return {
+            "audio_pending_bytes": len(self._audio),
+            "audio_max_pending_bytes": self.max_audio_bytes,
+            "audio_chunks_coalesced": self.audio_chunks_coalesced,
+            "audio_frames_dropped": self.audio_frames_dropped,
+            "video_pending": int(self._video is not None),
+            "video_frames_dropped": self.video_frames_dropped,
+        }
+
+
+class DownstreamQueue:
+    """
+    Gemini -> client buffer with a small jitter buffer for audio.
+
+    Text and tool messages are always delivered. Audio is queued as raw PCM and consecutive Gemini
+    audio parts are merged (up to `max_batch_ms`) into one message, so a client that is slower than
+    Gemini gets fewer, larger messages rather than a growing backlog. At the start of each response
+    the first audio is held until `prebuffer_ms` is buffered or has elapsed, giving the player a
+    cushion against bursty delivery. At most `max_audio_depth` audio messages are held; when a slow
+    client lets it fill up, the oldest audio is dropped so playback stays close to real time.
+    Exposes a websocket-like `send` so existing senders (e.g. tool responses) can write through it.
+    """
+
+    def __init__(self, encode_audio, max_audio_depth: int = DOWNSTREAM_AUDIO_MAX_DEPTH,
+                 prebuffer_ms: int = OUTBOUND_AUDIO_PREBUFFER_MS, max_batch_ms: int = OUTBOUND_AUDIO_MAX_BATCH_MS,
+                 sample_rate: int = OUTPUT_SAMPLE_RATE):
+        """
+        Args:
+            encode_audio: Turns a PCM payload into the message sent to the client
+            max_audio_depth: Maximum number of queued audio messages
+            prebuffer_ms: Audio buffered before the first message of a response is released
+            max_batch_ms: Longest audio message built by merging Gemini audio parts
+            sample_rate: Sample rate of Gemini's PCM audio
+        """
+        self.encode_audio = encode_audio
+        self.max_audio_depth = max_audio_depth
+        self.prebuffer_bytes = pcm_bytes(prebuffer_ms, sample_rate)
+        self.prebuffer_seconds = prebuffer_ms / 1000
+        self.max_batch_bytes = pcm_bytes(max_batch_ms, sample_rate)
+        self._messages = deque()
+        self._reported_depth = 0
+        self._audio_depth = 0
+        self._streaming = False
+        self._hold_until = None
+        self._closed = False
+        self._ready = asyncio.Event()
+        self.audio_parts = 0
+        self.audio_messages = 0
+        self.audio_dropped = 0
+        self.max_depth = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put_audio(self, pcm) -> None:
+        if self._closed:
+            return
+        self.audio_parts += 1
+        if not self._streaming and self._hold_until is None:
+            self._hold_until = time.monotonic() + self.prebuffer_seconds
+        if self._messages and self._messages[-1][0] and len(self._messages[-1][1]) + len(pcm) <= self.max_batch_bytes:
+            self._messages[-1][1].extend(pcm)
+            self._ready.set()
+            return
+        if self._audio_depth >= self.max_audio_depth:
+            self._drop_oldest_audio()
+        self._messages.append((True, bytearray(pcm)))
+        self._audio_depth += 1
+        self._added()
+
+    def end_audio(self) -> None:
+        """Release buffered audio without further waiting; the next audio starts a new prebuffer."""
+        self._streaming = False
+        self._hold_until = None
+        self._ready.set()
+
+    async def send(self, message) -> None:
+        """Queue a message that must not be dropped (text, tool responses, protocol replies)."""
+        if self._closed:
+            return
+        self._messages.append((False, message))
+        self._added()
+
+    def close(self) -> None:
+        """Discard anything pending and wake the consumer; `get` then returns None."""
+        self._closed = True
+        self._messages.clear()
+        self._audio_depth = 0
+        self._report_depth()
+        self._ready.set()
+
+    async def get(self):
+        """Wait for the next message to send to the client, or None once closed."""
+        while True:
+            if self._closed:
+                return None
+            timeout = None
+            if self._messages:
+                is_audio, message = self._messages[0]
+                if not is_audio:
+                    self._messages.popleft()
+                    self._report_depth()
+                    return message
+                timeout = self._prebuffer_wait(len(message))
+                if timeout <= 0:
+                    self._messages.popleft()
+                    self._audio_depth -= 1
+                    self._report_depth()
+                    self._streaming = True
+                    self._hold_until = None
+                    self.audio_messages += 1
+                    return self.encode_audio(bytes(message))
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _prebuffer_wait(self, head_bytes: int) -> float:
+        """Seconds the head audio message should still be held (<= 0 to release it now)."""
+        if self._hold_until is None or head_bytes >= self.prebuffer_bytes or len(self._messages) > 1:
+            return 0.0
+        return self._hold_until - time.monotonic()
+
+    def _added(self) -> None:
+        self.max_depth = max(self.max_depth, len(self._messages))
+        self._report_depth()
+        self._ready.set()
+
+    def _drop_oldest_audio(self) -> None:
+        for index, (is_audio, _) in enumerate(self._messages):
+            if is_audio:
+                del self._messages[index]
+                self._audio_depth -= 1
+                self.audio_dropped += 1
+                MEDIA_DROPPED_TOTAL.inc(reason="audio_backlog")
+                return
+
+    def _report_depth(self) -> None:
+        """Move the queue-depth gauge, which sums every session's queue, by this queue's change."""
+        DOWNSTREAM_QUEUE_DEPTH.inc(len(self._messages) - self._reported_depth)
+        self._reported_depth = len(self._messages)
+
+    def stats(self) -> dict:
+        return {
+            "depth": len(self._messages),
+            "max_depth": self.max_depth,
+            "audio_depth": self._audio_depth,
+            "audio_dropped": self.audio_dropped,
+            "audio_parts": self.audio_parts,
+            "audio_messages": self.audio_messages,
+        }
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Tests for the Firestore write-ahead log: logged groups reach Firestore exactly once, across
+outages, permanent rejections and restarts.
+
+Uses an in-memory stand-in for the Firestore client behind a real BatchWriter.
+Run with `python -m pytest test_write_ahead_log.py`.
+"""
+
+import sqlite3
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+from google.api_core.exceptions import AlreadyExists, InvalidArgument, ServiceUnavailable
+from google.cloud.firestore_v1.transforms import Increment
+
+from firebase_config import orphaned_wal_paths, worker_wal_path
+from write_ahead_log import WriteAheadLog
+from write_pipeline import BatchWriter
+
+
+class FakeRef:
+    def __init__(self, path):
+        self.path = path
+        self.id = path.rsplit("/", 1)[1]
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def create(self, ref, data):
+        self.ops.append((True, ref, data))
+
+    def set(self, ref, data, merge=False):
+        self.ops.append((False, ref, data))
+
+    def commit(self):
+        self.db.attempts += 1
+        if self.db.down:
+            raise ServiceUnavailable("firestore down")
+        for create, ref, _ in self.ops:
+            if ref.path in self.db.invalid_paths:
+                raise InvalidArgument(ref.path)
+            if create and ref.path in self.db.docs:
+                raise AlreadyExists(ref.path)
+        for _, ref, data in self.ops:
+            doc = self.db.docs.setdefault(ref.path, {})
+            for key, value in data.items():
+                doc[key] = doc.get(key, 0) + value.value if isinstance(value, Increment) else value
+
+
+class FakeDB:
+    def __init__(self):
+        self.docs = {}
+        self.down = False
+        self.invalid_paths = set()
+        self.attempts = 0
+
+    def document(self, path):
+        return FakeRef(path)
+
+    def new_ref(self):
+        return FakeRef(f"transactions/{uuid.uuid4().hex[:20]}")
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def group(ref, amount):
+    return [(ref, {"amount": amount, "timestamp": datetime(2025, 5, 1, 12, 0)}, False),
+            (FakeRef("spending_rollups/u__total"), {"total": Increment(amount)}, True)]
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+
+@pytest.fixture
+def open_wal(tmp_path, db):
+    opened = []
+
+    def open_wal(**options):
+        writer = BatchWriter(db, flush_interval=0.001)
+        wal = WriteAheadLog(str(tmp_path / "wal.sqlite3"), db, writer, retry_backoff=0.02, max_backoff=0.05, **options)
+        opened.append((wal, writer))
+        return wal
+
+    yield open_wal
+    for wal, writer in opened:
+        if wal._conn is not None:
+            wal.close(5)
+        writer.close(5)
+
+
+def dead_letters(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "wal.sqlite3"))
+    try:
+        return conn.execute("SELECT kind, attempts, last_error FROM dead_letters").fetchall()
+    finally:
+        conn.close()
+
+
+def test_logged_group_is_replayed_to_firestore(db, open_wal):
+    wal = open_wal()
+    ref = db.new_ref()
+    assert wal.append("transaction", group(ref, 5)).result(5) == ref.id
+
+    assert db.docs[ref.path]["timestamp"] == datetime(2025, 5, 1, 12, 0)
+    assert db.docs["spending_rollups/u__total"]["total"] == 5
+    assert wal.pending() == 0
+
+
+def test_failed_group_is_retried_with_backoff(db, open_wal):
+    db.down = True
+    wal = open_wal()
+    ref = db.new_ref()
+    future = wal.append("transaction", group(ref, 5))
+    time.sleep(0.3)
+    assert not future.done()
+    assert wal.pending() == 1
+    # Delays of 0.02s, 0.04s, then the 0.05s cap: a handful of attempts, not a busy loop
+    assert 3 <= db.attempts <= 10
+    with wal._condition:
+        attempts, last_error = wal._conn.execute("SELECT attempts, last_error FROM pending_writes").fetchone()
+    assert attempts == db.attempts
+    assert "firestore down" in last_error
+
+    db.down = False
+    assert future.result(5) == ref.id
+    assert db.docs["spending_rollups/u__total"]["total"] == 5
+
+
+def test_permanently_rejected_group_moves_to_dead_letters(tmp_path, db, open_wal):
+    wal = open_wal()
+    bad, good = db.new_ref(), db.new_ref()
+    db.invalid_paths.add(bad.path)
+    failed = wal.append("transaction", group(bad, 5))
+    stored = wal.append("transaction", group(good, 7))
+
+    with pytest.raises(InvalidArgument):
+        failed.result(5)
+    assert stored.result(5) == good.id
+    assert wal.pending() == 0
+    wal.close(5)
+    assert [(kind, attempts) for kind, attempts, _ in dead_letters(tmp_path)] == [("transaction", 1)]
+
+
+def test_group_failing_max_attempts_moves_to_dead_letters(tmp_path, db, open_wal):
+    db.down = True
+    wal = open_wal(max_attempts=3)
+    future = wal.append("transaction", group(db.new_ref(), 5))
+
+    with pytest.raises(ServiceUnavailable):
+        future.result(5)
+    assert wal.pending() == 0
+    wal.close(5)
+    assert [(kind, attempts) for kind, attempts, _ in dead_letters(tmp_path)] == [("transaction", 3)]
+
+
+def test_group_that_already_committed_is_not_applied_again(db, open_wal):
+    wal = open_wal()
+    ref = db.new_ref()
+    # Committed before the log could remove it, e.g. a crash between the commit and the delete
+    db.docs[ref.path] = {"amount": 5}
+    db.docs["spending_rollups/u__total"] = {"total": 5}
+
+    assert wal.append("transaction", group(ref, 5)).result(5) == ref.id
+    assert db.docs["spending_rollups/u__total"]["total"] == 5
+    assert wal.pending() == 0
+
+
+def test_pending_groups_are_replayed_after_restart(db, open_wal):
+    db.down = True
+    wal = open_wal()
+    refs = [db.new_ref() for _ in range(3)]
+    for amount, ref in enumerate(refs, 1):
+        wal.append("transaction", group(ref, amount))
+    wal.close(5)
+    assert db.docs == {}
+
+    db.down = False
+    wal = open_wal()
+    wait_until(lambda: wal.pending() == 0)
+    assert all(ref.path in db.docs for ref in refs)
+    assert db.docs["spending_rollups/u__total"]["total"] == 6
+
+
+def test_log_is_owned_by_one_process(tmp_path, db, open_wal):
+    open_wal()
+    writer = BatchWriter(db)
+    with pytest.raises(sqlite3.OperationalError):
+        WriteAheadLog(str(tmp_path / "wal.sqlite3"), db, writer)
+    writer.close(5)
+
+
+def test_logs_of_workers_beyond_the_worker_count_are_orphaned(tmp_path):
+    path = str(tmp_path / "firebase_wal.sqlite3")
+    for index in range(4):
+        open(worker_wal_path(path, index), "w").close()
+    open(str(tmp_path / "firebase_wal-worker3.sqlite3-wal"), "w").close()
+
+    assert orphaned_wal_paths(path, 2) == [worker_wal_path(path, 2), worker_wal_path(path, 3)]
+    assert orphaned_wal_paths(path, 1) == [worker_wal_path(path, index) for index in (1, 2, 3)]
+    assert orphaned_wal_paths(path, 4) == []
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Regression tests for the batched Firestore write pipeline: neither futures that callers cancel nor
+commit errors reported for batches the server did apply may get a committed group written twice.
+
+Runs against both copies of BatchWriter (live agent and receipt_processor) with an in-memory
+stand-in for the Firestore client, and checks that the copies stay the same code.
+Run with `python -m pytest test_write_pipeline.py`.
+"""
+
+import ast
+import importlib.util
+import os
+import sys
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+from google.api_core.exceptions import AlreadyExists, DeadlineExceeded, InvalidArgument, ServiceUnavailable
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PIPELINES = {
+    "live": os.path.join(HERE, "write_pipeline.py"),
+    "receipt_processor": os.path.join(HERE, "..", "manager", "sub_agents", "receipt_processor", "write_pipeline.py"),
+}
+
+
+def load_pipeline(name):
+    spec = importlib.util.spec_from_file_location(f"write_pipeline_{name}", PIPELINES[name])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeRef:
+    def __init__(self, doc_id):
+        self.id = doc_id
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.id, False))
+
+    def create(self, ref, data):
+        self.writes.append((ref.id, True))
+
+    def commit(self):
+        if self.db.during_commit is not None:
+            self.db.during_commit()
+        self.db.attempts += 1
+        if self.db.unavailable:
+            self.db.unavailable -= 1
+            raise ServiceUnavailable("backend unavailable")
+        if any(doc_id in self.db.invalid_ids for doc_id, _ in self.writes):
+            raise InvalidArgument("invalid document")
+        if any(create and doc_id in self.db.committed_ids() for doc_id, create in self.writes):
+            raise AlreadyExists(self.writes[0][0])
+        self.db.commits.append([doc_id for doc_id, _ in self.writes])
+        if self.db.ambiguous_failures:
+            # Applied on the server, but the client only sees the deadline
+            self.db.ambiguous_failures -= 1
+            raise DeadlineExceeded("commit outcome unknown")
+
+
+class FakeDB:
+    def __init__(self):
+        self.commits = []
+        self.during_commit = None
+        self.ambiguous_failures = 0
+        self.unavailable = 0
+        self.invalid_ids = set()
+        self.attempts = 0
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def committed_ids(self):
+        return [doc_id for writes in self.commits for doc_id in writes]
+
+
+@pytest.fixture(params=sorted(PIPELINES))
+def pipeline(request):
+    return load_pipeline(request.param)
+
+
+def group(doc_id, merge=False):
+    return [(FakeRef(doc_id), {"id": doc_id}, merge)]
+
+
+def test_group_cancelled_while_queued_is_not_written(pipeline):
+    db = FakeDB()
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    kept = writer.submit(group("a"))
+    dropped = writer.submit(group("b"))
+    assert dropped.cancel()
+    writer.close(5)
+
+    assert kept.result(1) == "a"
+    assert db.committed_ids() == ["a"]
+
+
+def test_cancel_during_commit_of_multi_group_batch_commits_once(pipeline):
+    db = FakeDB()
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    first = writer.submit(group("a"))
+    second = writer.submit(group("b"))
+    cancel_results = []
+    # A caller timing out (asyncio.wait_for on the wrapped future) while the batch is committing
+    db.during_commit = lambda: cancel_results.append(second.cancel())
+    writer.close(5)
+
+    assert cancel_results == [False]
+    assert first.result(1) == "a"
+    assert second.result(1) == "b"
+    # Committed once, not retried group by group
+    assert db.commits == [["a", "b"]]
+
+
+def test_cancel_during_commit_of_single_group_keeps_writer_alive(pipeline):
+    db = FakeDB()
+    writer = pipeline.BatchWriter(db, flush_interval=0)
+    cancelled = threading.Event()
+    future = writer.submit(group("a"))
+
+    def cancel():
+        future.cancel()
+        cancelled.set()
+
+    db.during_commit = cancel
+    assert future.result(5) == "a"
+    assert cancelled.is_set()
+
+    db.during_commit = None
+    assert writer.submit(group("b")).result(5) == "b"
+    writer.close(5)
+    assert db.committed_ids() == ["a", "b"]
+
+
+def test_cancelled_group_does_not_block_flush(pipeline):
+    db = FakeDB()
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    future = writer.submit(group("a"))
+    future.cancel()
+    writer.close(5)
+
+    with pytest.raises(CancelledError):
+        future.result(0)
+    assert db.commits == []
+    assert writer._pending_ops == 0
+
+
+def test_ambiguous_batch_failure_is_not_reapplied_on_resubmit(pipeline):
+    db = FakeDB()
+    db.ambiguous_failures = 1
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    first = writer.submit(group("a", pipeline.CREATE) + [(FakeRef("total"), {"total": 1}, True)])
+    second = writer.submit(group("b", pipeline.CREATE) + [(FakeRef("total"), {"total": 2}, True)])
+    writer.close(5)
+    with pytest.raises(DeadlineExceeded):
+        first.result(1)
+    with pytest.raises(DeadlineExceeded):
+        second.result(1)
+
+    # The caller resubmits, batched with a new group: the created records already exist
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    retried = writer.submit(group("a", pipeline.CREATE) + [(FakeRef("total"), {"total": 1}, True)])
+    fresh = writer.submit(group("c", pipeline.CREATE) + [(FakeRef("total"), {"total": 3}, True)])
+    writer.close(5)
+
+    assert retried.result(1) == "a"
+    assert fresh.result(1) == "c"
+    assert db.commits == [["a", "total", "b", "total"], ["c", "total"]]
+
+
+def test_transient_error_fails_whole_batch_without_isolating(pipeline):
+    db = FakeDB()
+    db.unavailable = 1
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    futures = [writer.submit(group(doc_id)) for doc_id in "abc"]
+    writer.close(5)
+
+    for future in futures:
+        with pytest.raises(ServiceUnavailable):
+            future.result(1)
+    # One failed commit, not one more per group
+    assert db.attempts == 1
+    assert db.commits == []
+
+
+def test_invalid_record_fails_only_its_own_group(pipeline):
+    db = FakeDB()
+    db.invalid_ids = {"b"}
+    writer = pipeline.BatchWriter(db, flush_interval=60)
+    futures = [writer.submit(group(doc_id)) for doc_id in "abc"]
+    writer.close(5)
+
+    assert futures[0].result(1) == "a"
+    with pytest.raises(InvalidArgument):
+        futures[1].result(1)
+    assert futures[2].result(1) == "c"
+    assert db.commits == [["a"], ["c"]]
+
+
+def _code_without_docstrings(path):
+    tree = ast.parse(open(path).read())
+    for node in ast.walk(tree):
+        body = getattr(node, "body", None)
+        if (isinstance(body, list) and body and isinstance(body[0], ast.Expr)
+                and isinstance(body[0].value, ast.Constant) and isinstance(body[0].value.value, str)):
+            node.body = body[1:] or [ast.Pass()]
+    return ast.dump(tree)
+
+
+def test_pipeline_copies_differ_only_in_docstrings():
+    live, receipt_processor = (_code_without_docstrings(PIPELINES[name]) for name in sorted(PIPELINES))
+    assert live == receipt_processor, "Apply the same change to both copies of write_pipeline.py"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__, "-q"]))
@@ -0,0 +1,117 @@
+import inspect
+import re
+
+from google.genai import types
+
+# Python annotation -> Gemini schema type; unannotated parameters are declared as strings.
+SCHEMA_TYPES = {
+    str: types.Type.STRING,
+    int: types.Type.INTEGER,
+    float: types.Type.NUMBER,
+    bool: types.Type.BOOLEAN,
+}
+
+_ARG_LINE = re.compile(r"^(\w+)\s*(?:\([^)]*\))?:\s*(.*)$")
+
+
+def _parse_docstring(doc: str):
+    """
+    Split a Google-style docstring into its summary paragraph and Args descriptions.
+
+    Returns:
+        (summary, {argument name: description})
+    """
+    doc = inspect.cleandoc(doc or "")
+    summary = " ".join(doc.split("\n\n", 1)[0].split())
+    descriptions = {}
+    current = None
+    in_args = False
+    for line in doc.splitlines():
+        stripped = line.strip()
+        if stripped in ("Args:", "Arguments:"):
+            in_args = True
+            continue
+        if not in_args:
+            continue
+        if stripped.endswith(":") and not line.startswith(" "):
+            # The next section (Returns:, Raises:, ...) ends the argument list
+            break
+        match = _ARG_LINE.match(stripped)
+        if match and line.startswith("    ") and not line.startswith("     "):
+            current = match.group(1)
+            descriptions[current] = match.group(2)
+        elif current and stripped:
+            descriptions[current] += " " + stripped
+    return summary, descriptions
+
+
+class RegisteredTool:
+    """A tool function with its parameters and the FunctionDeclaration derived from it."""
+
+    def __init__(self, func, description: str = None):
+        self.func = func
+        self.name = func.__name__
+        summary, arg_descriptions = _parse_docstring(func.__doc__)
+        signature = inspect.signature(func)
+        # (argument name, default) in positional order; required arguments fall back to ""
+        self.params = tuple(
+            (param.name, "" if param.default is inspect.Parameter.empty else param.default)
+            for param in signature.parameters.values()
+        )
+        properties = {}
+        required = []
+        for param in signature.parameters.values():
+            param_description = arg_descriptions.get(param.name, "")
+            if param.default is inspect.Parameter.empty:
+                required.append(param.name)
+            elif param_description:
+                param_description = "Optional: " + param_description
+            properties[param.name] = types.Schema(
+                type=SCHEMA_TYPES.get(param.annotation, types.Type.STRING),
+                description=param_description or None,
+            )
+        self.declaration = types.FunctionDeclaration(
+            name=self.name,
+            description=description or summary,
+            parameters=types.Schema(type=types.Type.OBJECT, properties=properties, required=required),
+        )
+
+    def call_args(self, args: dict) -> list:
+        """Positional arguments for the function from a function call's `args`."""
+        return [args.get(name, default) for name, default in self.params]
+
+
+class ToolRegistry:
+    """
+    Tools the live agent offers Gemini, registered with `@registry.tool`.
+
+    Declarations are derived from each function's signature and docstring once, at registration,
+    and `declarations` is an immutable tuple that every session's config shares.
+    """
+
+    def __init__(self):
+        self._tools = {}
+        self.declarations = ()
+
+    def tool(self, func=None, *, description: str = None):
+        """
+        Register a tool function; usable as `@registry.tool` or `@registry.tool(description=...)`.
+
+        The docstring's first paragraph becomes the tool description unless `description` is given,
+        its Args entries describe the parameters, and parameters without a default are required.
+        """
+        def register(func):
+            registered = RegisteredTool(func, description)
+            self._tools[registered.name] = registered
+            self.declarations = (types.Tool(function_declarations=[
+                tool.declaration for tool in self._tools.values()
+            ]),)
+            return func
+
+        return register(func) if func is not None else register
+
+    def get(self, name: str):
+        return self._tools.get(name)
+
+    def names(self) -> tuple:
+        return tuple(self._tools)
@@ -0,0 +1,130 @@
+import hashlib
+import io
+import os
+import time
+
+from metrics import MEDIA_DROPPED_TOTAL
+
+# Frames whose difference hashes differ in at most this many of 64 bits count as duplicates.
+VIDEO_HASH_DISTANCE = int(os.getenv("VIDEO_HASH_DISTANCE", "6"))
+# Frame-rate bounds; the cap moves between them with upstream send latency.
+VIDEO_MAX_FPS = float(os.getenv("VIDEO_MAX_FPS", "1.0"))
+VIDEO_MIN_FPS = float(os.getenv("VIDEO_MIN_FPS", "0.2"))
+# Even an unchanged scene is resent after this many seconds so Gemini keeps a current view.
+VIDEO_REFRESH_SECONDS = float(os.getenv("VIDEO_REFRESH_SECONDS", "10"))
+
+# The interval between frames is kept at least this multiple of the smoothed send latency.
+LATENCY_FACTOR = 4.0
+LATENCY_SMOOTHING = 0.2
+
+_HASH_WIDTH, _HASH_HEIGHT = 9, 8
+
+
+def difference_hash(jpeg_bytes: bytes):
+    """
+    64-bit difference hash of a JPEG, or None if Pillow is unavailable or cannot decode it.
+
+    `Image.draft` lets the JPEG decoder scale down by up to 8x while decoding, so hashing a
+    640x480 frame only decodes an 80x60 grayscale image.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        image = Image.open(io.BytesIO(jpeg_bytes))
+        image.draft("L", (_HASH_WIDTH * 8, _HASH_HEIGHT * 8))
+        pixels = list(image.convert("L").resize((_HASH_WIDTH, _HASH_HEIGHT)).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(_HASH_HEIGHT):
+        for col in range(_HASH_WIDTH - 1):
+            left = pixels[row * _HASH_WIDTH + col]
+            right = pixels[row * _HASH_WIDTH + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+class VideoFrameGate:
+    """
+    Decides which camera frames are forwarded to Gemini.
+
+    A frame is dropped if it arrives sooner than the current frame interval, or if it is a
+    near-duplicate of the last forwarded frame (by difference hash, or by exact content hash when
+    the JPEG cannot be decoded). The frame interval starts at 1 / max_fps and stretches towards
+    1 / min_fps while sends to Gemini are slow.
+    """
+
+    def __init__(self, max_fps: float = VIDEO_MAX_FPS, min_fps: float = VIDEO_MIN_FPS,
+                 hash_distance: int = VIDEO_HASH_DISTANCE, refresh_seconds: float = VIDEO_REFRESH_SECONDS):
+        """
+        Args:
+            max_fps: Highest frame rate forwarded when the upstream is fast
+            min_fps: Lowest frame rate the latency adaptation may fall to
+            hash_distance: Maximum Hamming distance between hashes of duplicate frames
+            refresh_seconds: Seconds after which an unchanged frame is forwarded anyway
+        """
+        self.min_interval = 1.0 / max_fps
+        self.max_interval = 1.0 / min_fps
+        self.hash_distance = hash_distance
+        self.refresh_seconds = refresh_seconds
+        self.send_latency = 0.0
+        self._last_sent_at = None
+        self._last_hash = None
+        self._last_digest = None
+        self.sent = 0
+        self.dropped_rate = 0
+        self.dropped_duplicate = 0
+
+    @property
+    def interval(self) -> float:
+        """Current minimum number of seconds between forwarded frames."""
+        return min(self.max_interval, max(self.min_interval, self.send_latency * LATENCY_FACTOR))
+
+    def admit(self, jpeg_bytes: bytes, now: float = None) -> bool:
+        """
+        Whether a frame should be forwarded; updates the gate's state if it is.
+
+        Args:
+            jpeg_bytes: The encoded frame
+            now: Monotonic time of arrival; defaults to now
+        """
+        now = time.monotonic() if now is None else now
+        since_last = None if self._last_sent_at is None else now - self._last_sent_at
+        if since_last is not None and since_last < self.interval:
+            self.dropped_rate += 1
+            MEDIA_DROPPED_TOTAL.inc(reason="video_rate")
+            return False
+
+        # Cheap rate check first, so only frames that could be sent are hashed.
+        frame_hash = difference_hash(jpeg_bytes)
+        digest = hashlib.blake2b(jpeg_bytes, digest_size=16).digest() if frame_hash is None else None
+        stale = since_last is None or since_last >= self.refresh_seconds
+        if not stale and self._is_duplicate(frame_hash, digest):
+            self.dropped_duplicate += 1
+            MEDIA_DROPPED_TOTAL.inc(reason="video_duplicate")
+            return False
+
+        self._last_sent_at = now
+        self._last_hash = frame_hash
+        self._last_digest = digest
+        self.sent += 1
+        return True
+
+    def record_send_latency(self, seconds: float) -> None:
+        """Feed back how long forwarding a frame to Gemini took."""
+        self.send_latency += LATENCY_SMOOTHING * (seconds - self.send_latency)
+
+    def _is_duplicate(self, frame_hash, digest) -> bool:
+        if frame_hash is not None and self._last_hash is not None:
+            return bin(frame_hash ^ self._last_hash).count("1") <= self.hash_distance
+        return digest is not None and digest == self._last_digest
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "dropped_rate": self.dropped_rate,
+            "dropped_duplicate": self.dropped_duplicate,
+            "interval": round(self.interval, 3),
+        }
@@ -0,0 +1,258 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import List, Tuple
+
+from google.api_core.exceptions import AlreadyExists, BadRequest, NotFound, PermissionDenied
+from google.cloud.firestore_v1.transforms import Increment
+
+from live_logging import log_sampled
+from metrics import FIRESTORE_WAL_DEAD_LETTERS, FIRESTORE_WAL_PENDING
+from write_pipeline import CREATE
+
+logger = logging.getLogger("firebase_config")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    writes TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    writes TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+# Errors retrying cannot fix: invalid data (InvalidArgument, FailedPrecondition, ...), missing
+# permissions, or a group that cannot be rebuilt from the log.
+_PERMANENT_ERRORS = (BadRequest, PermissionDenied, NotFound, ValueError, TypeError)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, Increment):
+        return {"$increment": value.value}
+    raise TypeError(f"Cannot store {type(value).__name__} in the write-ahead log")
+
+
+def _decode_value(obj: dict):
+    if set(obj) == {"$datetime"}:
+        return datetime.fromisoformat(obj["$datetime"])
+    if set(obj) == {"$increment"}:
+        return Increment(obj["$increment"])
+    return obj
+
+
+class WriteAheadLog:
+    """
+    Durable local queue of Firestore write groups, kept in SQLite.
+
+    `append` returns once a group is on local disk, so callers wait for the disk rather than the
+    network. A replayer thread hands pending groups to the BatchWriter, which commits them in
+    batches, and deletes each group once it has committed. Failed groups stay in the log and are
+    retried with exponential backoff, including after a restart, until Firestore accepts them.
+    Groups Firestore rejects for good (see `_PERMANENT_ERRORS`), or that still fail after
+    `max_attempts`, are moved to the `dead_letters` table and their waiters fail.
+
+    One process owns a log file: it is opened in SQLite's exclusive locking mode, so a second
+    process (e.g. another server worker) cannot open it and replay the same groups.
+
+    Replays are idempotent: document IDs are assigned client-side before the group is logged, and
+    the group's first write creates its document. A group that committed but was not yet removed
+    from the log fails with AlreadyExists on replay and is treated as done, so the rest of the
+    group is never applied twice.
+    """
+
+    def __init__(self, path: str, db, writer, max_in_flight: int = 500,
+                 retry_backoff: float = 0.5, max_backoff: float = 60.0, max_attempts: int = 50):
+        """
+        Args:
+            path: SQLite database file
+            db: Firestore client, used to rebuild document references
+            writer: BatchWriter that commits replayed groups
+            max_in_flight: Groups handed to the writer at a time
+            retry_backoff: Seconds before the first retry of a failed group, doubled per attempt
+            max_backoff: Upper bound of the retry delay
+            max_attempts: Failed attempts after which a group is moved to the dead letters
+        """
+        self.path = path
+        self.db = db
+        self.writer = writer
+        self.max_in_flight = max_in_flight
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self._conn = sqlite3.connect(path, timeout=1.0, check_same_thread=False, isolation_level=None)
+        try:
+            self._conn.execute("PRAGMA locking_mode=EXCLUSIVE")
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=FULL")
+            # Take the lock now rather than on the first write, and keep it until close
+            self._conn.execute("BEGIN EXCLUSIVE")
+            self._conn.execute("COMMIT")
+            self._conn.executescript(_SCHEMA)
+        except sqlite3.Error:
+            self._conn.close()
+            raise
+        # Groups left over from an earlier run are replayed first
+        FIRESTORE_WAL_PENDING.inc(self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0])
+        self._in_flight = set()
+        self._waiters = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="firestore-wal-replayer", daemon=True)
+        self._thread.start()
+
+    def append(self, kind: str, writes: List[Tuple]) -> Future:
+        """
+        Durably log a write group for delivery to Firestore.
+
+        Args:
+            kind: Record type, for logs
+            writes: List of (document_reference, data, merge) tuples; the first creates its document
+
+        Returns:
+            Future resolving to the first document's ID once the group has committed in Firestore
+        """
+        payload = json.dumps([[ref.path, data, merge] for ref, data, merge in writes], default=_encode_value)
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("WriteAheadLog is closed")
+            cursor = self._conn.execute(
+                "INSERT INTO pending_writes (kind, writes, created_at) VALUES (?, ?, ?)",
+                (kind, payload, time.time()),
+            )
+            self._waiters[cursor.lastrowid] = future
+            FIRESTORE_WAL_PENDING.inc()
+            self._condition.notify()
+        return future
+
+    def pending(self) -> int:
+        """Number of groups not yet committed to Firestore."""
+        with self._condition:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+    def close(self, timeout: float = None):
+        """Stop replaying and wait for groups already handed to the writer; the rest stays on disk."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            FIRESTORE_WAL_PENDING.dec(self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0])
+            self._conn.close()
+            self._conn = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._closed:
+                    return
+                rows, wait = self._due()
+                if not rows:
+                    self._condition.wait(wait)
+                    continue
+                self._in_flight.update(row[0] for row in rows)
+            for entry_id, kind, payload in rows:
+                self._replay(entry_id, kind, payload)
+
+    def _due(self):
+        """Pending groups whose retry time has come, and how long to wait if there are none."""
+        capacity = self.max_in_flight - len(self._in_flight)
+        if capacity <= 0:
+            return [], None
+        now = time.time()
+        placeholders = ",".join("?" * len(self._in_flight))
+        excluded = f"AND id NOT IN ({placeholders})" if self._in_flight else ""
+        rows = self._conn.execute(
+            f"SELECT id, kind, writes FROM pending_writes WHERE next_attempt_at <= ? {excluded} ORDER BY id LIMIT ?",
+            (now, *self._in_flight, capacity),
+        ).fetchall()
+        if rows:
+            return rows, None
+        next_due = self._conn.execute(
+            f"SELECT MIN(next_attempt_at) FROM pending_writes WHERE 1 {excluded}", tuple(self._in_flight)
+        ).fetchone()[0]
+        return [], None if next_due is None else max(0.0, next_due - now)
+
+    def _replay(self, entry_id: int, kind: str, payload: str):
+        try:
+            writes = [
+                (self.db.document(path), data, CREATE if index == 0 else merge)
+                for index, (path, data, merge) in enumerate(json.loads(payload, object_hook=_decode_value))
+            ]
+            future = self.writer.submit(writes)
+        except Exception as e:
+            self._finish(entry_id, kind, None, e)
+            return
+        future.add_done_callback(lambda future: self._finish(entry_id, kind, writes[0][0].id, future.exception()))
+
+    def _finish(self, entry_id: int, kind: str, document_id, error):
+        with self._condition:
+            self._in_flight.discard(entry_id)
+            if self._conn is None:
+                # Closed while this group was committing; it is replayed on the next start
+                return
+            if error is None or isinstance(error, AlreadyExists):
+                self._conn.execute("DELETE FROM pending_writes WHERE id = ?", (entry_id,))
+                FIRESTORE_WAL_PENDING.dec()
+                waiter = self._waiters.pop(entry_id, None)
+                if waiter is not None:
+                    waiter.set_result(document_id)
+            else:
+                attempts = self._conn.execute(
+                    "SELECT attempts FROM pending_writes WHERE id = ?", (entry_id,)
+                ).fetchone()[0] + 1
+                if isinstance(error, _PERMANENT_ERRORS) or attempts >= self.max_attempts:
+                    self._dead_letter(entry_id, kind, attempts, error)
+                else:
+                    delay = min(self.max_backoff, self.retry_backoff * 2 ** (attempts - 1))
+                    self._conn.execute(
+                        "UPDATE pending_writes SET attempts = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                        (attempts, str(error), time.time() + delay, entry_id),
+                    )
+                    # During an outage every pending group fails; keep that to a line a second
+                    log_sampled(logger, logging.WARNING, "wal_retry",
+                                "%s write failed (attempt %s), retrying from the write-ahead log in %.1fs: %s",
+                                kind, attempts, delay, error)
+            self._condition.notify_all()
+
+    def _dead_letter(self, entry_id: int, kind: str, attempts: int, error: Exception):
+        """Move a group that will not commit out of the pending writes and fail its waiter (lock held)."""
+        self._conn.execute("BEGIN")
+        self._conn.execute(
+            "INSERT INTO dead_letters (id, kind, writes, created_at, attempts, last_error, failed_at) "
+            "SELECT id, kind, writes, created_at, ?, ?, ? FROM pending_writes WHERE id = ?",
+            (attempts, str(error), time.time(), entry_id),
+        )
+        self._conn.execute("DELETE FROM pending_writes WHERE id = ?", (entry_id,))
+        self._conn.execute("COMMIT")
+        FIRESTORE_WAL_PENDING.dec()
+        FIRESTORE_WAL_DEAD_LETTERS.inc(kind=kind)
+        logger.error("%s write failed (attempt %s), moved to the write-ahead log's dead letters: %s",
+                     kind, attempts, error)
+        waiter = self._waiters.pop(entry_id, None)
+        if waiter is not None:
+            waiter.set_exception(error)
@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from google.api_core.exceptions import AlreadyExists, BadRequest, NotFound
+
+# Firestore rejects batches with more than 500 writes.
+MAX_BATCH_OPS = 500
+# `merge` value of a write that creates its document and fails (with its batch) if it already exists.
+CREATE = "create"
+# Errors caused by a particular write (invalid data, a document that already exists or is missing), on
+# which a batch is retried group by group. Anything else, e.g. UNAVAILABLE or DEADLINE_EXCEEDED, would
+# fail every group the same way and is reported to the whole batch for the caller to retry.
+RECORD_ERRORS = (BadRequest, AlreadyExists, NotFound, ValueError, TypeError)
+
+
+class BatchWriter:
+    """
+    Accumulates Firestore writes and commits them as WriteBatch commits.
+
+    Each `submit` call is a group of set() writes that must land together (e.g. a record and its
+    rollup increments); groups are packed into batches of up to `max_ops` writes and flushed when a
+    batch is full or the oldest pending group has waited `flush_interval` seconds. Every group gets
+    a Future that resolves to the document ID of its first write, or to the commit error. If a batch
+    is rejected because of a record (see RECORD_ERRORS), its groups are retried one per batch so a
+    single bad record does not fail its neighbours; transient errors fail the whole batch at once.
+    A group whose first write creates its document is not applied twice if a failed batch did land.
+    A group can be cancelled through its Future only while it is still queued; once taken into a
+    batch it is committed and its Future resolved.
+    """
+
+    def __init__(self, db, max_ops: int = MAX_BATCH_OPS, flush_interval: float = 0.02):
+        """
+        Args:
+            db: Firestore client
+            max_ops: Maximum writes per batch commit (at most 500)
+            flush_interval: Seconds a write may wait for more writes to share its batch
+        """
+        self.db = db
+        self.max_ops = min(max_ops, MAX_BATCH_OPS)
+        self.flush_interval = flush_interval
+        self._pending = deque()
+        self._pending_ops = 0
+        self._in_flight = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="firestore-batch-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, writes: List[Tuple]) -> Future:
+        """
+        Queue a group of writes that are committed atomically in the same batch.
+
+        Args:
+            writes: List of (document_reference, data, merge) tuples; merge=CREATE creates the document
+
+        Returns:
+            Future resolving to the first document's ID once the batch has committed
+        """
+        if not writes or len(writes) > self.max_ops:
+            raise ValueError(f"A write group must contain between 1 and {self.max_ops} writes")
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("BatchWriter is closed")
+            self._pending.append((time.monotonic(), writes, future))
+            self._pending_ops += len(writes)
+            self._condition.notify()
+        return future
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until everything submitted so far has been committed or failed."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify()
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def close(self, timeout: float = None):
+        """Flush outstanding writes and stop the background thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def _take_batch(self) -> list:
+        groups, ops = [], 0
+        while self._pending and ops + len(self._pending[0][1]) <= self.max_ops:
+            _, writes, future = self._pending.popleft()
+            self._pending_ops -= len(writes)
+            # Groups cancelled while queued are dropped; the rest can no longer be cancelled once taken
+            if future.set_running_or_notify_cancel():
+                groups.append((writes, future))
+                ops += len(writes)
+        return groups
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending and (self._closed or self._pending_ops >= self.max_ops):
+                        break
+                    if self._pending:
+                        wait = self._pending[0][0] + self.flush_interval - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    elif self._closed:
+                        return
+                    else:
+                        self._condition.wait()
+                groups = self._take_batch()
+                self._in_flight += len(groups)
+            try:
+                self._commit(groups)
+            finally:
+                with self._condition:
+                    self._in_flight -= len(groups)
+                    self._condition.notify_all()
+
+    def _commit(self, groups: list):
+        if not groups:
+            return
+        try:
+            self._commit_batch(groups)
+        except Exception as e:
+            if len(groups) == 1 or not isinstance(e, RECORD_ERRORS):
+                # A transient error is not retried here: the outcome of the commit is unknown, and
+                # callers resubmit with their own backoff
+                for _, future in groups:
+                    future.set_exception(e)
+                return
+            # Isolate the failing record(s) by committing each group on its own.
+            for group in groups:
+                try:
+                    self._commit_batch([group])
+                except AlreadyExists as group_error:
+                    # A resubmitted group whose earlier, ambiguously failed (e.g. deadline) commit did land
+                    if group[0][0][2] == CREATE:
+                        self._resolve([group])
+                    else:
+                        group[1].set_exception(group_error)
+                except Exception as group_error:
+                    group[1].set_exception(group_error)
+                else:
+                    self._resolve([group])
+            return
+        # Outside the try above: only a failed commit may send groups back for another attempt
+        self._resolve(groups)
+
+    @staticmethod
+    def _resolve(groups: list):
+        for writes, future in groups:
+            future.set_result(writes[0][0].id)
+
+    def _commit_batch(self, groups: list):
+        batch = self.db.batch()
+        for writes, _ in groups:
+            for ref, data, merge in writes:
+                if merge == CREATE:
+                    batch.create(ref, data)
+                else:
+                    batch.set(ref, data, merge=merge)
+        batch.commit()